@@ -1,3 +1,3 @@
-from . import chat, projects, knowledge
+from . import chat, projects, knowledge, debug
 
-__all__ = ["chat", "projects", "knowledge"]
+__all__ = ["chat", "projects", "knowledge", "debug"]
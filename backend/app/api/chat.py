@@ -1,47 +1,198 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.schemas import ChatRequest, ChatResponse
-from app.models.database import get_db
+from app.models.schemas import (
+    BatchChatRequest, BatchItemResult, ChatRequest, ChatResponse, WorkflowPhase, WorkflowRunResponse
+)
+from app.models.database import get_db, AsyncSessionLocal, Conversation, Message, Project, WorkflowRun
+from app.config import settings
 from app.services.conversation_service import ConversationService
-from app.core.langgraph_workflow import LangGraphWorkflow
+from app.services.checkpoint_service import CheckpointService, RunCheckpoints
+from app.services.job_queue import JobEventCallback, get_job_queue
+from app.core.langgraph_workflow import LangGraphWorkflow, phase_node, route_nodes
+from app.services.rag_service import RAGService
+from app.services.llm_service import LLMService
+from app.services.rate_limiter import RequestPriority
+from app.services.registry import get_llm_service, get_rag_service, get_workflow
 from app.core.workflow_engine import WorkflowEngine
 from app.core.code_modifier import CodeModifier
+from app.services.response_cache import get_response_cache
+from app.utils.tracing import span, traced
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
-# 全局实例 - 使用LangGraph
-langgraph_workflow = LangGraphWorkflow()
+# 全局实例（LangGraph工作流等共享服务通过 ServiceRegistry 注入）
 workflow_engine = WorkflowEngine()  # 保留用于prompt生成
 code_modifier = CodeModifier()
+# 所有批量请求共享的工作流并发上限
+batch_semaphore = asyncio.Semaphore(settings.WORKFLOW_BATCH_CONCURRENCY)
 
-@router.post("/message", response_model=ChatResponse)
-async def send_message(request: ChatRequest, db: AsyncSession = Depends(get_db)):
-    """发送消息并获取AI响应"""
+@traced("chat.prepare_conversation")
+async def _prepare_conversation(db: AsyncSession, request: ChatRequest) -> Tuple[int, int, List[dict]]:
+    """获取或创建对话、保存用户消息，返回 (conversation_id, 用户消息id, 对话历史)"""
     
-    try:
-        # 1. 获取或创建对话
-        conversation_id = request.conversation_id
-        if not conversation_id:
-            if not request.project_id:
-                raise HTTPException(status_code=400, detail="project_id is required for new conversation")
-            
-            conversation = await ConversationService.create_conversation(
-                db,
-                project_id=request.project_id,
-                title=request.message[:50]
-            )
-            conversation_id = conversation.id
+    # 1. 获取或创建对话
+    conversation_id = request.conversation_id
+    if not conversation_id:
+        if not request.project_id:
+            raise HTTPException(status_code=400, detail="project_id is required for new conversation")
         
-        # 2. 保存用户消息
-        await ConversationService.add_message(
+        conversation = await ConversationService.create_conversation(
+            db,
+            project_id=request.project_id,
+            title=request.message[:50]
+        )
+        conversation_id = conversation.id
+    
+    # 2. 保存用户消息
+    user_message = await ConversationService.add_message(
+        db,
+        conversation_id=conversation_id,
+        role="user",
+        content=request.message
+    )
+    
+    # 3. 获取对话历史（token预算内、当前用户消息之前的最近消息）
+    history = await ConversationService.get_history_window(db, conversation_id, before_id=user_message.id)
+    
+    return conversation_id, user_message.id, history
+
+
+async def _save_assistant_message(db: AsyncSession,
+                                  conversation_id: int,
+                                  workflow_result: Dict[str, Any],
+                                  run_id: int,
+                                  message_id: Optional[int] = None) -> ChatResponse:
+    """保存助手消息并构建响应（message_id 非空时原地更新该消息）"""
+    
+    assistant_content = workflow_result["content"]
+    code_modifications = workflow_result.get("code_modifications", [])
+    security_warnings = workflow_result.get("security_warnings", [])
+    meta_info = {
+        "workflow_state": workflow_result.get("workflow_state", {}),
+        "code_modifications": code_modifications,
+        "security_warnings": security_warnings,
+        "run_id": run_id,
+    }
+    
+    assistant_message = None
+    if message_id is not None:
+        assistant_message = await ConversationService.update_message(db, message_id, assistant_content, meta_info)
+    if assistant_message is None:
+        assistant_message = await ConversationService.add_message(
             db,
             conversation_id=conversation_id,
-            role="user",
-            content=request.message
+            role="assistant",
+            content=assistant_content,
+            meta_info=meta_info
         )
-        
-        # 3. 获取对话历史
-        history = await ConversationService.get_conversation_history(db, conversation_id)
+    # 刷新对象
+    await db.refresh(assistant_message)
+    
+    return _chat_response(assistant_message, run_id)
+
+
+async def _resolve_mode(db: AsyncSession, request: ChatRequest, conversation_id: int) -> str:
+    """工作流模式：请求指定 > 所属项目的设置 > WORKFLOW_DEFAULT_MODE"""
+    
+    if request.workflow_mode:
+        return request.workflow_mode.value
+    
+    project_id = request.project_id
+    if project_id is None:
+        conversation = await db.get(Conversation, conversation_id)
+        project_id = conversation.project_id if conversation else None
+    project = await db.get(Project, project_id) if project_id else None
+    if project is not None and project.workflow_mode:
+        return project.workflow_mode
+    return settings.WORKFLOW_DEFAULT_MODE
+
+
+def _chat_response(message: Message, run_id: int) -> ChatResponse:
+    """由已保存的助手消息构建响应"""
+    
+    meta_info = message.meta_info or {}
+    workflow_state_data = meta_info.get("workflow_state", {})
+    code_modifications = meta_info.get("code_modifications", [])
+    security_warnings = meta_info.get("security_warnings", [])
+    
+    return ChatResponse(
+        message_id=message.id,
+        content=message.content,
+        conversation_id=message.conversation_id,
+        workflow_state={
+            "current_phase": workflow_state_data.get("current_phase", ""),
+            "active_personas": workflow_state_data.get("active_personas", []),
+            "route": workflow_state_data.get("route"),
+            "phase_outputs": {},
+            "security_flags": security_warnings
+        } if workflow_state_data else None,
+        code_modifications=code_modifications if code_modifications else None,
+        suggestions=security_warnings if security_warnings else None,
+        run_id=run_id
+    )
+
+
+@traced("chat.complete_run")
+async def _complete_run(db: AsyncSession,
+                        run_id: int,
+                        conversation_id: int,
+                        workflow_result: Dict[str, Any],
+                        message_id: Optional[int] = None) -> ChatResponse:
+    """保存助手消息并记录运行结果（有阶段出错时运行标记为失败，可续跑）"""
+    
+    response = await _save_assistant_message(db, conversation_id, workflow_result, run_id, message_id)
+    phase_errors = workflow_result.get("phase_errors") or {}
+    await CheckpointService.finish_run(
+        db,
+        run_id,
+        error=json.dumps(phase_errors, ensure_ascii=False) if phase_errors else None,
+        assistant_message_id=response.message_id
+    )
+    return response
+
+
+async def _fail_run(db: AsyncSession, run_id: int, workflow_result: Dict[str, Any]) -> HTTPException:
+    """记录运行失败，返回带运行id的错误（客户端可据此续跑）"""
+    
+    error = workflow_result.get("error", "Workflow execution error")
+    await CheckpointService.finish_run(db, run_id, error=error)
+    return HTTPException(status_code=500, detail=error, headers={"X-Workflow-Run-Id": str(run_id)})
+
+
+async def _fail_if_running(run_id: int, error: str):
+    """运行中断（客户端断开或异常）时仍处于执行中的运行标记为失败，之后可通过 /runs/{run_id}/resume 续跑
+    
+    使用独立会话；调用方应以 asyncio.shield 包裹，避免在已取消的任务中被再次取消。
+    """
+    
+    async with AsyncSessionLocal() as session:
+        workflow_run = await CheckpointService.get_run(session, run_id)
+        if workflow_run is not None and workflow_run.status == "running":
+            await _fail_run(session, run_id, {"error": error})
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/message", response_model=ChatResponse)
+async def send_message(request: ChatRequest,
+                       db: AsyncSession = Depends(get_db),
+                       langgraph_workflow: LangGraphWorkflow = Depends(get_workflow),
+                       rag_service: RAGService = Depends(get_rag_service)):
+    """发送消息并获取AI响应"""
+    
+    try:
+        conversation_id, message_id, history = await _prepare_conversation(db, request)
+        mode = await _resolve_mode(db, request, conversation_id)
+        workflow_run = await CheckpointService.create_run(db, conversation_id, message_id, request.project_id, mode=mode)
         
         # 4. RAG检索（如果指定了上下文文件）
         context_docs = []
@@ -55,57 +206,433 @@ async def send_message(request: ChatRequest, db: AsyncSession = Depends(get_db))
         # 5. 构建系统提示词
         system_prompt = workflow_engine.build_system_prompt()
         
-        # 6. 使用LangGraph执行完整工作流
+        # 6. 使用LangGraph执行完整工作流（每个节点完成后保存检查点）
+        CheckpointService.acquire(workflow_run.id)
+        try:
+            workflow_result = await langgraph_workflow.run(
+                user_input=request.message,
+                system_prompt=system_prompt,
+                conversation_history=history,
+                project_id=request.project_id,
+                checkpoints=RunCheckpoints(workflow_run.id),
+                mode=mode
+            )
+        finally:
+            CheckpointService.release(workflow_run.id)
+        
+        if not workflow_result["success"]:
+            raise await _fail_run(db, workflow_run.id, workflow_result)
+        
+        # 7. 保存助手消息、记录运行结果并构建响应
+        response = await _complete_run(db, workflow_run.id, conversation_id, workflow_result)
+        
+        # 8. 后台滚动摘要（对话变长后把较早的轮次并入摘要）
+        ConversationService.schedule_compaction(conversation_id, langgraph_workflow.llm_service)
+        return response
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/message/stream")
+async def send_message_stream(request: ChatRequest,
+                              db: AsyncSession = Depends(get_db),
+                              langgraph_workflow: LangGraphWorkflow = Depends(get_workflow)):
+    """发送消息并以 SSE 流式返回各阶段的token
+    
+    事件类型:
+    - start: {"conversation_id", "run_id"}
+    - route: {"route"}  工作流路径（answer / lite / full / collapsed）
+    - phase: {"phase"}  进入新阶段
+    - token: {"phase", "content"}  阶段产生的token
+    - code_modification: {"phase", "modification"}  实现阶段生成过程中解析完成的代码修改块
+    - reused: {"node"}  节点复用了检查点中的输出
+    - done: ChatResponse  工作流完成且助手消息已保存
+    - error: {"detail", "run_id"}  可通过 /runs/{run_id}/resume 续跑
+    """
+    
+    conversation_id, message_id, history = await _prepare_conversation(db, request)
+    mode = await _resolve_mode(db, request, conversation_id)
+    workflow_run = await CheckpointService.create_run(db, conversation_id, message_id, request.project_id, mode=mode)
+    run_id = workflow_run.id
+    system_prompt = workflow_engine.build_system_prompt()
+    
+    async def event_stream():
+        yield _sse("start", {"conversation_id": conversation_id, "run_id": run_id})
+        
+        CheckpointService.acquire(run_id)
+        # 客户端断开时生成器在 await 处收到 CancelledError 或在 yield 处收到 GeneratorExit
+        error = "cancelled"
+        try:
+            async for event in langgraph_workflow.run_stream(
+                user_input=request.message,
+                system_prompt=system_prompt,
+                conversation_history=history,
+                project_id=request.project_id,
+                checkpoints=RunCheckpoints(run_id),
+                mode=mode
+            ):
+                if event["event"] != "result":
+                    yield _sse(event["event"], {k: v for k, v in event.items() if k != "event"})
+                    continue
+                
+                # 请求作用域的会话在流开始前可能已关闭，这里使用独立会话保存
+                workflow_result = event["result"]
+                if not workflow_result["success"]:
+                    async with AsyncSessionLocal() as session:
+                        error = await _fail_run(session, run_id, workflow_result)
+                    yield _sse("error", {"detail": error.detail, "run_id": run_id})
+                    return
+                
+                async with AsyncSessionLocal() as session:
+                    response = await _complete_run(session, run_id, conversation_id, workflow_result)
+                ConversationService.schedule_compaction(conversation_id, langgraph_workflow.llm_service)
+                yield _sse("done", response.model_dump(mode="json"))
+        except Exception as e:
+            error = str(e)
+            yield _sse("error", {"detail": error, "run_id": run_id})
+        finally:
+            try:
+                await asyncio.shield(_fail_if_running(run_id, error))
+            finally:
+                CheckpointService.release(run_id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _rerun(db: AsyncSession,
+                 langgraph_workflow: LangGraphWorkflow,
+                 run_id: int,
+                 from_nodes: Optional[Set[str]] = None,
+                 stream_callback: Optional[JobEventCallback] = None) -> ChatResponse:
+    """执行运行中的部分节点，其余节点复用检查点
+    
+    from_nodes 为空时续跑：执行没有检查点的节点（失败、未执行到的，或排队中的新运行的全部节点）。
+    被重新执行节点的所有下游节点同样失效；助手消息原地更新。
+    指定 from_nodes（重新生成）时不使用LLM响应缓存。
+    """
+    
+    workflow_run = await CheckpointService.get_run(db, run_id)
+    if workflow_run is None:
+        raise HTTPException(status_code=404, detail="Workflow run not found")
+    user_message = await db.get(Message, workflow_run.message_id)
+    if user_message is None:
+        raise HTTPException(status_code=404, detail="User message not found")
+    if not CheckpointService.acquire(run_id):
+        raise HTTPException(status_code=409, detail="Workflow run is already executing")
+    
+    try:
+        await CheckpointService.start_run(db, run_id)
+        outputs = await CheckpointService.load_outputs(db, run_id)
+        regenerate = from_nodes is not None
+        if from_nodes is None:
+            from_nodes = set(langgraph_workflow.nodes) - set(outputs)
+        stale = langgraph_workflow.downstream(from_nodes)
+        await CheckpointService.discard(db, run_id, stale & set(outputs))
+        cached = {node: output for node, output in outputs.items() if node not in stale}
+        
+        history = await ConversationService.get_history_before(db, workflow_run.conversation_id, user_message.id)
         workflow_result = await langgraph_workflow.run(
-            user_input=request.message,
-            system_prompt=system_prompt,
-            conversation_history=history[:-1],
-            project_id=request.project_id
+            user_input=user_message.content,
+            system_prompt=workflow_engine.build_system_prompt(),
+            conversation_history=history,
+            project_id=workflow_run.project_id,
+            stream_callback=stream_callback,
+            checkpoints=RunCheckpoints(run_id, cached),
+            mode=workflow_run.mode or "staged",
+            use_cache=not regenerate
         )
         
         if not workflow_result["success"]:
-            raise HTTPException(status_code=500, detail=workflow_result.get("error", "Workflow execution error"))
-        
-        assistant_content = workflow_result["content"]
-        code_modifications = workflow_result.get("code_modifications", [])
-        security_warnings = workflow_result.get("security_warnings", [])
+            raise await _fail_run(db, run_id, workflow_result)
         
-        # 7. 保存助手消息
-        assistant_message = await ConversationService.add_message(
+        return await _complete_run(
             db,
-            conversation_id=conversation_id,
-            role="assistant",
-            content=assistant_content,
-            meta_info={
-                "workflow_state": workflow_result.get("workflow_state", {}),
-                "code_modifications": code_modifications,
-                "security_warnings": security_warnings,
-            }
+            run_id,
+            workflow_run.conversation_id,
+            workflow_result,
+            message_id=workflow_run.assistant_message_id
         )
-        # 刷新对象
-        await db.refresh(assistant_message)
+    finally:
+        CheckpointService.release(run_id)
 
-        # 8. 构建响应
-        workflow_state_data = workflow_result.get("workflow_state", {})
+
+async def _run_batch_item(langgraph_workflow: LangGraphWorkflow,
+                          index: int,
+                          item: ChatRequest,
+                          conversation_lock: Optional[asyncio.Lock]) -> BatchItemResult:
+    """执行批量请求中的一个条目（错误只影响该条目）"""
+    
+    run_id = None
+    try:
+        # 同一对话的条目按顺序执行（等待时不占用并发名额）
+        async with conversation_lock or nullcontext(), batch_semaphore:
+            with span("chat.batch_item", index=index):
+                async with AsyncSessionLocal() as session:
+                    conversation_id, message_id, history = await _prepare_conversation(session, item)
+                    mode = await _resolve_mode(session, item, conversation_id)
+                    workflow_run = await CheckpointService.create_run(
+                        session, conversation_id, message_id, item.project_id, mode=mode
+                    )
+                    run_id = workflow_run.id
+                    
+                    CheckpointService.acquire(run_id)
+                    try:
+                        workflow_result = await langgraph_workflow.run(
+                            user_input=item.message,
+                            system_prompt=workflow_engine.build_system_prompt(),
+                            conversation_history=history,
+                            project_id=item.project_id,
+                            checkpoints=RunCheckpoints(run_id),
+                            priority=RequestPriority.BATCH,
+                            mode=mode
+                        )
+                    finally:
+                        CheckpointService.release(run_id)
+                    
+                    if not workflow_result["success"]:
+                        error = await _fail_run(session, run_id, workflow_result)
+                        return BatchItemResult(index=index, success=False, run_id=run_id, error=error.detail)
+                    
+                    response = await _complete_run(session, run_id, conversation_id, workflow_result)
         
-        return ChatResponse(
-            message_id=assistant_message.id,
-            content=assistant_content,
-            conversation_id=conversation_id,
-            workflow_state={
-                "current_phase": workflow_state_data.get("current_phase", ""),
-                "active_personas": workflow_state_data.get("active_personas", []),
-                "phase_outputs": {},
-                "security_flags": security_warnings
-            } if workflow_state_data else None,
-            code_modifications=code_modifications if code_modifications else None,
-            suggestions=security_warnings if security_warnings else None
+        ConversationService.schedule_compaction(conversation_id, langgraph_workflow.llm_service)
+        # 有阶段出错时仍返回已生成的内容，但条目计为失败
+        phase_errors = workflow_result.get("phase_errors") or {}
+        return BatchItemResult(
+            index=index,
+            success=not phase_errors,
+            run_id=run_id,
+            result=response,
+            error=json.dumps(phase_errors, ensure_ascii=False) if phase_errors else None
+        )
+    
+    except asyncio.CancelledError:
+        # 客户端断开：执行中的运行标记为失败
+        if run_id is not None:
+            await asyncio.shield(_fail_if_running(run_id, "cancelled"))
+        raise
+    except HTTPException as e:
+        return BatchItemResult(index=index, success=False, run_id=run_id, error=str(e.detail))
+    except Exception as e:
+        return BatchItemResult(index=index, success=False, run_id=run_id, error=str(e))
+
+
+@router.post("/batch")
+async def send_batch(request: BatchChatRequest,
+                     langgraph_workflow: LangGraphWorkflow = Depends(get_workflow)):
+    """批量执行工作流，以 NDJSON 流式返回结果
+    
+    每个条目按完成顺序返回一行 BatchItemResult（单个条目的错误不影响其他条目），最后一行为
+    {"summary": {"total", "succeeded", "failed"}}。所有批量请求共享 WORKFLOW_BATCH_CONCURRENCY 个并发名额，
+    LLM调用以最低优先级排队，配额紧张时优先保证交互请求；同一对话的条目按请求中的顺序依次执行。
+    """
+    
+    if len(request.items) > settings.WORKFLOW_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many items ({len(request.items)} > {settings.WORKFLOW_BATCH_MAX_ITEMS})"
+        )
+    
+    items = [
+        item if item.conversation_id or item.project_id else item.model_copy(update={"project_id": request.project_id})
+        for item in request.items
+    ]
+    locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+    
+    async def result_stream():
+        tasks = [
+            asyncio.ensure_future(_run_batch_item(
+                langgraph_workflow, index, item,
+                locks[item.conversation_id] if item.conversation_id else None
+            ))
+            for index, item in enumerate(items)
+        ]
+        succeeded = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                succeeded += result.success
+                yield result.model_dump_json() + "\n"
+            yield json.dumps({"summary": {
+                "total": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+            }}) + "\n"
+        finally:
+            # 客户端断开时取消尚未完成的条目
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def execute_job(langgraph_workflow: LangGraphWorkflow, run_id: int, emit: JobEventCallback):
+    """后台任务队列的执行函数：执行（或从检查点继续）一个排队的运行"""
+    
+    async with AsyncSessionLocal() as session:
+        try:
+            response = await _rerun(session, langgraph_workflow, run_id, stream_callback=emit)
+        except HTTPException:
+            # 失败已记录在运行上（或运行已被其他请求执行）
+            return
+        except Exception as e:
+            await CheckpointService.finish_run(session, run_id, error=str(e))
+            raise
+    ConversationService.schedule_compaction(response.conversation_id, langgraph_workflow.llm_service)
+
+
+async def _run_response(db: AsyncSession, workflow_run: WorkflowRun) -> WorkflowRunResponse:
+    """运行状态（已保存助手消息时附带结果）"""
+    
+    result = None
+    if workflow_run.assistant_message_id and workflow_run.status in ("completed", "failed"):
+        message = await db.get(Message, workflow_run.assistant_message_id)
+        if message is not None:
+            result = _chat_response(message, workflow_run.id)
+    
+    return WorkflowRunResponse(
+        run_id=workflow_run.id,
+        conversation_id=workflow_run.conversation_id,
+        status=workflow_run.status,
+        error=workflow_run.error,
+        result=result
+    )
+
+
+@router.post("/message/async", response_model=WorkflowRunResponse, status_code=202)
+async def send_message_async(request: ChatRequest, db: AsyncSession = Depends(get_db)):
+    """发送消息并立即返回运行id；工作流在后台任务队列中执行
+    
+    通过 GET /runs/{run_id} 轮询状态与结果，或 GET /runs/{run_id}/events 订阅进度。
+    """
+    
+    conversation_id, message_id, _ = await _prepare_conversation(db, request)
+    mode = await _resolve_mode(db, request, conversation_id)
+    workflow_run = await CheckpointService.create_run(
+        db, conversation_id, message_id, request.project_id, background=True, mode=mode
+    )
+    get_job_queue().enqueue(workflow_run.id)
+    return await _run_response(db, workflow_run)
+
+
+@router.get("/runs/{run_id}", response_model=WorkflowRunResponse)
+async def get_run(run_id: int, db: AsyncSession = Depends(get_db)):
+    """获取运行状态与结果"""
+    
+    workflow_run = await CheckpointService.get_run(db, run_id)
+    if workflow_run is None:
+        raise HTTPException(status_code=404, detail="Workflow run not found")
+    return await _run_response(db, workflow_run)
+
+
+@router.get("/runs/{run_id}/events")
+async def subscribe_run(run_id: int):
+    """以 SSE 订阅后台运行的进度
+    
+    事件类型:
+    - status: WorkflowRunResponse  订阅时的状态
+    - route / phase / token / code_modification / reused: 同 /message/stream
+    - done: WorkflowRunResponse  运行结束（completed 或 failed）
+    """
+    
+    job_queue = get_job_queue()
+    events = job_queue.subscribe(run_id)
+    
+    async with AsyncSessionLocal() as session:
+        workflow_run = await CheckpointService.get_run(session, run_id)
+        if workflow_run is None:
+            job_queue.unsubscribe(run_id, events)
+            raise HTTPException(status_code=404, detail="Workflow run not found")
+        initial = await _run_response(session, workflow_run)
+    
+    async def event_stream():
+        try:
+            yield _sse("status", initial.model_dump(mode="json"))
+            if initial.status in ("completed", "failed"):
+                return
+            
+            while True:
+                event = await events.get()
+                if event["event"] != "finished":
+                    yield _sse(event["event"], {k: v for k, v in event.items() if k != "event"})
+                    continue
+                
+                async with AsyncSessionLocal() as session:
+                    workflow_run = await CheckpointService.get_run(session, run_id)
+                    final = await _run_response(session, workflow_run)
+                yield _sse("done", final.model_dump(mode="json"))
+                return
+        finally:
+            job_queue.unsubscribe(run_id, events)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/runs/{run_id}/resume", response_model=ChatResponse)
+async def resume_run(run_id: int,
+                     db: AsyncSession = Depends(get_db),
+                     langgraph_workflow: LangGraphWorkflow = Depends(get_workflow)):
+    """续跑失败的工作流：只重新执行失败/未完成的阶段及其下游，已完成的阶段复用检查点"""
+    
+    workflow_run = await CheckpointService.get_run(db, run_id)
+    if workflow_run is not None and workflow_run.status == "completed":
+        raise HTTPException(status_code=400, detail="Workflow run already completed, use regenerate instead")
+    
+    try:
+        return await _rerun(db, langgraph_workflow, run_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e), headers={"X-Workflow-Run-Id": str(run_id)})
+
+
+@router.post("/runs/{run_id}/regenerate", response_model=ChatResponse)
+async def regenerate_run(run_id: int,
+                         from_phase: WorkflowPhase,
+                         db: AsyncSession = Depends(get_db),
+                         langgraph_workflow: LangGraphWorkflow = Depends(get_workflow)):
+    """从指定阶段重新生成：该阶段及其下游重新执行，上游阶段复用检查点
+    
+    合并模式的运行中各分析阶段由同一次调用产生，从其中任一阶段重新生成都会重新执行整个调用。
+    不在运行所走路径上的阶段（例如直接回答的运行中的需求阶段）返回 400。
+    """
+    
+    workflow_run = await CheckpointService.get_run(db, run_id)
+    if workflow_run is None:
+        raise HTTPException(status_code=404, detail="Workflow run not found")
+    
+    # 运行所走的路径：需求阶段转入澄清时以其为准，否则取请求分类的结果
+    node = phase_node(from_phase, workflow_run.mode)
+    outputs = await CheckpointService.load_outputs(db, run_id)
+    route = ((outputs.get("requirement_understanding") or {}).get("route")
+             or (outputs.get("classify_request") or {}).get("route"))
+    if route and node not in route_nodes(route):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Phase '{from_phase.value}' is not on the '{route}' route of this run"
         )
     
+    try:
+        return await _rerun(db, langgraph_workflow, run_id, {node})
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e), headers={"X-Workflow-Run-Id": str(run_id)})
 
 
 @router.post("/apply-modifications")
@@ -121,3 +648,23 @@ async def apply_code_modifications(modifications: list[dict]):
         "success": all(r["success"] for r in results),
         "results": results
     }
+
+
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """获取LLM响应缓存命中统计"""
+    
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return {"enabled": False}
+    
+    return {"enabled": True, **get_response_cache().stats()}
+
+
+@router.get("/llm-metrics")
+async def get_llm_metrics(llm_service: LLMService = Depends(get_llm_service)):
+    """获取LLM调用指标（各阶段延迟分位数、超时、对冲，以及各部署的负载与熔断状态）"""
+    
+    return {
+        **llm_service.metrics.snapshot(),
+        "deployments": llm_service.deployments_snapshot(),
+    }
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException
+from app.utils.tracing import get_trace_store
+
+router = APIRouter(prefix="/api/debug", tags=["debug"])
+
+
+@router.get("/traces")
+async def list_traces(limit: int = 50):
+    """最近请求的 trace 概要（新的在前）"""
+    
+    return {"traces": get_trace_store().recent(limit)}
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """单个请求的 span 树（trace_id 见响应头 X-Trace-Id）"""
+    
+    trace = get_trace_store().get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_dict()
@@ -3,11 +3,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.database import get_db
 from app.services.vector_service import VectorService
 from app.services.rag_service import RAGService
+from app.services.embedding_cache import get_embedding_cache
+from app.services.registry import get_rag_service, get_vector_service
+from app.config import settings
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/knowledge", tags=["knowledge"])
-vector_service = VectorService()
-rag_service = RAGService()
 
 
 class SearchRequest(BaseModel):
@@ -17,7 +18,9 @@ class SearchRequest(BaseModel):
 
 
 @router.post("/search")
-async def search_knowledge(request: SearchRequest, db: AsyncSession = Depends(get_db)):
+async def search_knowledge(request: SearchRequest,
+                           db: AsyncSession = Depends(get_db),
+                           rag_service: RAGService = Depends(get_rag_service)):
     """搜索知识库"""
     
     results = await rag_service.retrieve_context(
@@ -33,8 +36,18 @@ async def search_knowledge(request: SearchRequest, db: AsyncSession = Depends(ge
 
 
 @router.get("/collection-info")
-async def get_collection_info():
+async def get_collection_info(vector_service: VectorService = Depends(get_vector_service)):
     """获取向量数据库信息"""
     
     info = vector_service.get_collection_info()
     return info
+
+
+@router.get("/embedding-cache-stats")
+async def get_embedding_cache_stats():
+    """获取嵌入缓存命中统计"""
+    
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return {"enabled": False}
+    
+    return {"enabled": True, **get_embedding_cache().stats()}
@@ -1,17 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.schemas import ProjectCreate, ProjectResponse, ConversationResponse, FileResponse
+from app.models.schemas import ProjectCreate, ProjectUpdate, ProjectResponse, ConversationResponse, FileResponse
 from app.models.database import get_db
 from app.services.conversation_service import ConversationService
 from app.services.rag_service import RAGService
 from app.services.vector_service import VectorService
+from app.services.registry import get_rag_service, get_vector_service
 from typing import List
 import os
 import aiofiles
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
-rag_service = RAGService()
-vector_service = VectorService()
 
 @router.post("/", response_model=ProjectResponse)
 async def create_project(project: ProjectCreate, db: AsyncSession = Depends(get_db)):
@@ -36,8 +35,19 @@ async def get_project(project_id: int, db: AsyncSession = Depends(get_db)):
     return project
 
 
+@router.patch("/{project_id}", response_model=ProjectResponse)
+async def update_project(project_id: int, project: ProjectUpdate, db: AsyncSession = Depends(get_db)):
+    """更新项目（描述、默认工作流模式）"""
+    updated = await ConversationService.update_project(db, project_id, project)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return updated
+
+
 @router.delete("/{project_id}")
-async def delete_project(project_id: int, db: AsyncSession = Depends(get_db)):
+async def delete_project(project_id: int,
+                         db: AsyncSession = Depends(get_db),
+                         vector_service: VectorService = Depends(get_vector_service)):
     """删除项目"""
     # 删除向量数据
     await vector_service.delete_by_project(project_id)
@@ -91,7 +101,8 @@ async def get_conversation(conversation_id: int, db: AsyncSession = Depends(get_
 async def upload_file(
     project_id: int,
     file: UploadFile = File(...),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    rag_service: RAGService = Depends(get_rag_service)
 ):
     """上传文件到项目"""
     
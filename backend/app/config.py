@@ -1,5 +1,6 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List, Optional
 import os
 import json
 from pathlib import Path
@@ -8,6 +9,23 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 ENV_FILE = BASE_DIR / ".env"
 
+class AzureDeployment(BaseModel):
+    """部署池中的一个 Azure OpenAI 部署（同一池中的部署必须提供相同的模型）"""
+    endpoint: str
+    deployment: str
+    api_key: Optional[str] = None      # 未设置时使用 AZURE_OPENAI_API_KEY
+    api_version: Optional[str] = None  # 未设置时使用 AZURE_OPENAI_API_VERSION
+    rpm: Optional[int] = None          # 该部署的配额，未设置时使用 CHAT_/EMBEDDING_ 默认值
+    tpm: Optional[int] = None
+    # 是否传入各阶段的 temperature/max_tokens，未设置时使用 AZURE_OPENAI_SAMPLING_PARAMS
+    sampling_params: Optional[bool] = None
+
+class PhaseModel(BaseModel):
+    """一个阶段使用的部署池与采样参数（未设置的参数使用调用方传入的默认值）"""
+    tier: Optional[str] = None         # AZURE_OPENAI_CHAT_TIERS 中的名称，未设置时使用默认聊天池
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
 class Settings(BaseSettings):
     # Azure OpenAI
     AZURE_OPENAI_ENDPOINT: str
@@ -15,6 +33,22 @@ class Settings(BaseSettings):
     AZURE_OPENAI_API_VERSION: str = "2024-02-15-preview"
     AZURE_OPENAI_DEPLOYMENT_NAME: str = "gpt-4"
     AZURE_OPENAI_EMBEDDING_DEPLOYMENT: str = "text-embedding-3-large"
+    # 是否向聊天部署传入各阶段的 temperature/max_tokens。推理模型（o 系列、gpt-5）不接受这些参数，
+    # 因此默认关闭；使用 gpt-4 / gpt-4o 等模型时可以开启
+    AZURE_OPENAI_SAMPLING_PARAMS: bool = False
+    # 流式调用时请求 stream_options.include_usage（需要 API 版本 2024-09-01-preview 及以上），
+    # 开启后流式阶段同样可以统计 cached_tokens
+    AZURE_OPENAI_STREAM_USAGE: bool = False
+    # 多部署负载均衡（JSON数组，元素字段见 AzureDeployment）；为空时只使用上面的单个部署
+    AZURE_OPENAI_CHAT_DEPLOYMENTS: List[AzureDeployment] = []
+    AZURE_OPENAI_EMBEDDING_DEPLOYMENTS: List[AzureDeployment] = []
+    # 部署选择策略：least_outstanding（进行中请求最少）| latency_weighted（按延迟加权随机）
+    LLM_ROUTING_STRATEGY: str = "least_outstanding"
+    # 分级模型：额外的聊天部署池（名称 -> 部署列表），例如把更快更便宜的模型配置为 {"fast": [...]}
+    AZURE_OPENAI_CHAT_TIERS: Dict[str, List[AzureDeployment]] = {}
+    # 各阶段（工作流阶段名，以及 summarize_file / summarize_conversation）使用的部署池与采样参数，
+    # 例如 {"requirement": {"tier": "fast"}, "implementation": {"max_tokens": 8000}}；未列出的阶段使用默认聊天池
+    LLM_PHASE_MODELS: Dict[str, PhaseModel] = {}
     
     # Qdrant
     QDRANT_COLLECTION_NAME: str = "meta_agent_knowledge"
@@ -23,6 +57,104 @@ class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///./data/sqlite/meta_agent.db"
     
+    # 对话历史窗口（每次LLM调用携带的历史token上限）
+    HISTORY_TOKEN_BUDGET: int = 16000
+    # 对话滚动摘要：摘要之后的原文超过 TRIGGER 时，后台把较早的消息并入摘要，只保留约 TAIL 个token的最近原文
+    HISTORY_SUMMARY_ENABLED: bool = True
+    HISTORY_SUMMARY_TRIGGER_TOKENS: int = 8000
+    HISTORY_SUMMARY_TAIL_TOKENS: int = 3000
+    HISTORY_SUMMARY_TARGET_TOKENS: int = 800
+    
+    # HTTP 连接池（每个上游一个，所有服务共享）
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 120.0
+    HTTP_CONNECT_TIMEOUT: float = 10.0
+    HTTP_READ_TIMEOUT: float = 600.0
+    
+    # 客户端限流（与 Azure 部署配额一致）
+    RATE_LIMIT_ENABLED: bool = True
+    CHAT_RPM_LIMIT: int = 480
+    CHAT_TPM_LIMIT: int = 80000
+    EMBEDDING_RPM_LIMIT: int = 2100
+    EMBEDDING_TPM_LIMIT: int = 350000
+    RATE_LIMIT_COMPLETION_ESTIMATE: int = 1000  # 排队时预估的输出token数
+    RATE_LIMIT_MAX_RETRIES: int = 5
+    
+    # 工作流快速路径：问答类请求单次调用直接回答，局部修改跳过架构设计与RAG规划
+    WORKFLOW_FAST_PATH_ENABLED: bool = True
+    # 需求阶段列出待澄清问题时跳过后续阶段，直接把问题交付给用户
+    WORKFLOW_CLARIFICATION_SHORT_CIRCUIT: bool = True
+    # 各阶段携带的对话历史：full（完整窗口）| digest（摘要 + 最近消息节选）| none（只用提示词中的前序阶段输出）
+    # 未列出的阶段使用 full
+    WORKFLOW_CONTEXT_POLICIES: Dict[str, str] = {
+        "requirement": "full",
+        "answer": "full",
+        "architecture": "digest",
+        "rag_planning": "none",
+        "implementation": "digest",
+        "security_review": "none",
+        "collapsed": "full",
+    }
+    WORKFLOW_CONTEXT_DIGEST_TOKENS: int = 1000
+    WORKFLOW_CONTEXT_DIGEST_MESSAGE_TOKENS: int = 300  # digest 中每条消息保留的token上限
+    # 默认工作流模式：staged（各阶段分别调用LLM）| collapsed（单次调用，按段落拆分）；可按项目或请求覆盖
+    WORKFLOW_DEFAULT_MODE: str = "staged"
+    # 后台任务队列（POST /api/chat/message/async）同时执行的工作流数
+    WORKFLOW_JOB_CONCURRENCY: int = 2
+    # 批量接口（POST /api/chat/batch）：所有批量请求共享的并发上限，以及单个请求的条目上限
+    WORKFLOW_BATCH_CONCURRENCY: int = 4
+    WORKFLOW_BATCH_MAX_ITEMS: int = 500
+    
+    # LLM 调用截止时间 / 对冲 / 熔断
+    LLM_TIMEOUT_SECONDS: float = 180.0
+    LLM_PHASE_TIMEOUTS: Dict[str, float] = {
+        "requirement": 90.0,
+        "architecture": 120.0,
+        "rag_planning": 90.0,
+        "implementation": 300.0,
+        "security_review": 120.0,
+        "answer": 90.0,
+        "collapsed": 300.0,
+    }
+    LLM_HEDGING_ENABLED: bool = False
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    LLM_CIRCUIT_RECOVERY_SECONDS: float = 30.0
+    
+    # LLM Response Cache（默认关闭：开启后相同的请求总是得到相同的回答）
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_PATH: str = "./data/cache/llm_responses.db"
+    RESPONSE_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    RESPONSE_CACHE_MAX_ENTRIES: int = 5000
+    RESPONSE_CACHE_SEMANTIC_ENABLED: bool = False
+    RESPONSE_CACHE_SEMANTIC_THRESHOLD: float = 0.97
+    
+    # Embedding Batching（单次请求上限与并发）
+    EMBEDDING_BATCH_MAX_ITEMS: int = 2048
+    EMBEDDING_BATCH_MAX_TOKENS: int = 300000
+    EMBEDDING_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 3
+    EMBEDDING_RETRY_BASE_DELAY: float = 0.5
+    
+    # Embedding Cache
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "./data/cache/embeddings.db"
+    EMBEDDING_CACHE_MAX_MB: int = 512
+    
+    # LLM/嵌入调用录制与回放（离线性能回归）：off | record（调用真实部署并录制）| replay（只回放录制的响应，不访问网络）
+    LLM_CASSETTE_MODE: str = "off"
+    LLM_CASSETTE_PATH: str = "./data/cassettes/llm.jsonl"
+    LLM_CASSETTE_LATENCY_SCALE: float = 0.0  # 回放时模拟的耗时 = 录制耗时 × 该倍数（0 为立即返回）
+    
+    # 请求追踪（每个 /api 请求一个 trace，开启 DEBUG_ENDPOINTS_ENABLED 后可在 /api/debug/traces 查看）
+    TRACING_ENABLED: bool = True
+    TRACING_EXPORT_PATH: str = "./data/traces/spans.jsonl"  # 每行一个 span；为空时不导出
+    TRACING_EXPORT_MAX_MB: int = 100
+    TRACING_MAX_TRACES: int = 200  # 内存中保留的最近 trace 数
+    # /api/debug 调试端点（trace 中包含请求路径与提示词统计，且没有鉴权，默认不注册）
+    DEBUG_ENDPOINTS_ENABLED: bool = False
+    
     # Security
     SECRET_KEY: str
     CORS_ORIGINS: List[str] = ["http://localhost:5173", "http://127.0.0.1:5173"]
@@ -37,6 +169,18 @@ class Settings(BaseSettings):
         case_sensitive = True
         extra = 'ignore'
         
+    def chat_deployments(self) -> List[AzureDeployment]:
+        """聊天部署池"""
+        return self.AZURE_OPENAI_CHAT_DEPLOYMENTS or [
+            AzureDeployment(endpoint=self.AZURE_OPENAI_ENDPOINT, deployment=self.AZURE_OPENAI_DEPLOYMENT_NAME)
+        ]
+    
+    def embedding_deployments(self) -> List[AzureDeployment]:
+        """嵌入部署池"""
+        return self.AZURE_OPENAI_EMBEDDING_DEPLOYMENTS or [
+            AzureDeployment(endpoint=self.AZURE_OPENAI_ENDPOINT, deployment=self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT)
+        ]
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # 解析 CORS_ORIGINS（如果是字符串）
@@ -61,4 +205,6 @@ settings = Settings()
 data_dir = BASE_DIR / "data"
 os.makedirs(data_dir / "qdrant", exist_ok=True)
 os.makedirs(data_dir / "sqlite", exist_ok=True)
-os.makedirs(data_dir / "uploads", exist_ok=True)
\ No newline at end of file
+os.makedirs(data_dir / "uploads", exist_ok=True)
+os.makedirs(data_dir / "cache", exist_ok=True)
+os.makedirs(data_dir / "traces", exist_ok=True)
\ No newline at end of file
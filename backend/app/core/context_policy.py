@@ -0,0 +1,57 @@
+"""阶段上下文策略：决定工作流各阶段携带多少对话历史"""
+from app.config import settings
+from app.utils.tokens import count_tokens_async, truncate_tokens_async
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+# 摘要中剩余预算低于该值时不再加入更早的消息
+DIGEST_MIN_MESSAGE_TOKENS = 32
+
+class ContextPolicy(str, Enum):
+    FULL = "full"      # 完整历史窗口
+    DIGEST = "digest"  # 滚动摘要 + 最近消息节选
+    NONE = "none"      # 不带历史，只依赖提示词中的前序阶段输出
+
+def phase_policy(phase: str) -> ContextPolicy:
+    """阶段的上下文策略（未配置的阶段使用完整历史）"""
+    return ContextPolicy(settings.WORKFLOW_CONTEXT_POLICIES.get(phase, ContextPolicy.FULL.value))
+
+async def _clip(entry: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+    token_count = entry.get("token_count")
+    if token_count is None:
+        token_count = await count_tokens_async(entry["content"])
+    if token_count <= max_tokens:
+        return {**entry, "token_count": token_count}
+    content = await truncate_tokens_async(entry["content"], max_tokens)
+    return {"role": entry["role"], "content": content + "\n[...]", "token_count": max_tokens}
+
+async def build_history_digest(history: Optional[List[Dict[str, Any]]],
+                               max_tokens: Optional[int] = None,
+                               message_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+    """构建对话历史摘要（格式同历史窗口，可直接作为 conversation_history）
+    
+    滚动摘要（如有）最多占一半预算；其余预算从最新消息往前填充，每条消息只保留开头部分。
+    助手消息以需求分析开头，截断后保留的正是每轮的要点。
+    """
+    if not history:
+        return []
+    
+    budget = max_tokens or settings.WORKFLOW_CONTEXT_DIGEST_TOKENS
+    per_message = message_tokens or settings.WORKFLOW_CONTEXT_DIGEST_MESSAGE_TOKENS
+    
+    summary = None
+    if history[0]["role"] == "summary":
+        summary = await _clip(history[0], budget // 2)
+        budget -= summary["token_count"]
+        history = history[1:]
+    
+    recent = []
+    for entry in reversed(history):
+        if budget < DIGEST_MIN_MESSAGE_TOKENS:
+            break
+        clipped = await _clip(entry, min(per_message, budget))
+        recent.append(clipped)
+        budget -= clipped["token_count"]
+    recent.reverse()
+    
+    return ([summary] if summary else []) + recent
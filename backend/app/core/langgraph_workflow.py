@@ -1,19 +1,188 @@
-from typing import TypedDict, List, Dict, Any, Optional, Annotated
-from langgraph.graph import StateGraph, END
+from typing import TypedDict, List, Dict, Any, Optional, Annotated, AsyncIterator, Awaitable, Callable, Iterable, Set, Tuple
+from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableConfig
 from app.services.llm_service import LLMService
 from app.services.rag_service import RAGService
+from app.services.checkpoint_service import RunCheckpoints
+from app.services.rate_limiter import RequestPriority
+from app.utils.tracing import span, traced
 from app.core.security_reviewer import SecurityReviewer
-from app.models.schemas import WorkflowPhase
-import operator
+from app.core.modification_parser import CodeModificationParser
+from app.core.response_sections import split_sections
+from app.core.prompt_layout import PromptLayout
+from app.core.request_classifier import classify_request, needs_clarification, strip_clarification_marker
+from app.core.context_policy import ContextPolicy, phase_policy, build_history_digest
+from app.models.schemas import WorkflowPhase, WorkflowRoute, WorkflowMode
+from app.config import settings
+import asyncio
+
+# 流式事件回调：接收 {"event": ..., ...} 字典
+StreamCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+# LLM输出文本的消费回调
+TokenCallback = Callable[[str], Awaitable[None]]
+
+# 各阶段的固定说明（不含任何插值，保证提示词前缀在各轮之间字节级一致；易变内容由 PromptLayout 追加在其后）
+PHASE_INSTRUCTIONS: Dict[WorkflowPhase, str] = {
+    WorkflowPhase.REQUIREMENT: """You are in the REQUIREMENT UNDERSTANDING phase.
+
+Active Personas: Documentation & PM, Architect
+
+Your task:
+1. Extract key points from the user's request
+2. Identify any unclear or missing requirements
+3. Output a structured understanding of the task
+
+Provide your analysis in this format:
+**Requirement Analysis:**
+[Your analysis here]
+
+**Clarification Needed:**
+[List the questions that block implementation, or write "None"]
+
+End your response with exactly one of these lines (no other text on the line):
+CLARIFICATION_REQUIRED: YES
+CLARIFICATION_REQUIRED: NO
+Use YES only if the request cannot be implemented without the user's answers.
+""",
+    WorkflowPhase.ARCHITECTURE: """You are in the ARCHITECTURE DESIGN phase.
+
+Active Personas: Architect, Backend Lead
+
+Your task (based on the requirement analysis below):
+1. Design system architecture and module division
+2. Define key data structures and interfaces
+3. Consider scalability and maintainability
+
+Provide your design.
+""",
+    WorkflowPhase.RAG_PLANNING: """You are in the RAG PLANNING phase.
+
+Your task (based on the architecture design and retrieved context below):
+1. Determine if additional file context is needed
+2. Specify embedding/chunking strategy if applicable
+
+Provide your plan.
+""",
+    WorkflowPhase.IMPLEMENTATION: """You are in the IMPLEMENTATION phase.
+
+Your task (based on the requirement analysis and architecture design below):
+1. Generate complete, runnable code
+2. Follow the Code Modification Protocol
+
+Provide your implementation with clear code blocks.
+""",
+    WorkflowPhase.SECURITY_REVIEW: """You are in the SECURITY REVIEW phase.
+
+Your task (for the implementation and automated scan below):
+1. Identify potential security vulnerabilities
+2. Provide remediation suggestions
+
+Provide your security review.
+""",
+    WorkflowPhase.ANSWER: """You are answering the user's question directly.
+
+Active Personas: Architect, Backend Lead
+
+Your task:
+1. Answer the question concisely and accurately, using the project context below when relevant
+2. Do not produce a full design or implementation unless explicitly asked
+3. If the question cannot be answered from the available context, say what is missing
+""",
+    WorkflowPhase.COLLAPSED: """You are running the whole development workflow in a single response.
+
+Active Personas: Documentation & PM, Architect, Backend Lead, Security Reviewer
+
+Your task (for the user input and project context below):
+1. Understand the requirement; state assumptions instead of asking clarification questions
+2. Design the architecture and key interfaces
+3. Generate complete, runnable code following the Code Modification Protocol
+4. Review the implementation for security vulnerabilities
+
+Structure your response with exactly these section headings, in this order:
+**Summary:** [Requirement analysis and assumptions]
+
+**Analysis:** [Architecture and module design]
+
+**Proposed Workflow:** [Implementation steps]
+
+**Implementation:** [Code modification blocks]
+
+**Security Review:** [Risks and remediation]
+""",
+}
+
+# 阶段 -> 产生该阶段输出的图节点（用于从指定阶段重新生成）
+PHASE_NODES: Dict[WorkflowPhase, str] = {
+    WorkflowPhase.REQUIREMENT: "requirement_understanding",
+    WorkflowPhase.ARCHITECTURE: "architecture_design",
+    WorkflowPhase.RAG_PLANNING: "rag_planning",
+    WorkflowPhase.IMPLEMENTATION: "implementation",
+    WorkflowPhase.SECURITY_REVIEW: "security_review",
+    WorkflowPhase.DELIVERY: "delivery",
+    WorkflowPhase.ANSWER: "direct_answer",
+    WorkflowPhase.COLLAPSED: "collapsed_workflow",
+}
+
+# 合并模式下由 collapsed_workflow 一次产出的阶段
+COLLAPSED_PHASES = (
+    WorkflowPhase.REQUIREMENT,
+    WorkflowPhase.ARCHITECTURE,
+    WorkflowPhase.RAG_PLANNING,
+    WorkflowPhase.IMPLEMENTATION,
+    WorkflowPhase.SECURITY_REVIEW,
+)
+
+def phase_node(phase: WorkflowPhase, mode: Optional[str] = None) -> str:
+    """产生该阶段输出的图节点（合并模式的运行中，各分析阶段都由 collapsed_workflow 产生）"""
+    if mode == WorkflowMode.COLLAPSED.value and phase in COLLAPSED_PHASES:
+        return "collapsed_workflow"
+    return PHASE_NODES[phase]
+
+# 各路径上执行的图节点（lite / full 执行全部分阶段节点）
+STAGED_NODES = {
+    "classify_request", "requirement_understanding", "retrieve_context", "architecture_design",
+    "rag_planning", "implementation", "security_review", "delivery",
+}
+ROUTE_NODES: Dict[str, Set[str]] = {
+    WorkflowRoute.ANSWER.value: {"classify_request", "direct_answer"},
+    WorkflowRoute.COLLAPSED.value: {"classify_request", "collapsed_workflow", "delivery"},
+    WorkflowRoute.CLARIFY.value: {"classify_request", "requirement_understanding", "retrieve_context", "delivery"},
+}
+
+def route_nodes(route: str) -> Set[str]:
+    """该路径上执行的图节点（不在路径上的节点不能作为重新生成的起点）"""
+    return ROUTE_NODES.get(route, STAGED_NODES)
+
+def _latest(current: Any, update: Any) -> Any:
+    """并行分支在同一步写入同一个键时取最后写入的值"""
+    return update
+
+def _merge(current: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """合并并行分支写入的字典"""
+    return {**(current or {}), **(update or {})}
+
+# 运行输入：只在 run() 中写入初始状态，节点不得返回（见 _checkpointed）
+INPUT_KEYS = frozenset({
+    "messages", "history_digest", "user_input", "system_prompt", "project_id", "mode",
+})
 
 class WorkflowState(TypedDict):
-    """工作流状态定义"""
-    messages: Annotated[List[Dict[str, str]], operator.add]
-    current_phase: str
+    """工作流状态定义
+    
+    节点只返回自己修改的键（增量更新）；并行分支可能同时写入的键需要声明 reducer。
+    输入键（INPUT_KEYS）不声明 reducer：对话历史若带追加型 reducer，节点返回完整状态时
+    历史会在每个节点之后重复追加。
+    """
+    messages: List[Dict[str, str]]
+    history_digest: List[Dict[str, Any]]  # 对话历史摘要（digest 策略的阶段使用）
+    current_phase: Annotated[str, _latest]
     user_input: str
     system_prompt: str
-    context_files: Optional[List[Dict[str, Any]]]
+    context_files: Optional[List[Dict[str, Any]]]  # RAG检索结果
+    retrieval_error: Optional[str]
     project_id: Optional[int]
+    mode: str  # WorkflowMode
+    route: str  # WorkflowRoute
     
     # 各阶段输出
     requirement_analysis: Optional[str]
@@ -26,238 +195,563 @@ class WorkflowState(TypedDict):
     # 元数据
     code_modifications: List[Dict[str, Any]]
     security_warnings: List[str]
-    active_personas: List[str]
+    active_personas: Annotated[List[str], _latest]
+    phase_errors: Annotated[Dict[str, str], _merge]  # 阶段 -> LLM调用错误（出错的节点不写检查点）
 
 class LangGraphWorkflow:
     """基于LangGraph的6阶段工作流"""
     
-    def __init__(self):
-        self.llm_service = LLMService()
-        self.rag_service = RAGService()
+    def __init__(self,
+                 llm_service: Optional[LLMService] = None,
+                 rag_service: Optional[RAGService] = None):
+        self.llm_service = llm_service or LLMService()
+        self.rag_service = rag_service or RAGService(llm_service=self.llm_service)
         self.graph = self._build_graph()
     
     def _build_graph(self) -> StateGraph:
-        """构建工作流图"""
+        """构建工作流图（DAG，无依赖的工作并行执行）
+        
+            START ─ classify_request ─┬─ direct_answer ─ END                                                        (answer)
+                                      ├─ collapsed_workflow ──────────────────────────────────────────────────────────┐  (collapsed)
+                                      ├─ requirement_understanding ─ architecture_design ─┬─ implementation ─ security_review ─┤
+                                      └─ retrieve_context ────────────────────────────────┴─ rag_planning ─────────────────────┴─ delivery ─ END
+        
+        - classify_request 启发式判断路径（不调用LLM），问答/寒暄直接由 direct_answer 单次调用回答
+        - collapsed 模式下除问答外的请求由 collapsed_workflow 单次调用完成，按段落标题拆分为各阶段输出
+        - lite 路径中架构设计、RAG检索与RAG规划节点直接跳过（不调用LLM），汇合关系保持不变
+        - 需求阶段列出待澄清问题时直接进入交付（clarify 路径）
+        - RAG检索（查询嵌入 + 向量搜索）只依赖用户输入，与需求理解/架构设计并行
+        - 实现阶段只依赖需求与架构，与RAG规划并行
+        - 实现阶段边生成边解析代码修改块，每个块完成后立即在线程池中做静态安全扫描
+        """
         
         workflow = StateGraph(WorkflowState)
         
-        # 添加节点
-        workflow.add_node("requirement_understanding", self.requirement_understanding)
-        workflow.add_node("architecture_design", self.architecture_design)
-        workflow.add_node("rag_planning", self.rag_planning)
-        workflow.add_node("implementation", self.implementation)
-        workflow.add_node("security_review", self.security_review_node)
-        workflow.add_node("delivery", self.delivery)
-        
-        # 定义边
-        workflow.set_entry_point("requirement_understanding")
-        workflow.add_edge("requirement_understanding", "architecture_design")
-        workflow.add_edge("architecture_design", "rag_planning")
-        workflow.add_edge("rag_planning", "implementation")
+        # 添加节点（运行带检查点时，已有检查点的节点直接复用输出）
+        nodes = {
+            "classify_request": self.classify_request,
+            "direct_answer": self.direct_answer,
+            "collapsed_workflow": self.collapsed_workflow,
+            "requirement_understanding": self.requirement_understanding,
+            "retrieve_context": self.retrieve_context,
+            "architecture_design": self.architecture_design,
+            "rag_planning": self.rag_planning,
+            "implementation": self.implementation,
+            "security_review": self.security_review_node,
+            "delivery": self.delivery,
+        }
+        for name, node in nodes.items():
+            workflow.add_node(name, self._checkpointed(name, node))
+        
+        # 定义边（列表形式的起点表示等待所有起点完成后再汇合）
+        workflow.add_edge(START, "classify_request")
+        workflow.add_conditional_edges(
+            "classify_request",
+            self._route_after_classify,
+            ["direct_answer", "collapsed_workflow", "requirement_understanding", "retrieve_context"]
+        )
+        workflow.add_edge("direct_answer", END)
+        workflow.add_edge("collapsed_workflow", "delivery")
+        workflow.add_conditional_edges(
+            "requirement_understanding",
+            self._route_after_requirement,
+            ["architecture_design", "delivery"]
+        )
+        workflow.add_edge(["architecture_design", "retrieve_context"], "rag_planning")
+        workflow.add_edge("architecture_design", "implementation")
         workflow.add_edge("implementation", "security_review")
-        workflow.add_edge("security_review", "delivery")
+        workflow.add_edge(["rag_planning", "security_review"], "delivery")
         workflow.add_edge("delivery", END)
         
         return workflow.compile()
     
-    async def requirement_understanding(self, state: WorkflowState) -> WorkflowState:
-        """阶段1: 需求理解"""
-        
-        prompt = f"""You are in the REQUIREMENT UNDERSTANDING phase.
-
-Active Personas: Documentation & PM, Architect
-
-Your task:
-1. Extract key points from the user's request
-2. Identify any unclear or missing requirements
-3. Output a structured understanding of the task
-
-User Input: {state['user_input']}
-
-Provide your analysis in this format:
-**Requirement Analysis:**
-[Your analysis here]
-
-**Clarification Needed:** (if any)
-[List questions or mark as "None"]
-"""
-        
-        response = await self.llm_service.generate_response(
+    @staticmethod
+    def _route_after_classify(state: WorkflowState) -> List[str]:
+        if state.get('route') == WorkflowRoute.ANSWER.value:
+            return ["direct_answer"]
+        if state.get('route') == WorkflowRoute.COLLAPSED.value:
+            return ["collapsed_workflow"]
+        return ["requirement_understanding", "retrieve_context"]
+    
+    @staticmethod
+    def _route_after_requirement(state: WorkflowState) -> str:
+        if state.get('route') == WorkflowRoute.CLARIFY.value:
+            return "delivery"
+        return "architecture_design"
+    
+    @staticmethod
+    def _is_lite(state: WorkflowState) -> bool:
+        return state.get('route') == WorkflowRoute.LITE.value
+    
+    @property
+    def nodes(self) -> List[str]:
+        """工作流的全部节点名"""
+        return [node for node in self.graph.get_graph().nodes if node not in (START, END)]
+    
+    def downstream(self, nodes: Iterable[str]) -> Set[str]:
+        """给定节点及其所有下游节点（这些节点的检查点在重新执行时失效）"""
+        edges = self.graph.get_graph().edges
+        result = set(nodes)
+        frontier = list(result)
+        while frontier:
+            node = frontier.pop()
+            for edge in edges:
+                if edge.source == node and edge.target != END and edge.target not in result:
+                    result.add(edge.target)
+                    frontier.append(edge.target)
+        return result
+    
+    @staticmethod
+    def _get_stream_callback(config: Optional[RunnableConfig]) -> Optional[StreamCallback]:
+        """从运行配置中取出流式回调（非流式运行时为 None）"""
+        if not config:
+            return None
+        return config.get("configurable", {}).get("stream_callback")
+    
+    @staticmethod
+    def _get_priority(config: Optional[RunnableConfig]) -> RequestPriority:
+        """从运行配置中取出LLM调用的限流优先级"""
+        if not config:
+            return RequestPriority.INTERACTIVE
+        return config.get("configurable", {}).get("priority", RequestPriority.INTERACTIVE)
+    
+    @staticmethod
+    def _get_use_cache(config: Optional[RunnableConfig]) -> bool:
+        """从运行配置中取出是否查询LLM响应缓存（重新生成时为 False）"""
+        if not config:
+            return True
+        return config.get("configurable", {}).get("use_cache", True)
+    
+    @staticmethod
+    def _get_checkpoints(config: Optional[RunnableConfig]) -> Optional[RunCheckpoints]:
+        """从运行配置中取出检查点（未启用时为 None）"""
+        if not config:
+            return None
+        return config.get("configurable", {}).get("checkpoints")
+    
+    def _checkpointed(self, name: str, node: Callable[..., Awaitable[Dict[str, Any]]]):
+        """包装节点：记录 span；有检查点时复用输出，否则执行节点并在成功后保存输出"""
+        
+        async def run_node(state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+            with span(f"workflow.{name}") as node_span:
+                checkpoints = self._get_checkpoints(config)
+                cached = checkpoints.get(name) if checkpoints is not None else None
+                node_span.set("reused", cached is not None)
+                if cached is not None:
+                    callback = self._get_stream_callback(config)
+                    if callback:
+                        await callback({"event": "reused", "node": name})
+                    return cached
+                
+                output = await node(state, config)
+                returned_inputs = INPUT_KEYS.intersection(output)
+                if returned_inputs:
+                    raise ValueError(f"Node {name} must not return input keys: {sorted(returned_inputs)}")
+                if output.get("route"):
+                    node_span.set("route", output["route"])
+                if output.get("phase_errors"):
+                    node_span.set("phase_errors", output["phase_errors"])
+                # 出错的节点不保存，续跑时重新执行
+                if (checkpoints is not None
+                        and not output.get("phase_errors") and not output.get("retrieval_error")):
+                    await checkpoints.save(name, output)
+                return output
+        
+        return run_node
+    
+    @staticmethod
+    def _phase_error(phase: WorkflowPhase, response: Dict[str, Any]) -> Dict[str, Any]:
+        """LLM调用失败时记录阶段错误（供续跑时定位失败的阶段）"""
+        if response['success']:
+            return {}
+        return {"phase_errors": {phase.value: response.get('error') or "Unknown error"}}
+    
+    @staticmethod
+    def _phase_history(state: WorkflowState, phase: WorkflowPhase) -> List[Dict[str, Any]]:
+        """按阶段的上下文策略选择携带的对话历史"""
+        policy = phase_policy(phase.value)
+        if policy == ContextPolicy.NONE:
+            return []
+        if policy == ContextPolicy.DIGEST:
+            return state.get('history_digest', [])
+        return state.get('messages', [])
+    
+    async def _call_llm(self,
+                        state: WorkflowState,
+                        config: Optional[RunnableConfig],
+                        phase: WorkflowPhase,
+                        prompt: str,
+                        temperature: Optional[float] = None,
+                        max_tokens: Optional[int] = None,
+                        on_text: Optional[TokenCallback] = None) -> Dict[str, Any]:
+        """调用LLM；流式运行时逐token转发并标记所属阶段
+        
+        temperature/max_tokens 为该阶段的默认采样参数，可被 LLM_PHASE_MODELS 覆盖。
+        on_text 消费输出文本：流式运行时逐token调用，非流式运行时以完整响应调用一次。
+        """
+        callback = self._get_stream_callback(config)
+        priority = self._get_priority(config)
+        use_cache = self._get_use_cache(config)
+        timeout = settings.LLM_PHASE_TIMEOUTS.get(phase.value)
+        history = self._phase_history(state, phase)
+        if callback is None:
+            response = await self.llm_service.generate_response(
+                system_prompt=state['system_prompt'],
+                user_message=prompt,
+                conversation_history=history,
+                priority=priority,
+                phase=phase.value,
+                timeout=timeout,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                use_cache=use_cache,
+                cache_query=state['user_input'],
+            )
+            if on_text and response['success']:
+                await on_text(response['content'])
+            return response
+        
+        await callback({"event": "phase", "phase": phase.value})
+        
+        async def on_token(token: str):
+            await callback({"event": "token", "phase": phase.value, "content": token})
+            if on_text:
+                await on_text(token)
+        
+        return await self.llm_service.stream_response(
             system_prompt=state['system_prompt'],
             user_message=prompt,
-            conversation_history=state.get('messages', []),
-            #temperature=0.5
+            conversation_history=history,
+            on_token=on_token,
+            priority=priority,
+            phase=phase.value,
+            timeout=timeout,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            use_cache=use_cache,
+            cache_query=state['user_input'],
         )
+    
+    async def classify_request(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """路由：判断请求走问答 / 局部修改 / 完整流程 / 合并模式"""
+        
+        route = WorkflowRoute.FULL
+        if settings.WORKFLOW_FAST_PATH_ENABLED:
+            route = classify_request(state['user_input'], state.get('messages'))
+        if state.get('mode') == WorkflowMode.COLLAPSED.value and route != WorkflowRoute.ANSWER:
+            route = WorkflowRoute.COLLAPSED
         
-        state['requirement_analysis'] = response['content'] if response['success'] else "Error in analysis"
-        state['current_phase'] = WorkflowPhase.REQUIREMENT.value
-        state['active_personas'] = ["documentation_pm", "architect"]
+        callback = self._get_stream_callback(config)
+        if callback:
+            await callback({"event": "route", "route": route.value})
         
-        return state
+        return {"route": route.value}
     
-    async def architecture_design(self, state: WorkflowState) -> WorkflowState:
-        """阶段2: 架构设计"""
+    async def direct_answer(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """快速路径：单次LLM调用直接回答"""
         
-        prompt = f"""You are in the ARCHITECTURE DESIGN phase.
-
-Active Personas: Architect, Backend Lead
-
-Based on the requirement analysis:
-{state.get('requirement_analysis', '')}
-
-Your task:
-1. Design system architecture and module division
-2. Define key data structures and interfaces
-3. Consider scalability and maintainability
-
-Provide your design.
-"""
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.ANSWER])
+                  .add("Project Context", await self._project_context(state))
+                  .add("Question", state['user_input'])
+                  .render())
         
-        response = await self.llm_service.generate_response(
-            system_prompt=state['system_prompt'],
-            user_message=prompt,
-            conversation_history=state.get('messages', []),
-            #temperature=0.6
+        response = await self._call_llm(state, config, WorkflowPhase.ANSWER, prompt)
+        
+        return {
+            "final_output": response['content'] if response['success'] else "Error in answer",
+            "current_phase": WorkflowPhase.ANSWER.value,
+            "active_personas": ["architect", "backend_lead"],
+            **self._phase_error(WorkflowPhase.ANSWER, response),
+        }
+    
+    async def _project_context(self, state: WorkflowState) -> str:
+        """单次调用的节点（问答 / 合并模式）直接检索项目上下文，返回检索到的片段文本"""
+        if not state.get('project_id'):
+            return ""
+        try:
+            results = await self.rag_service.retrieve_context(
+                query=state['user_input'],
+                project_id=state['project_id'],
+                top_k=5
+            )
+            return "\n\n".join(
+                f"### {result['metadata'].get('filename', '')}\n{result.get('text', '')}"
+                for result in results or []
+            )
+        except Exception as e:
+            return f"RAG Error: {str(e)}"
+    
+    async def collapsed_workflow(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """合并模式：单次LLM调用完成需求/架构/实现/安全审查，按段落标题拆分为各阶段输出
+        
+        代码修改块仍然边生成边解析并做静态安全扫描；回答中没有可识别的段落标题时整体作为实现输出。
+        """
+        
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.COLLAPSED])
+                  .add("Project Context", await self._project_context(state))
+                  .add("User Input", state['user_input'])
+                  .render())
+        
+        response, modifications, warnings = await self._generate_code(
+            state, config, WorkflowPhase.COLLAPSED, prompt,
+            temperature=0.5,
+            max_tokens=8000
+        )
+        
+        personas = ["documentation_pm", "architect", "backend_lead", "security_reviewer"]
+        if not response['success']:
+            return {
+                "implementation": "Error in collapsed workflow",
+                "code_modifications": [],
+                "security_warnings": [],
+                "current_phase": WorkflowPhase.COLLAPSED.value,
+                "active_personas": personas,
+                **self._phase_error(WorkflowPhase.COLLAPSED, response),
+            }
+        
+        sections = split_sections(response['content'])
+        design = "\n\n".join(
+            sections[title] for title in ("analysis", "proposed workflow") if sections.get(title)
         )
+        implementation = "\n\n".join(
+            sections[title] for title in ("implementation", "optional enhancements") if sections.get(title)
+        )
+        
+        return {
+            "requirement_analysis": sections.get("summary", ""),
+            "architecture_design": design or None,
+            "implementation": implementation or response['content'],
+            "security_review": sections.get("security review", ""),
+            "code_modifications": modifications,
+            "security_warnings": warnings,
+            "current_phase": WorkflowPhase.COLLAPSED.value,
+            "active_personas": personas,
+        }
+    
+    async def requirement_understanding(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """阶段1: 需求理解（列出待澄清问题时转入 clarify 路径）"""
+        
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.REQUIREMENT])
+                  .add("User Input", state['user_input'])
+                  .render())
         
-        state['architecture_design'] = response['content'] if response['success'] else "Error in design"
-        state['current_phase'] = WorkflowPhase.ARCHITECTURE.value
-        state['active_personas'] = ["architect", "backend_lead"]
+        response = await self._call_llm(
+            state, config, WorkflowPhase.REQUIREMENT, prompt,
+            temperature=0.5
+        )
         
-        return state
+        output = {
+            "requirement_analysis": (strip_clarification_marker(response['content'])
+                                     if response['success'] else "Error in analysis"),
+            "current_phase": WorkflowPhase.REQUIREMENT.value,
+            "active_personas": ["documentation_pm", "architect"],
+            **self._phase_error(WorkflowPhase.REQUIREMENT, response),
+        }
+        if (settings.WORKFLOW_CLARIFICATION_SHORT_CIRCUIT
+                and response['success'] and needs_clarification(response['content'])):
+            output["route"] = WorkflowRoute.CLARIFY.value
+        return output
     
-    async def rag_planning(self, state: WorkflowState) -> WorkflowState:
-        """阶段3: RAG规划"""
+    async def retrieve_context(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """RAG检索（与需求理解并行，结果供RAG规划阶段使用）"""
         
-        context_info = ""
-        if state.get('project_id'):
-            try:
-                results = await self.rag_service.retrieve_context(
-                    query=state['user_input'],
-                    project_id=state['project_id'],
-                    top_k=5
-                )
-                
-                if results:
-                    context_info = "\n\nRetrieved Context:\n"
-                    for idx, result in enumerate(results, 1):
-                        context_info += f"\n{idx}. {result['metadata']['filename']}\n"
-            except Exception as e:
-                context_info = f"\n\nRAG Error: {str(e)}"
+        if not state.get('project_id') or self._is_lite(state):
+            return {"context_files": None}
         
-        prompt = f"""You are in the RAG PLANNING phase.
-
-Architecture Design:
-{state.get('architecture_design', '')}
-
-{context_info}
-
-Your task:
-1. Determine if additional file context is needed
-2. Specify embedding/chunking strategy if applicable
-
-Provide your plan.
-"""
+        try:
+            results = await self.rag_service.retrieve_context(
+                query=state['user_input'],
+                project_id=state['project_id'],
+                top_k=5
+            )
+            return {"context_files": results}
+        except Exception as e:
+            return {"context_files": None, "retrieval_error": str(e)}
+    
+    async def architecture_design(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """阶段2: 架构设计（lite 路径跳过）"""
         
-        response = await self.llm_service.generate_response(
-            system_prompt=state['system_prompt'],
-            user_message=prompt,
-            conversation_history=state.get('messages', []),
-            #temperature=0.5
+        if self._is_lite(state):
+            return {}
+        
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.ARCHITECTURE])
+                  .add("Requirement Analysis", state.get('requirement_analysis', ''))
+                  .render())
+        
+        response = await self._call_llm(
+            state, config, WorkflowPhase.ARCHITECTURE, prompt,
+            temperature=0.6
         )
         
-        state['rag_plan'] = response['content'] if response['success'] else "Error in RAG planning"
-        state['current_phase'] = WorkflowPhase.RAG_PLANNING.value
-        state['active_personas'] = ["ai_rag_engineer", "architect"]
+        return {
+            "architecture_design": response['content'] if response['success'] else "Error in design",
+            "current_phase": WorkflowPhase.ARCHITECTURE.value,
+            "active_personas": ["architect", "backend_lead"],
+            **self._phase_error(WorkflowPhase.ARCHITECTURE, response),
+        }
+    
+    async def rag_planning(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """阶段3: RAG规划（检索已在 retrieve_context 分支中完成；lite 路径跳过）"""
+        
+        if self._is_lite(state):
+            return {}
+        
+        context_info = ""
+        if state.get('retrieval_error'):
+            context_info = f"RAG Error: {state['retrieval_error']}"
+        elif state.get('context_files'):
+            context_info = "\n".join(
+                f"{idx}. {result['metadata']['filename']}"
+                for idx, result in enumerate(state['context_files'], 1)
+            )
+        
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.RAG_PLANNING])
+                  .add("Architecture Design", state.get('architecture_design', ''))
+                  .add("Retrieved Context", context_info)
+                  .render())
+        
+        response = await self._call_llm(
+            state, config, WorkflowPhase.RAG_PLANNING, prompt,
+            temperature=0.5
+        )
         
-        return state
+        return {
+            "rag_plan": response['content'] if response['success'] else "Error in RAG planning",
+            "current_phase": WorkflowPhase.RAG_PLANNING.value,
+            "active_personas": ["ai_rag_engineer", "architect"],
+            **self._phase_error(WorkflowPhase.RAG_PLANNING, response),
+        }
     
-    async def implementation(self, state: WorkflowState) -> WorkflowState:
+    async def implementation(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
         """阶段4: 实现"""
         
-        prompt = f"""You are in the IMPLEMENTATION phase.
-
-Previous phases summary:
-- Requirement: {state.get('requirement_analysis', '')[:200]}
-- Architecture: {state.get('architecture_design', '')[:200]}
-
-Your task:
-1. Generate complete, runnable code
-2. Follow the Code Modification Protocol
-
-Provide your implementation with clear code blocks.
-"""
+        # 不再携带完整对话历史，前序阶段的输出完整传入
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.IMPLEMENTATION])
+                  .add("Requirement Analysis", state.get('requirement_analysis') or '')
+                  .add("Architecture Design", state.get('architecture_design') or 'Skipped (lite route)')
+                  .render())
         
-        response = await self.llm_service.generate_response(
-            system_prompt=state['system_prompt'],
-            user_message=prompt,
-            conversation_history=state.get('messages', []),
-            #temperature=0.7,
-            #max_tokens=4000
+        response, modifications, warnings = await self._generate_code(
+            state, config, WorkflowPhase.IMPLEMENTATION, prompt,
+            temperature=0.7,
+            max_tokens=4000
         )
         
-        state['implementation'] = response['content'] if response['success'] else "Error in implementation"
-        state['current_phase'] = WorkflowPhase.IMPLEMENTATION.value
-        state['active_personas'] = ["backend_lead", "frontend_engineer"]
+        if not response['success']:
+            return {
+                "implementation": "Error in implementation",
+                "code_modifications": [],
+                "security_warnings": [],
+                "current_phase": WorkflowPhase.IMPLEMENTATION.value,
+                "active_personas": ["backend_lead", "frontend_engineer"],
+                **self._phase_error(WorkflowPhase.IMPLEMENTATION, response),
+            }
         
-        # 解析代码修改
-        from app.core.workflow_engine import WorkflowEngine
-        engine = WorkflowEngine()
-        modifications = engine.parse_code_modifications(state['implementation'])
-        state['code_modifications'] = modifications
+        return {
+            "implementation": response['content'],
+            "code_modifications": modifications,
+            "security_warnings": warnings,
+            "current_phase": WorkflowPhase.IMPLEMENTATION.value,
+            "active_personas": ["backend_lead", "frontend_engineer"],
+        }
+    
+    async def _generate_code(self,
+                             state: WorkflowState,
+                             config: Optional[RunnableConfig],
+                             phase: WorkflowPhase,
+                             prompt: str,
+                             temperature: Optional[float] = None,
+                             max_tokens: Optional[int] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[str]]:
+        """调用LLM生成代码，返回 (LLM响应, 代码修改块, 静态扫描警告)
+        
+        边生成边解析代码修改块：每个块完成后立即推送预览，并在线程池中做静态安全扫描（与生成并行）。
+        """
+        callback = self._get_stream_callback(config)
+        parser = CodeModificationParser()
+        scans: List[asyncio.Future] = []
+        
+        async def on_modifications(modifications: List[Dict[str, Any]]):
+            for modification in modifications:
+                scans.append(asyncio.ensure_future(asyncio.to_thread(self._scan_modification, modification)))
+                if callback:
+                    await callback({
+                        "event": "code_modification",
+                        "phase": phase.value,
+                        "modification": modification,
+                    })
+        
+        async def on_text(text: str):
+            await on_modifications(parser.feed(text))
+        
+        response = await self._call_llm(
+            state, config, phase, prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            on_text=on_text
+        )
+        if response['success']:
+            await on_modifications(parser.close())
+        reports = await asyncio.gather(*scans)
         
-        return state
+        return response, parser.modifications, [report for report in reports if report]
+    
+    @staticmethod
+    def _scan_modification(modification: Dict[str, Any]) -> Optional[str]:
+        """静态安全扫描一个代码修改块（不调用LLM），无问题时返回 None"""
+        issues = SecurityReviewer.review_code(modification.get('content', ''))
+        if not issues:
+            return None
+        report = SecurityReviewer.generate_security_report(issues)
+        return f"File: {modification['file_path']}\n{report}"
     
-    async def security_review_node(self, state: WorkflowState) -> WorkflowState:
+    async def security_review_node(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
         """阶段5: 安全审查"""
         
-        security_issues = []
-        for mod in state.get('code_modifications', []):
-            issues = SecurityReviewer.review_code(mod.get('content', ''))
-            if issues:
-                report = SecurityReviewer.generate_security_report(issues)
-                security_issues.append(f"File: {mod['file_path']}\n{report}")
-        
-        prompt = f"""You are in the SECURITY REVIEW phase.
-
-Implementation to review:
-{state.get('implementation', '')[:1000]}
-
-Automated Security Scan:
-{chr(10).join(security_issues) if security_issues else "No issues detected"}
-
-Your task:
-1. Identify potential security vulnerabilities
-2. Provide remediation suggestions
+        security_issues = state.get('security_warnings', [])
 
-Provide your security review.
-"""
-        
-        response = await self.llm_service.generate_response(
-            system_prompt=state['system_prompt'],
-            user_message=prompt,
-            conversation_history=state.get('messages', []),
-            #temperature=0.3
+        prompt = (PromptLayout(PHASE_INSTRUCTIONS[WorkflowPhase.SECURITY_REVIEW])
+                  .add("Implementation to Review", state.get('implementation', '')[:1000])
+                  .add("Automated Security Scan",
+                       chr(10).join(security_issues) if security_issues else "No issues detected")
+                  .render())
+        
+        response = await self._call_llm(
+            state, config, WorkflowPhase.SECURITY_REVIEW, prompt,
+            temperature=0.3
         )
         
-        state['security_review'] = response['content'] if response['success'] else "Error in security review"
-        state['current_phase'] = WorkflowPhase.SECURITY_REVIEW.value
-        state['active_personas'] = ["security_reviewer"]
-        state['security_warnings'] = security_issues
-        
-        return state
+        return {
+            "security_review": response['content'] if response['success'] else "Error in security review",
+            "current_phase": WorkflowPhase.SECURITY_REVIEW.value,
+            "active_personas": ["security_reviewer"],
+            **self._phase_error(WorkflowPhase.SECURITY_REVIEW, response),
+        }
     
-    async def delivery(self, state: WorkflowState) -> WorkflowState:
+    async def delivery(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
         """阶段6: 交付"""
         
-        final_output = f"""# Meta-Agent Development Result
+        if state.get('route') == WorkflowRoute.CLARIFY.value:
+            final_output = f"""# Meta-Agent Development Result
 
 ## Summary
 {state.get('requirement_analysis', '')}
 
+## Next Steps
+1. Answer the clarification questions above
+2. Resend the request with the missing details
+"""
+        else:
+            architecture = ""
+            if state.get('architecture_design'):
+                architecture = f"""
 ## Architecture Design
-{state.get('architecture_design', '')}
+{state['architecture_design']}
+"""
+            final_output = f"""# Meta-Agent Development Result
 
+## Summary
+{state.get('requirement_analysis', '')}
+{architecture}
 ## Implementation
 {state.get('implementation', '')}
 
@@ -270,26 +764,46 @@ Provide your security review.
 3. Test the implementation
 """
         
-        state['final_output'] = final_output
-        state['current_phase'] = WorkflowPhase.DELIVERY.value
-        state['active_personas'] = ["documentation_pm"]
+        callback = self._get_stream_callback(config)
+        if callback:
+            await callback({"event": "phase", "phase": WorkflowPhase.DELIVERY.value})
         
-        return state
+        return {
+            "final_output": final_output,
+            "current_phase": WorkflowPhase.DELIVERY.value,
+            "active_personas": ["documentation_pm"],
+        }
     
+    @traced("workflow.run")
     async def run(self, 
                   user_input: str,
                   system_prompt: str,
                   conversation_history: Optional[List[Dict[str, str]]] = None,
-                  project_id: Optional[int] = None) -> Dict[str, Any]:
-        """运行完整工作流"""
+                  project_id: Optional[int] = None,
+                  stream_callback: Optional[StreamCallback] = None,
+                  checkpoints: Optional[RunCheckpoints] = None,
+                  priority: RequestPriority = RequestPriority.INTERACTIVE,
+                  mode: str = WorkflowMode.STAGED.value,
+                  use_cache: bool = True) -> Dict[str, Any]:
+        """运行完整工作流
+        
+        传入 checkpoints 时，每个节点成功完成后保存其输出；已有检查点的节点直接复用，
+        用于失败后续跑或从某个阶段重新生成。priority 为各阶段LLM调用在限流器中的优先级。
+        mode 为 collapsed 时各阶段合并为单次LLM调用。use_cache=False 时重新执行的节点不使用
+        LLM响应缓存（否则重新生成的提示词与上次相同，会直接命中缓存返回同样的结果）。
+        """
         
         initial_state: WorkflowState = {
             "messages": conversation_history or [],
+            "history_digest": await build_history_digest(conversation_history),
             "current_phase": "",
             "user_input": user_input,
             "system_prompt": system_prompt,
             "context_files": None,
+            "retrieval_error": None,
             "project_id": project_id,
+            "mode": mode,
+            "route": WorkflowRoute.FULL.value,
             "requirement_analysis": None,
             "architecture_design": None,
             "rag_plan": None,
@@ -299,10 +813,17 @@ Provide your security review.
             "code_modifications": [],
             "security_warnings": [],
             "active_personas": [],
+            "phase_errors": {},
         }
         
         try:
-            final_state = await self.graph.ainvoke(initial_state)
+            config: RunnableConfig = {"configurable": {
+                "stream_callback": stream_callback,
+                "checkpoints": checkpoints,
+                "priority": priority,
+                "use_cache": use_cache,
+            }}
+            final_state = await self.graph.ainvoke(initial_state, config=config)
             
             return {
                 "success": True,
@@ -310,13 +831,53 @@ Provide your security review.
                 "workflow_state": {
                     "current_phase": final_state['current_phase'],
                     "active_personas": final_state['active_personas'],
+                    "route": final_state['route'],
                 },
                 "code_modifications": final_state['code_modifications'],
                 "security_warnings": final_state['security_warnings'],
+                "phase_errors": final_state.get('phase_errors', {}),
             }
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e),
                 "content": None
-            }
\ No newline at end of file
+            }
+    
+    async def run_stream(self,
+                         user_input: str,
+                         system_prompt: str,
+                         conversation_history: Optional[List[Dict[str, str]]] = None,
+                         project_id: Optional[int] = None,
+                         checkpoints: Optional[RunCheckpoints] = None,
+                         mode: str = WorkflowMode.STAGED.value) -> AsyncIterator[Dict[str, Any]]:
+        """流式运行工作流：依次产出 route/phase/token/code_modification/reused 事件，最后产出一个 result 事件（内容同 run 的返回值）"""
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def emit(event: Dict[str, Any]):
+            await queue.put(event)
+        
+        async def runner():
+            result = await self.run(
+                user_input=user_input,
+                system_prompt=system_prompt,
+                conversation_history=conversation_history,
+                project_id=project_id,
+                stream_callback=emit,
+                checkpoints=checkpoints,
+                mode=mode
+            )
+            await queue.put({"event": "result", "result": result})
+        
+        task = asyncio.create_task(runner())
+        try:
+            while True:
+                event = await queue.get()
+                yield event
+                if event["event"] == "result":
+                    break
+        finally:
+            # 客户端断开时取消未完成的工作流
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,150 @@
+from typing import Any, Dict, List, Optional
+import re
+
+from app.core.response_sections import section_heading
+
+# 代码修改块的起始标记（见系统提示词中的 Code Modification Protocol）
+BLOCK_MARKER = "[File to Modify]:"
+# 代码围栏行
+FENCE = "```"
+# 块头：文件路径 + 修改类型（类型行以换行结束后块头才算完整）
+HEADER_PATTERN = re.compile(r'\[File to Modify\]:\s*(.+?)\n\[Modification Type\]:\s*(\S.*?)\n', re.DOTALL)
+
+class CodeModificationParser:
+    """[File to Modify] 代码修改块的增量解析器
+
+    逐段喂入LLM输出（feed），每当一个块结束（下一个块的起始标记或代码围栏之外的段落标题出现）
+    就立即返回该块，输出结束时调用 close() 返回最后一个块。已返回的块从缓冲区移除，每段文本只扫描一次。
+    """
+
+    def __init__(self):
+        self.modifications: List[Dict[str, Any]] = []
+        self._buffer = ""
+        # 当前块（块头已解析）的路径与类型，以及块内容在缓冲区中的起始位置
+        self._current: Optional[Dict[str, str]] = None
+        self._content_start = 0
+        # 下一次查找起始标记 / 尝试解析块头的位置
+        self._search_from = 0
+        self._header_checked = 0
+        # 块内容中下一个待检查行的起始位置，以及当前是否位于代码围栏内（跨块累计）
+        self._line_start = 0
+        self._in_fence = False
+        self._closed = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """追加一段输出，返回其中新结束的代码修改块"""
+        if self._closed:
+            raise ValueError("Parser is closed")
+        self._buffer += text
+
+        completed = []
+        while True:
+            if self._current is None:
+                if not self._parse_header():
+                    break
+                continue
+
+            end = self._buffer.find(BLOCK_MARKER, self._search_from)
+            heading = self._find_heading(end if end >= 0 else len(self._buffer))
+            if heading >= 0:
+                completed.append(self._finish_block(heading))
+                continue
+            if end < 0:
+                # 标记可能被拆在两段之间，保留末尾不足一个标记长度的部分下次重新查找
+                self._search_from = max(self._content_start, len(self._buffer) - len(BLOCK_MARKER) + 1)
+                break
+            completed.append(self._finish_block(end))
+
+        return completed
+
+    def close(self) -> List[Dict[str, Any]]:
+        """输出结束，返回最后一个未结束的块"""
+        if self._closed:
+            return []
+        self._closed = True
+        if self._current is None:
+            return []
+        heading = self._find_heading(len(self._buffer), final=True)
+        return [self._finish_block(heading if heading >= 0 else len(self._buffer))]
+
+    def _parse_header(self) -> bool:
+        """在缓冲区中定位下一个块的起始标记并解析块头；块头尚不完整时返回 False"""
+        start = self._buffer.find(BLOCK_MARKER, self._search_from)
+        if start < 0:
+            # 起始标记之前的文本不属于任何块，可以丢弃（保留最后一个不完整的行，标记可能被拆在其中）
+            self._discard(self._buffer.rfind("\n") + 1)
+            self._search_from = 0
+            self._header_checked = 0
+            return False
+
+        if start > 0:
+            self._discard(start)
+            self._header_checked = max(0, self._header_checked - start)
+        self._search_from = 0
+
+        # 块头以换行结束，没有新的换行时不必重新尝试
+        if "\n" not in self._buffer[self._header_checked:]:
+            self._header_checked = len(self._buffer)
+            return False
+        self._header_checked = len(self._buffer)
+
+        match = HEADER_PATTERN.match(self._buffer)
+        if match is None:
+            return False
+
+        self._current = {"file_path": match.group(1).strip(), "modification_type": match.group(2).strip()}
+        self._content_start = match.end()
+        self._search_from = match.end()
+        self._line_start = match.end()
+        return True
+
+    def _discard(self, end: int):
+        """丢弃缓冲区中不属于任何块的前缀，其中的围栏行仍计入围栏状态"""
+        for line in self._buffer[:end].split("\n")[:-1]:
+            self._track_fence(line)
+        self._buffer = self._buffer[end:]
+
+    def _track_fence(self, line: str) -> bool:
+        if not line.lstrip().startswith(FENCE):
+            return False
+        self._in_fence = not self._in_fence
+        return True
+
+    def _find_heading(self, limit: int, final: bool = False) -> int:
+        """检查块内容中 limit 之前的完整行（final 时包括最后一行），返回代码围栏之外第一个段落标题的位置，没有时返回 -1
+
+        块内容在段落标题处结束：单次回答中代码修改块之后的 Security Review 等段落不属于代码。
+        """
+        while self._line_start < limit:
+            newline = self._buffer.find("\n", self._line_start, limit)
+            if newline < 0:
+                if not final:
+                    return -1
+                newline = limit
+            start, self._line_start = self._line_start, newline + 1
+            line = self._buffer[start:newline]
+            if not self._track_fence(line) and not self._in_fence and section_heading(line):
+                return start
+        return -1
+
+    def _finish_block(self, end: int) -> Dict[str, Any]:
+        modification = {
+            **self._current,
+            "content": self._buffer[self._content_start:end].strip(),
+        }
+        self.modifications.append(modification)
+
+        self._buffer = self._buffer[end:]
+        self._current = None
+        self._content_start = 0
+        self._search_from = 0
+        self._header_checked = 0
+        self._line_start = 0
+        return modification
+
+def parse_code_modifications(text: str) -> List[Dict[str, Any]]:
+    """一次性解析完整输出中的全部代码修改块"""
+    parser = CodeModificationParser()
+    parser.feed(text)
+    parser.close()
+    return parser.modifications
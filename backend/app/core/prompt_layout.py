@@ -0,0 +1,31 @@
+from typing import List, Optional, Tuple
+
+class PromptLayout:
+    """阶段提示词组装
+
+    Azure OpenAI 的提示词缓存只对“完全相同的前缀”生效（≥1024 tokens，按128 tokens递增），
+    因此消息整体按“最静态 → 最易变”排列：
+
+    1. 系统提示词（WorkflowEngine.build_system_prompt，进程内固定不变）
+    2. 对话历史（同一轮各阶段相同，跨轮只在末尾追加）
+    3. 本阶段提示词（即本类输出）：
+       阶段说明与输出格式（固定文本）→ 前序阶段产出 → 检索结果 → 用户输入
+
+    阶段说明必须是不含插值的常量，所有易变内容通过 add() 追加在其后。
+    """
+
+    def __init__(self, instructions: str):
+        self.instructions = instructions.strip()
+        self.sections: List[Tuple[str, str]] = []
+
+    def add(self, title: str, content: Optional[str]) -> "PromptLayout":
+        """追加一个易变段落（按调用顺序排列，越易变的越晚添加）；内容为空时跳过"""
+        if content:
+            self.sections.append((title, content.strip()))
+        return self
+
+    def render(self) -> str:
+        parts = [self.instructions]
+        for title, content in self.sections:
+            parts.append(f"## {title}\n{content}")
+        return "\n\n".join(parts) + "\n"
@@ -0,0 +1,103 @@
+from app.models.schemas import WorkflowRoute
+from typing import Dict, List, Optional
+import re
+
+# 问句开头（英文按单词、中文按前缀匹配）
+QUESTION_PREFIXES = (
+    "what", "why", "how", "which", "where", "when", "who", "is", "are",
+    "can", "could", "should", "explain", "describe", "tell me",
+    "什么", "为什么", "怎么", "如何", "哪", "是否", "能否", "可以", "解释", "说明", "请问",
+)
+# 寒暄
+GREETINGS = (
+    "hi", "hello", "hey", "thanks", "thank you",
+    "你好", "谢谢",
+)
+# 确认类消息：助手上一轮给出方案后表示"照此执行"，只有对话中没有助手回复时才按寒暄处理
+ACKNOWLEDGEMENTS = (
+    "ok", "okay", "got it", "yes", "sure", "go ahead", "do it",
+    "好的", "明白", "收到", "是的", "可以", "继续",
+)
+# 需要产出代码的动词
+BUILD_KEYWORDS = (
+    "implement", "create", "build", "add", "write", "generate", "refactor", "fix",
+    "modify", "change", "update", "remove", "delete", "rename", "migrate", "develop",
+    "实现", "创建", "新建", "添加", "增加", "编写", "生成", "重构", "修复", "修改", "删除", "重命名", "迁移", "开发",
+)
+# 涉及系统设计、需要完整架构/RAG规划的关键词
+ARCHITECTURE_KEYWORDS = (
+    "architecture", "system", "service", "module", "database", "schema", "microservice",
+    "pipeline", "workflow", "integration", "framework", "design", "project", "app",
+    "架构", "系统", "服务", "模块", "数据库", "表结构", "微服务", "流程", "集成", "框架", "设计", "项目", "应用",
+)
+
+# 需求阶段输出末尾的澄清标记行（允许模型给标记加粗或加反引号）
+CLARIFICATION_MARKER = re.compile(r"^[ \t*`_]*CLARIFICATION_REQUIRED[ \t*`_]*:[ \t*`_]*(YES|NO)\b[ \t*`_.]*$\n?", re.I | re.M)
+
+# 简单请求的长度上限（单词数，中文按字数的一半估算）
+ANSWER_MAX_WORDS = 60
+LITE_MAX_WORDS = 40
+
+def _word_count(text: str) -> int:
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return len(re.findall(r"[A-Za-z0-9_]+", text)) + cjk // 2
+
+def _contains(text: str, keywords) -> bool:
+    """英文关键词按单词边界匹配（add 不匹配 address），中文关键词按子串匹配"""
+    for keyword in keywords:
+        if keyword.isascii():
+            if re.search(rf"\b{re.escape(keyword)}\b", text):
+                return True
+        elif keyword in text:
+            return True
+    return False
+
+def classify_request(user_input: str, history: Optional[List[Dict[str, str]]] = None) -> WorkflowRoute:
+    """启发式判断请求需要走的工作流路径（不调用LLM）
+    
+    - answer: 寒暄或不要求产出代码的简短问题，单次LLM调用直接回答
+    - lite: 简短、局部的代码修改，跳过架构设计与RAG规划
+    - full: 其余请求，完整6阶段（包括对助手上一轮回复的确认，如 "ok" / "do it"）
+    
+    history 为本条消息之前的对话历史，用于判断确认类消息是否在回应助手的方案。
+    """
+    text = user_input.strip().lower()
+    if not text:
+        return WorkflowRoute.FULL
+    
+    stripped = text.rstrip("!.。！~ ")
+    if stripped in GREETINGS:
+        return WorkflowRoute.ANSWER
+    if stripped in ACKNOWLEDGEMENTS:
+        has_assistant_turn = any(message.get("role") == "assistant" for message in history or [])
+        return WorkflowRoute.FULL if has_assistant_turn else WorkflowRoute.ANSWER
+    
+    words = _word_count(text)
+    has_code_block = "```" in text
+    wants_code = _contains(text, BUILD_KEYWORDS)
+    
+    is_question = text.endswith(("?", "？")) or any(
+        re.match(rf"{re.escape(prefix)}\b", text) if prefix.isascii() else text.startswith(prefix)
+        for prefix in QUESTION_PREFIXES
+    )
+    if is_question and not wants_code and words <= ANSWER_MAX_WORDS:
+        return WorkflowRoute.ANSWER
+    
+    if (wants_code and not has_code_block and words <= LITE_MAX_WORDS
+            and not _contains(text, ARCHITECTURE_KEYWORDS)):
+        return WorkflowRoute.LITE
+    
+    return WorkflowRoute.FULL
+
+def needs_clarification(requirement_analysis: str) -> bool:
+    """需求分析是否以 CLARIFICATION_REQUIRED: YES 结束（标记由需求阶段的提示词要求输出）
+    
+    只认固定标记，不解析 Clarification Needed 段落的自然语言；缺少标记时按不需要澄清处理，
+    以免把正常请求误转入 clarify 路径。出现多个标记时以最后一个为准。
+    """
+    markers = CLARIFICATION_MARKER.findall(requirement_analysis)
+    return bool(markers) and markers[-1].upper() == "YES"
+
+def strip_clarification_marker(requirement_analysis: str) -> str:
+    """去掉标记行（标记只用于路由，不展示给用户）"""
+    return CLARIFICATION_MARKER.sub("", requirement_analysis).strip()
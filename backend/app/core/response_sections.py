@@ -0,0 +1,60 @@
+from typing import Dict, List, Optional
+import re
+
+# 系统提示词 Output Format Standard 中的段落标题
+SECTION_TITLES = (
+    "Summary",
+    "Analysis",
+    "Proposed Workflow",
+    "Implementation",
+    "Optional Enhancements",
+    "Security Review",
+    "Next Steps",
+)
+
+# 段落标题行：**Summary:** / **Summary**: / ## Summary / Summary:（标题后可以直接跟正文）
+SECTION_HEADING = re.compile(
+    r'^[ \t]*(?P<hash>#{1,6}[ \t]+)?(?P<bold>\*\*)?(?P<title>' + "|".join(SECTION_TITLES) + r')\b'
+    r'(?P<end>[ \t]*:[ \t]*\*\*|\*\*[ \t]*:?|[ \t]*:)?',
+    re.IGNORECASE
+)
+
+def section_heading(line: str) -> Optional[re.Match]:
+    """匹配段落标题行，不是标题时返回 None"""
+    match = SECTION_HEADING.match(line)
+    if match is None:
+        return None
+    # 加粗的标题必须闭合，否则只是以该单词开头的普通句子
+    if match.group("bold") and not (match.group("end") or "").count("*"):
+        return None
+    if not (match.group("hash") or match.group("end")):
+        return None
+    return match
+
+def split_sections(text: str) -> Dict[str, str]:
+    """按段落标题拆分单次回答，返回 小写标题 -> 正文（代码块内的行不视为标题）
+
+    同一标题出现多次时正文依次拼接；第一个标题之前的内容不属于任何段落。
+    """
+    sections: Dict[str, List[str]] = {}
+    current: Optional[str] = None
+    lines: List[str] = []
+    in_fence = False
+
+    def flush():
+        if current is not None:
+            sections.setdefault(current, []).append("\n".join(lines).strip())
+
+    for line in text.split("\n"):
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        match = None if in_fence else section_heading(line)
+        if match is None:
+            lines.append(line)
+            continue
+        flush()
+        current = match.group("title").lower()
+        lines = [line[match.end():]]
+    flush()
+
+    return {title: "\n\n".join(part for part in parts if part) for title, parts in sections.items()}
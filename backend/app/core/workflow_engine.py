@@ -1,6 +1,7 @@
 from typing import Dict, Any, List, Optional
 from app.models.schemas import WorkflowPhase, PersonaRole, WorkflowState
 from app.core.personas import PersonaSystem
+from app.core.modification_parser import parse_code_modifications
 import re
 
 class WorkflowEngine:
@@ -158,24 +159,8 @@ Always maintain professional, helpful, collaborative tone."""
         return self.current_state.current_phase
     
     def parse_code_modifications(self, response: str) -> List[Dict[str, Any]]:
-        """解析代码修改块"""
-        modifications = []
-        
-        pattern = r'\[File to Modify\]:\s*(.+?)\n\[Modification Type\]:\s*(.+?)\n(.*?)(?=\[File to Modify\]:|$)'
-        matches = re.finditer(pattern, response, re.DOTALL)
-                        
-        for match in matches:
-            file_path = match.group(1).strip()
-            mod_type = match.group(2).strip()
-            content = match.group(3).strip()
-            
-            modifications.append({
-                "file_path": file_path,
-                "modification_type": mod_type,
-                "content": content
-            })
-        
-        return modifications
+        """解析代码修改块（流式输出可直接使用 CodeModificationParser 增量解析）"""
+        return parse_code_modifications(response)
     
     def extract_security_warnings(self, response: str) -> List[str]:
         """提取安全警告"""
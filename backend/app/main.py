@@ -3,8 +3,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.config import settings
 from app.models.database import init_db
-from app.api import chat, projects, knowledge
+from app.services.registry import ServiceRegistry
+from app.api import chat, projects, knowledge, debug
 from app.utils.startup_check import check_environment
+from app.services.job_queue import get_job_queue
+from app.utils.tracing import TracingMiddleware, get_trace_store
+from functools import partial
+import asyncio
 import logging
 import sys
 
@@ -30,9 +35,20 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Database initialized")
     
+    # 创建共享服务（LLM客户端、连接池、向量库等）
+    app.state.registry = ServiceRegistry()
+    logger.info("Service registry initialized")
+    
+    # 后台工作流任务队列（恢复上次未完成的任务）
+    await get_job_queue().start(partial(chat.execute_job, app.state.registry.langgraph_workflow))
+    logger.info("Workflow job queue started")
+    
     yield
     
     # 关闭时
+    await get_job_queue().aclose()
+    await app.state.registry.aclose()
+    await asyncio.to_thread(get_trace_store().close)
     logger.info("Application shutdown")
 
 
@@ -50,12 +66,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "X-Workflow-Run-Id"],
 )
 
+# 请求追踪
+app.add_middleware(TracingMiddleware)
+
 # 注册路由
 app.include_router(chat.router)
 app.include_router(projects.router)
 app.include_router(knowledge.router)
+if settings.DEBUG_ENDPOINTS_ENABLED:
+    app.include_router(debug.router)
 
 
 @app.get("/")
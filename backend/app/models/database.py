@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
@@ -13,6 +13,7 @@ class Project(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, index=True)
     description = Column(Text, nullable=True)
+    workflow_mode = Column(String(20), nullable=True)  # staged / collapsed，未设置时使用 WORKFLOW_DEFAULT_MODE
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -28,8 +29,14 @@ class Conversation(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 滚动摘要：覆盖 id <= summary_until_id 的所有消息，之后的消息以原文进入历史窗口
+    summary = Column(Text, nullable=True)
+    summary_until_id = Column(Integer, nullable=True)
+    summary_token_count = Column(Integer, nullable=True)
+    
     project = relationship("Project", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    workflow_runs = relationship("WorkflowRun", back_populates="conversation", cascade="all, delete-orphan")
 
 class Message(Base):
     __tablename__ = "messages"
@@ -39,9 +46,15 @@ class Message(Base):
     role = Column(String(50))
     content = Column(Text)
     meta_info = Column(JSON, nullable=True)  # 使用 meta_info 代替 metadata
+    token_count = Column(Integer, nullable=True)  # 写入时计算，构建历史窗口时无需重新分词
     created_at = Column(DateTime, default=datetime.utcnow)
     
     conversation = relationship("Conversation", back_populates="messages")
+    
+    __table_args__ = (
+        # 按对话从新到旧读取历史窗口
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
 
 class KnowledgeFile(Base):
     __tablename__ = "knowledge_files"
@@ -58,6 +71,37 @@ class KnowledgeFile(Base):
     
     project = relationship("Project", back_populates="files")
 
+class WorkflowRun(Base):
+    """一次工作流运行（由一条用户消息触发）"""
+    __tablename__ = "workflow_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), index=True)
+    message_id = Column(Integer, ForeignKey("messages.id"), index=True)  # 触发本次运行的用户消息
+    assistant_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    project_id = Column(Integer, nullable=True)
+    status = Column(String(20), default="running", index=True)  # queued / running / completed / failed
+    background = Column(Integer, default=0)  # 1: 异步任务，由后台工作池执行（进程重启后继续）
+    mode = Column(String(20), default="staged")  # 工作流执行模式（续跑/重新生成时沿用）
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    conversation = relationship("Conversation", back_populates="workflow_runs")
+    checkpoints = relationship("WorkflowCheckpoint", back_populates="run", cascade="all, delete-orphan")
+
+class WorkflowCheckpoint(Base):
+    """工作流节点检查点（节点成功完成后的增量输出）"""
+    __tablename__ = "workflow_checkpoints"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("workflow_runs.id"), index=True)
+    node = Column(String(50))
+    output = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    run = relationship("WorkflowRun", back_populates="checkpoints")
+
 # 创建异步引擎
 engine = create_async_engine(
     settings.DATABASE_URL,
@@ -80,7 +124,30 @@ async def get_db():
         finally:
             await session.close()
 
+# 已有数据库需要补充的列（create_all 不会修改已存在的表）
+_ADDED_COLUMNS = [
+    ("messages", "token_count", "INTEGER"),
+    ("conversations", "summary", "TEXT"),
+    ("conversations", "summary_until_id", "INTEGER"),
+    ("conversations", "summary_token_count", "INTEGER"),
+    ("workflow_runs", "background", "INTEGER DEFAULT 0"),
+    ("workflow_runs", "mode", "VARCHAR(20) DEFAULT 'staged'"),
+    ("projects", "workflow_mode", "VARCHAR(20)"),
+]
+
+def _migrate(sync_conn):
+    """为旧数据库补充新增列和索引"""
+    for table, column, column_type in _ADDED_COLUMNS:
+        existing = {row[1] for row in sync_conn.execute(text(f"PRAGMA table_info({table})"))}
+        if column not in existing:
+            sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+    
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 # 初始化数据库
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate)
\ No newline at end of file
@@ -10,6 +10,19 @@ class WorkflowPhase(str, Enum):
     IMPLEMENTATION = "implementation"
     SECURITY_REVIEW = "security_review"
     DELIVERY = "delivery"
+    ANSWER = "answer"  # 快速路径：直接回答
+    COLLAPSED = "collapsed"  # 合并模式：单次调用产出全部阶段
+
+class WorkflowRoute(str, Enum):
+    ANSWER = "answer"    # 问答/寒暄：单次LLM调用直接回答
+    LITE = "lite"        # 局部修改：跳过架构设计与RAG规划
+    FULL = "full"        # 完整6阶段
+    CLARIFY = "clarify"  # 需求阶段提出了待澄清的问题，直接交付问题
+    COLLAPSED = "collapsed"  # 合并模式：单次LLM调用产出全部阶段
+
+class WorkflowMode(str, Enum):
+    STAGED = "staged"        # 各阶段分别调用LLM
+    COLLAPSED = "collapsed"  # 单次LLM调用，按输出格式的段落拆分为各阶段结果（更快，质量略低）
 
 class PersonaRole(str, Enum):
     ARCHITECT = "architect"
@@ -25,10 +38,16 @@ class ChatRequest(BaseModel):
     conversation_id: Optional[int] = None
     project_id: Optional[int] = None
     context_files: Optional[List[int]] = None
+    workflow_mode: Optional[WorkflowMode] = None  # 未指定时使用项目设置
 
 class ProjectCreate(BaseModel):
     name: str
     description: Optional[str] = None
+    workflow_mode: Optional[WorkflowMode] = None  # 未设置时使用 WORKFLOW_DEFAULT_MODE
+
+class ProjectUpdate(BaseModel):
+    description: Optional[str] = None
+    workflow_mode: Optional[WorkflowMode] = None
 
 class FileUpload(BaseModel):
     filename: str
@@ -64,6 +83,7 @@ class ProjectResponse(BaseModel):
     id: int
     name: str
     description: Optional[str] = None
+    workflow_mode: Optional[str] = None
     created_at: datetime
     updated_at: datetime
     
@@ -88,6 +108,7 @@ class WorkflowState(BaseModel):
     active_personas: List[PersonaRole]
     phase_outputs: Dict[str, Any] = {}
     security_flags: List[str] = []
+    route: Optional[WorkflowRoute] = None
 
 class ChatResponse(BaseModel):
     message_id: int
@@ -96,3 +117,22 @@ class ChatResponse(BaseModel):
     workflow_state: Optional[WorkflowState] = None
     code_modifications: Optional[List[Dict[str, Any]]] = None
     suggestions: Optional[List[str]] = None
+    run_id: Optional[int] = None  # 工作流运行id（用于续跑/从某阶段重新生成）
+
+class BatchChatRequest(BaseModel):
+    items: List[ChatRequest] = Field(..., min_length=1)
+    project_id: Optional[int] = None  # 未指定 conversation_id / project_id 的条目使用该项目
+
+class BatchItemResult(BaseModel):
+    index: int  # 条目在请求中的下标（结果按完成顺序返回）
+    success: bool
+    run_id: Optional[int] = None  # 失败的条目可通过 /runs/{run_id}/resume 续跑
+    result: Optional[ChatResponse] = None  # 部分阶段出错时同样返回已生成的内容
+    error: Optional[str] = None
+
+class WorkflowRunResponse(BaseModel):
+    run_id: int
+    conversation_id: int
+    status: str  # queued / running / completed / failed
+    error: Optional[str] = None
+    result: Optional[ChatResponse] = None  # 运行结束且已保存助手消息时返回
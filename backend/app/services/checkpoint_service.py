@@ -0,0 +1,122 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete
+from app.models.database import WorkflowRun, WorkflowCheckpoint, AsyncSessionLocal
+from app.utils.tracing import span
+from typing import Any, Dict, Iterable, Optional, Set
+from datetime import datetime
+
+# 正在执行的运行（同一运行同时只允许一次续跑/重新生成）
+_active_runs: Set[int] = set()
+
+class RunCheckpoints:
+    """一次工作流运行的节点检查点
+    
+    cached 中已有的节点直接复用其输出（不调用LLM）；新完成的节点输出立即写入SQLite。
+    并行分支会同时完成，每次写入使用独立会话。
+    """
+    
+    def __init__(self, run_id: int, cached: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.run_id = run_id
+        self.cached = dict(cached or {})
+        self.reused = set(self.cached)
+    
+    def get(self, node: str) -> Optional[Dict[str, Any]]:
+        return self.cached.get(node)
+    
+    async def save(self, node: str, output: Dict[str, Any]):
+        self.cached[node] = output
+        with span("db.save_checkpoint", node=node):
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    delete(WorkflowCheckpoint)
+                    .where(WorkflowCheckpoint.run_id == self.run_id, WorkflowCheckpoint.node == node)
+                )
+                session.add(WorkflowCheckpoint(run_id=self.run_id, node=node, output=output))
+                await session.commit()
+
+class CheckpointService:
+    """工作流运行与检查点管理"""
+    
+    @staticmethod
+    async def create_run(db: AsyncSession,
+                         conversation_id: int,
+                         message_id: int,
+                         project_id: Optional[int],
+                         background: bool = False,
+                         mode: str = "staged") -> WorkflowRun:
+        """为一条用户消息创建运行记录（后台运行创建为 queued，由任务队列执行）"""
+        run = WorkflowRun(
+            conversation_id=conversation_id,
+            message_id=message_id,
+            project_id=project_id,
+            status="queued" if background else "running",
+            background=1 if background else 0,
+            mode=mode
+        )
+        db.add(run)
+        await db.commit()
+        await db.refresh(run)
+        return run
+    
+    @staticmethod
+    async def get_run(db: AsyncSession, run_id: int) -> Optional[WorkflowRun]:
+        """获取运行记录"""
+        return await db.get(WorkflowRun, run_id)
+    
+    @staticmethod
+    async def load_outputs(db: AsyncSession, run_id: int) -> Dict[str, Dict[str, Any]]:
+        """读取运行已保存的节点输出 node -> 增量输出"""
+        result = await db.execute(
+            select(WorkflowCheckpoint.node, WorkflowCheckpoint.output)
+            .where(WorkflowCheckpoint.run_id == run_id)
+        )
+        return {row.node: row.output for row in result.all()}
+    
+    @staticmethod
+    async def discard(db: AsyncSession, run_id: int, nodes: Iterable[str]):
+        """删除需要重新执行的节点的检查点"""
+        nodes = list(nodes)
+        if not nodes:
+            return
+        await db.execute(
+            delete(WorkflowCheckpoint)
+            .where(WorkflowCheckpoint.run_id == run_id, WorkflowCheckpoint.node.in_(nodes))
+        )
+        await db.commit()
+    
+    @staticmethod
+    async def start_run(db: AsyncSession, run_id: int):
+        """标记运行开始执行"""
+        run = await db.get(WorkflowRun, run_id)
+        if run is not None and run.status != "running":
+            run.status = "running"
+            run.updated_at = datetime.utcnow()
+            await db.commit()
+    
+    @staticmethod
+    async def finish_run(db: AsyncSession,
+                         run_id: int,
+                         error: Optional[str] = None,
+                         assistant_message_id: Optional[int] = None):
+        """记录运行结果（error 非空时标记为失败，可续跑）"""
+        run = await db.get(WorkflowRun, run_id)
+        if run is None:
+            return
+        run.status = "failed" if error else "completed"
+        run.error = error
+        if assistant_message_id is not None:
+            run.assistant_message_id = assistant_message_id
+        run.updated_at = datetime.utcnow()
+        await db.commit()
+    
+    @staticmethod
+    def acquire(run_id: int) -> bool:
+        """标记运行为执行中；已在执行时返回 False"""
+        if run_id in _active_runs:
+            return False
+        _active_runs.add(run_id)
+        return True
+    
+    @staticmethod
+    def release(run_id: int):
+        _active_runs.discard(run_id)
@@ -1,9 +1,38 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
-from app.models.database import Project, Conversation, Message, KnowledgeFile
-from app.models.schemas import ProjectCreate
-from typing import List, Optional
+from sqlalchemy import select, desc, update, func
+from app.models.database import Project, Conversation, Message, KnowledgeFile, AsyncSessionLocal
+from app.models.schemas import ProjectCreate, ProjectUpdate
+from app.config import settings
+from app.services.rate_limiter import RequestPriority
+from app.utils.tokens import count_tokens_async
+from app.utils.tracing import current_span, start_trace, traced
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from datetime import datetime
+import asyncio
+
+if TYPE_CHECKING:
+    from app.services.llm_service import LLMService
+
+# 历史窗口缓存：conversation_id -> (窗口内最后一条消息id, 滚动摘要, 窗口, 窗口token总数（含摘要）)
+# 同一轮对话的各阶段以及后续轮次都复用，只增量读取新消息
+HISTORY_WINDOW_CACHE_SIZE = 256
+_history_windows: "OrderedDict[int, Tuple[int, Optional[dict], List[dict], int]]" = OrderedDict()
+
+# 正在运行的后台压缩任务（同时持有引用，避免任务被垃圾回收）
+_compaction_tasks: Dict[int, asyncio.Task] = {}
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a rolling summary of a software development conversation.
+Merge the new conversation turns into the existing summary.
+
+Keep:
+- The user's goals, requirements and constraints (including changes of mind)
+- Decisions made about architecture, APIs, data structures and file names
+- Code that was generated or modified (file paths and purpose, not full code)
+- Open questions and unresolved security warnings
+
+Write concise bullet points in the language of the conversation, at most about {target_tokens} tokens.
+Output only the updated summary."""
 
 class ConversationService:
     """对话管理服务"""
@@ -13,13 +42,30 @@ class ConversationService:
         """创建新项目"""
         project = Project(
             name=project_data.name,
-            description=project_data.description
+            description=project_data.description,
+            workflow_mode=project_data.workflow_mode.value if project_data.workflow_mode else None
         )
         db.add(project)
         await db.commit()
         await db.refresh(project)
         return project
     
+    @staticmethod
+    async def update_project(db: AsyncSession, project_id: int, project_data: ProjectUpdate) -> Optional[Project]:
+        """更新项目（只修改请求中提供的字段）"""
+        project = await db.get(Project, project_id)
+        if project is None:
+            return None
+        
+        updates = project_data.model_dump(exclude_unset=True)
+        if "description" in updates:
+            project.description = updates["description"]
+        if "workflow_mode" in updates:
+            project.workflow_mode = updates["workflow_mode"].value if updates["workflow_mode"] else None
+        await db.commit()
+        await db.refresh(project)
+        return project
+    
     @staticmethod
     async def get_projects(db: AsyncSession) -> List[Project]:
         """获取所有项目"""
@@ -39,10 +85,13 @@ class ConversationService:
         if project:
             await db.delete(project)
             await db.commit()
+            # 对话id可能被复用，清空历史窗口缓存
+            _history_windows.clear()
             return True
         return False
     
     @staticmethod
+    @traced("db.create_conversation")
     async def create_conversation(db: AsyncSession, project_id: int, title: str) -> Conversation:
         """创建新对话"""
         conversation = Conversation(
@@ -82,6 +131,7 @@ class ConversationService:
         return result.scalar_one_or_none()
     
     @staticmethod
+    @traced("db.add_message")
     async def add_message(db: AsyncSession,
                         conversation_id: int,
                         role: str,
@@ -92,8 +142,10 @@ class ConversationService:
             conversation_id=conversation_id,
             role=role,
             content=content,
-            meta_info=meta_info
+            meta_info=meta_info,
+            token_count=await count_tokens_async(content)
         )
+        current_span().update(role=role, content_chars=len(content), token_count=message.token_count)
         
         db.add(message)
         
@@ -107,6 +159,28 @@ class ConversationService:
         
         return message
     
+    @staticmethod
+    @traced("db.update_message")
+    async def update_message(db: AsyncSession,
+                             message_id: int,
+                             content: str,
+                             meta_info: Optional[dict] = None) -> Optional[Message]:
+        """原地更新消息内容（重新生成回复时使用）"""
+        message = await db.get(Message, message_id)
+        if message is None:
+            return None
+        
+        message.content = content
+        message.meta_info = meta_info
+        message.token_count = await count_tokens_async(content)
+        current_span().update(content_chars=len(content), token_count=message.token_count)
+        await db.commit()
+        await db.refresh(message)
+        
+        # 缓存的历史窗口中仍是旧内容
+        _history_windows.pop(message.conversation_id, None)
+        return message
+    
     @staticmethod
     async def get_conversation_history(db: AsyncSession, conversation_id: int) -> List[dict]:
         """获取对话历史（格式化为LLM输入）"""
@@ -125,6 +199,223 @@ class ConversationService:
             for msg in messages
         ]
     
+    @staticmethod
+    @traced("db.get_history_window")
+    async def get_history_window(db: AsyncSession,
+                                 conversation_id: int,
+                                 before_id: Optional[int] = None,
+                                 max_tokens: Optional[int] = None) -> List[dict]:
+        """获取token预算内的最近对话历史（格式化为LLM输入，按时间正序）
+        
+        存在滚动摘要时，第一项为 {"role": "summary", ...}，其后是摘要之后的消息原文。
+        首次从最新消息往前读取直到超出预算；之后只读取比缓存更新的消息，
+        追加到窗口末尾并从头部淘汰超出预算的消息。
+        指定 before_id 时只包含该消息之前的消息（当前消息不属于历史）；
+        缓存的窗口已越过该消息时改用 get_history_before。
+        """
+        budget = max_tokens or settings.HISTORY_TOKEN_BUDGET
+        columns = (Message.id, Message.role, Message.content, Message.token_count)
+        before = [Message.id < before_id] if before_id is not None else []
+        missing_counts = []
+        
+        async def to_entry(row) -> dict:
+            token_count = row.token_count
+            if token_count is None:
+                token_count = await count_tokens_async(row.content)
+                missing_counts.append({"id": row.id, "token_count": token_count})
+            return {"role": row.role, "content": row.content, "token_count": token_count}
+        
+        cached = _history_windows.get(conversation_id)
+        current_span().set("window_cache_hit", cached is not None)
+        if cached is not None and before_id is not None and cached[0] >= before_id:
+            return await ConversationService.get_history_before(db, conversation_id, before_id, max_tokens)
+        if cached is not None:
+            last_id, summary, window, total = cached
+            result = await db.execute(
+                select(*columns)
+                .where(Message.conversation_id == conversation_id, Message.id > last_id, *before)
+                .order_by(Message.id)
+            )
+            rows = result.all()
+            window = list(window)
+            for row in rows:
+                entry = await to_entry(row)
+                window.append(entry)
+                total += entry["token_count"]
+                last_id = row.id
+        else:
+            summary, summary_until_id = None, 0
+            result = await db.execute(
+                select(Conversation.summary, Conversation.summary_until_id, Conversation.summary_token_count)
+                .where(Conversation.id == conversation_id)
+            )
+            row = result.first()
+            if row is not None and row.summary:
+                summary = {"role": "summary", "content": row.summary, "token_count": row.summary_token_count or 0}
+                summary_until_id = row.summary_until_id or 0
+            if before_id is not None and summary_until_id >= before_id:
+                return await ConversationService.get_history_before(db, conversation_id, before_id, max_tokens)
+            
+            last_id, window = summary_until_id, []
+            total = summary["token_count"] if summary else 0
+            result = await db.stream(
+                select(*columns)
+                .where(Message.conversation_id == conversation_id, Message.id > summary_until_id, *before)
+                .order_by(desc(Message.id))
+            )
+            async for row in result:
+                entry = await to_entry(row)
+                if total + entry["token_count"] > budget:
+                    break
+                last_id = max(last_id, row.id)
+                window.append(entry)
+                total += entry["token_count"]
+            await result.close()
+            window.reverse()
+        
+        while window and total > budget:
+            total -= window.pop(0)["token_count"]
+        
+        # 回填旧数据缺失的token数
+        if missing_counts:
+            await db.execute(update(Message), missing_counts)
+            await db.commit()
+        
+        previous = _history_windows.get(conversation_id)
+        if previous is None or previous[0] <= last_id:
+            _history_windows[conversation_id] = (last_id, summary, window, total)
+            _history_windows.move_to_end(conversation_id)
+            while len(_history_windows) > HISTORY_WINDOW_CACHE_SIZE:
+                _history_windows.popitem(last=False)
+        
+        current_span().update(messages=len(window), tokens=total)
+        return ([summary] if summary else []) + list(window)
+    
+    @staticmethod
+    @traced("db.get_history_before")
+    async def get_history_before(db: AsyncSession,
+                                 conversation_id: int,
+                                 message_id: int,
+                                 max_tokens: Optional[int] = None) -> List[dict]:
+        """获取某条消息之前的对话历史（续跑/重新生成时还原原始运行的上下文，不使用窗口缓存）
+        
+        只有当滚动摘要完全位于该消息之前时才使用摘要。
+        """
+        budget = max_tokens or settings.HISTORY_TOKEN_BUDGET
+        
+        summary, summary_until_id = None, 0
+        row = (await db.execute(
+            select(Conversation.summary, Conversation.summary_until_id, Conversation.summary_token_count)
+            .where(Conversation.id == conversation_id)
+        )).first()
+        if row is not None and row.summary and (row.summary_until_id or 0) < message_id:
+            summary = {"role": "summary", "content": row.summary, "token_count": row.summary_token_count or 0}
+            summary_until_id = row.summary_until_id
+        
+        total = summary["token_count"] if summary else 0
+        window = []
+        result = await db.stream(
+            select(Message.role, Message.content, Message.token_count)
+            .where(Message.conversation_id == conversation_id,
+                   Message.id > summary_until_id,
+                   Message.id < message_id)
+            .order_by(desc(Message.id))
+        )
+        async for row in result:
+            token_count = row.token_count
+            if token_count is None:
+                token_count = await count_tokens_async(row.content)
+            if total + token_count > budget:
+                break
+            window.append({"role": row.role, "content": row.content, "token_count": token_count})
+            total += token_count
+        await result.close()
+        window.reverse()
+        
+        return ([summary] if summary else []) + window
+    
+    @staticmethod
+    @traced("conversation.compact")
+    async def compact_conversation(db: AsyncSession,
+                                   conversation_id: int,
+                                   llm_service: "LLMService") -> bool:
+        """把摘要之后、最近尾部之前的消息并入滚动摘要
+        
+        摘要之后的原文不超过 HISTORY_SUMMARY_TRIGGER_TOKENS 时不做任何事；
+        否则从最早的消息开始折叠，直到剩余原文不超过 HISTORY_SUMMARY_TAIL_TOKENS。
+        每次只总结“旧摘要 + 新折叠的消息”，成本与对话总长度无关。
+        """
+        conversation = await db.get(Conversation, conversation_id)
+        if conversation is None:
+            return False
+        summary_until_id = conversation.summary_until_id or 0
+        
+        pending_tokens = (await db.execute(
+            select(func.coalesce(func.sum(Message.token_count), 0))
+            .where(Message.conversation_id == conversation_id, Message.id > summary_until_id)
+        )).scalar()
+        if pending_tokens <= settings.HISTORY_SUMMARY_TRIGGER_TOKENS:
+            return False
+        
+        result = await db.execute(
+            select(Message.id, Message.role, Message.content, Message.token_count)
+            .where(Message.conversation_id == conversation_id, Message.id > summary_until_id)
+            .order_by(Message.id)
+        )
+        rows = result.all()
+        remaining = sum(row.token_count or 0 for row in rows)
+        folded = []
+        for row in rows:
+            if remaining <= settings.HISTORY_SUMMARY_TAIL_TOKENS:
+                break
+            folded.append(row)
+            remaining -= row.token_count or 0
+        if not folded:
+            return False
+        
+        transcript = "\n\n".join(f"{row.role.upper()}: {row.content}" for row in folded)
+        user_message = (
+            f"## Existing Summary\n{conversation.summary or 'None'}\n\n"
+            f"## New Conversation Turns\n{transcript}\n"
+        )
+        response = await llm_service.generate_response(
+            system_prompt=SUMMARY_SYSTEM_PROMPT.format(target_tokens=settings.HISTORY_SUMMARY_TARGET_TOKENS),
+            user_message=user_message,
+            priority=RequestPriority.BACKGROUND,
+            phase="summarize_conversation"
+        )
+        if not response["success"]:
+            print(f"Error compacting conversation {conversation_id}: {response.get('error')}")
+            return False
+        
+        conversation.summary = response["content"]
+        conversation.summary_until_id = folded[-1].id
+        conversation.summary_token_count = await count_tokens_async(response["content"])
+        await db.commit()
+        
+        # 窗口需要从新的摘要位置重建
+        _history_windows.pop(conversation_id, None)
+        return True
+    
+    @staticmethod
+    def schedule_compaction(conversation_id: int, llm_service: "LLMService"):
+        """在后台压缩对话（同一对话同时只运行一个压缩任务），不阻塞当前请求"""
+        if not settings.HISTORY_SUMMARY_ENABLED or conversation_id in _compaction_tasks:
+            return
+        
+        async def run():
+            try:
+                # 后台任务独立成一个 trace，不计入触发它的请求
+                with start_trace("background.compact_conversation", conversation_id=conversation_id):
+                    async with AsyncSessionLocal() as session:
+                        await ConversationService.compact_conversation(session, conversation_id, llm_service)
+            except Exception as e:
+                print(f"Error compacting conversation {conversation_id}: {e}")
+            finally:
+                _compaction_tasks.pop(conversation_id, None)
+        
+        _compaction_tasks[conversation_id] = asyncio.create_task(run())
+    
     @staticmethod
     async def add_file(db: AsyncSession,
                       project_id: int,
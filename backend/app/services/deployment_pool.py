@@ -0,0 +1,122 @@
+from app.services.rate_limiter import RateLimiter
+from app.services.resilience import CircuitBreaker, CircuitOpenError
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+import random
+import time
+
+class Deployment:
+    """一个 Azure OpenAI 部署：客户端 + 独立配额（限流器）+ 健康状态（熔断器）+ 负载统计"""
+
+    def __init__(self,
+                 name: str,
+                 endpoint: str,
+                 client: Any,
+                 rate_limiter: Optional[RateLimiter],
+                 circuit_breaker: CircuitBreaker,
+                 sampling_params: bool = True):
+        self.name = name
+        self.endpoint = endpoint
+        self.key = f"{urlsplit(endpoint).netloc}/{name}"
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        # 是否接受 temperature/max_tokens（推理模型不接受）
+        self.sampling_params = sampling_params
+
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def load(self) -> int:
+        """进行中 + 在本部署限流器中排队的请求数"""
+        queued = self.rate_limiter.queue_length if self.rate_limiter else 0
+        return self.outstanding + queued
+
+    def record_success(self, seconds: float, alpha: float = 0.2):
+        self.requests += 1
+        self.circuit_breaker.record_success()
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma = alpha * seconds + (1 - alpha) * self.latency_ewma
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.circuit_breaker.record_failure()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "deployment": self.name,
+            "endpoint": self.endpoint,
+            "outstanding": self.outstanding,
+            "queued": self.rate_limiter.queue_length if self.rate_limiter else 0,
+            "latency_ewma_seconds": self.latency_ewma,
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit_breaker": self.circuit_breaker.snapshot(),
+        }
+
+class DeploymentPool:
+    """同一模型的一组部署（可分布在不同 endpoint/区域）
+
+    - least_outstanding: 选择负载最小的部署，负载相同时选延迟最低的（新部署优先试探）
+    - latency_weighted: 按 1 / (延迟 × (1 + 负载)) 加权随机选择
+    熔断器打开的部署被摘除，恢复期过后以半开探测的方式重新接入；
+    因429暂停中的部署只在没有其他可用部署时才会被选中。
+    """
+
+    STRATEGIES = ("least_outstanding", "latency_weighted")
+
+    def __init__(self, kind: str, deployments: List[Deployment], strategy: str = "least_outstanding"):
+        if not deployments:
+            raise ValueError(f"{kind} deployment pool is empty")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.kind = kind
+        self.deployments = deployments
+        self.strategy = strategy
+
+    def __len__(self) -> int:
+        return len(self.deployments)
+
+    @property
+    def model_name(self) -> str:
+        """池内部署提供相同模型，缓存键统一使用第一个部署名"""
+        return self.deployments[0].name
+
+    def select(self, exclude: Iterable[Deployment] = ()) -> Deployment:
+        """选择一个部署；全部不可用时抛出 CircuitOpenError"""
+        excluded = set(exclude)
+        candidates = [
+            d for d in self.deployments
+            if d not in excluded and d.circuit_breaker.available()
+        ]
+        if not candidates:
+            raise CircuitOpenError(f"All {self.kind} deployments are degraded (circuit open)")
+
+        now = time.monotonic()
+        ready = [
+            d for d in candidates
+            if d.rate_limiter is None or d.rate_limiter.blocked_until <= now
+        ] or candidates
+
+        if len(ready) == 1:
+            return ready[0]
+
+        if self.strategy == "latency_weighted":
+            known = [d.latency_ewma for d in ready if d.latency_ewma]
+            default_latency = sum(known) / len(known) if known else 1.0
+            weights = [1.0 / ((d.latency_ewma or default_latency) * (1 + d.load)) for d in ready]
+            return random.choices(ready, weights=weights)[0]
+
+        return min(ready, key=lambda d: (d.load, d.latency_ewma or 0.0))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy,
+            "deployments": {d.key: d.snapshot() for d in self.deployments},
+        }
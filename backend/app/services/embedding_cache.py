@@ -0,0 +1,156 @@
+from app.config import settings
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+
+# 全局单例
+_embedding_cache = None
+
+def get_embedding_cache():
+    """获取嵌入缓存单例"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(
+            path=settings.EMBEDDING_CACHE_PATH,
+            max_bytes=settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+        )
+    return _embedding_cache
+
+class EmbeddingCache:
+    """内容寻址的嵌入缓存（SQLite float32 BLOB表，按容量LRU淘汰）
+
+    key = sha256(deployment + 归一化文本)，相同文本在任意文件/项目/查询之间共享。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """文本归一化（Unicode NFC + 去除首尾空白）"""
+        return unicodedata.normalize("NFC", text).strip()
+
+    @classmethod
+    def make_key(cls, deployment: str, text: str) -> str:
+        digest = hashlib.sha256(cls.normalize(text).encode("utf-8")).hexdigest()
+        return f"{deployment}:{digest}"
+
+    async def get_many(self, deployment: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量查找，未命中的位置为 None"""
+        keys = [self.make_key(deployment, text) for text in texts]
+        found = await asyncio.to_thread(self._get_many, keys)
+        results = [found.get(key) for key in keys]
+        hit_count = sum(1 for r in results if r is not None)
+        self.hits += hit_count
+        self.misses += len(results) - hit_count
+        return results
+
+    async def set_many(self, deployment: str, texts: List[str], embeddings: List[List[float]]):
+        """批量写入"""
+        items = {
+            self.make_key(deployment, text): np.asarray(embedding, dtype=np.float32).tobytes()
+            for text, embedding in zip(texts, embeddings)
+            if embedding
+        }
+        if items:
+            await asyncio.to_thread(self._set_many, items)
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            # SQLite 默认最多 999 个绑定参数
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _set_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            existing = self._get_sizes(list(items))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, blob, now) for key, blob in items.items()]
+            )
+            self._total_bytes += sum(len(blob) for blob in items.values()) - sum(existing.values())
+            self._evict()
+            self._conn.commit()
+
+    def _get_sizes(self, keys: List[str]) -> Dict[str, int]:
+        sizes: Dict[str, int] = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, LENGTH(vector) FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            sizes.update(dict(rows))
+        return sizes
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总容量低于上限"""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            freed = 0
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                freed += size
+                if self._total_bytes - freed <= self.max_bytes:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+            self._total_bytes -= freed
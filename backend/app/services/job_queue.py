@@ -0,0 +1,108 @@
+from sqlalchemy import select
+from app.models.database import WorkflowRun, AsyncSessionLocal
+from app.config import settings
+from app.utils.tracing import start_trace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+
+# 事件回调：接收 {"event": ..., ...} 字典
+JobEventCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+# 执行一个运行：(run_id, 事件回调)
+JobExecutor = Callable[[int, JobEventCallback], Awaitable[None]]
+
+class WorkflowJobQueue:
+    """后台工作流任务队列
+    
+    任务本身就是 status=queued 的 WorkflowRun 记录（持久化在SQLite），队列只保存运行id；
+    固定数量的 worker 并发执行，进程重启后由 start() 重新入队未完成的后台运行
+    （已完成节点的检查点会被复用）。订阅者可以收到执行中的 phase/token 事件。
+    """
+    
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._pending: Set[int] = set()
+        self._workers: List[asyncio.Task] = []
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._execute: Optional[JobExecutor] = None
+    
+    async def start(self, execute: JobExecutor):
+        """启动 worker，并恢复上次进程退出时未完成的后台运行"""
+        self._execute = execute
+        
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(WorkflowRun.id)
+                .where(WorkflowRun.background == 1, WorkflowRun.status.in_(("queued", "running")))
+                .order_by(WorkflowRun.id)
+            )
+            recovered = result.scalars().all()
+        for run_id in recovered:
+            self.enqueue(run_id)
+        if recovered:
+            print(f"Recovered {len(recovered)} unfinished workflow jobs")
+        
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+    
+    def enqueue(self, run_id: int):
+        """加入队列（已在队列中的运行不会重复加入）"""
+        if run_id in self._pending:
+            return
+        self._pending.add(run_id)
+        self._queue.put_nowait(run_id)
+    
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+    
+    def subscribe(self, run_id: int) -> asyncio.Queue:
+        """订阅运行的事件；运行结束时收到 {"event": "finished"}"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(run_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, run_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(run_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(run_id, None)
+    
+    async def _publish(self, run_id: int, event: Dict[str, Any]):
+        for queue in self._subscribers.get(run_id, ()):
+            queue.put_nowait(event)
+    
+    async def _worker(self):
+        while True:
+            run_id = await self._queue.get()
+            
+            async def emit(event: Dict[str, Any]):
+                await self._publish(run_id, event)
+            
+            try:
+                with start_trace("job.workflow_run", run_id=run_id):
+                    await self._execute(run_id, emit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Workflow job {run_id} error: {e}")
+            finally:
+                self._pending.discard(run_id)
+                self._queue.task_done()
+                await self._publish(run_id, {"event": "finished"})
+    
+    async def aclose(self):
+        """停止 worker（执行中的运行保持 running 状态，下次启动时从检查点继续）"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+_job_queue: Optional[WorkflowJobQueue] = None
+
+def get_job_queue() -> WorkflowJobQueue:
+    """获取后台任务队列单例"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = WorkflowJobQueue(concurrency=settings.WORKFLOW_JOB_CONCURRENCY)
+    return _job_queue
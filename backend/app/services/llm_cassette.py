@@ -0,0 +1,201 @@
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from app.config import settings
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+# 全局单例
+_cassette = None
+
+def get_cassette() -> "Cassette":
+    """获取录制/回放文件单例"""
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette(
+            path=settings.LLM_CASSETTE_PATH,
+            mode=settings.LLM_CASSETTE_MODE,
+            latency_scale=settings.LLM_CASSETTE_LATENCY_SCALE,
+        )
+    return _cassette
+
+class CassetteMissError(Exception):
+    """回放模式下请求不在录制文件中"""
+
+class Cassette:
+    """LLM / 嵌入调用的录制与回放（离线性能回归）
+
+    - record: 调用真实部署，并把每次请求与响应按行追加到 JSONL 文件
+    - replay: 不访问网络，按请求内容（消息 + 采样参数 / 文本）查找录制的响应；
+      同一请求录制了多次时按录制顺序依次返回，用完后重复最后一次。
+      latency_scale 控制模拟耗时：0 为立即返回，1 为按录制时的耗时返回
+    """
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 0.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._positions: Dict[str, int] = {}
+        if mode == "replay":
+            self._load()
+        elif mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @staticmethod
+    def make_key(kind: str, request: Any) -> str:
+        payload = json.dumps([kind, request], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    def _append(self, line: str):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    async def record(self, kind: str, request: Any, response: Dict[str, Any], latency: float):
+        entry = {
+            "key": self.make_key(kind, request),
+            "kind": kind,
+            "request": request,
+            "response": response,
+            "latency": latency,
+        }
+        await asyncio.to_thread(self._append, json.dumps(entry, ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    def lookup(self, kind: str, request: Any) -> Dict[str, Any]:
+        """取出下一条录制的响应；不存在时抛出 CassetteMissError"""
+        key = self.make_key(kind, request)
+        entries = self._entries.get(key)
+        if not entries:
+            self.misses += 1
+            raise CassetteMissError(f"No recorded {kind} response for request {key[:12]}")
+
+        position = self._positions.get(key, 0)
+        self._positions[key] = position + 1
+        self.replayed += 1
+        return entries[min(position, len(entries) - 1)]
+
+    async def simulate_latency(self, seconds: float):
+        if self.latency_scale > 0 and seconds > 0:
+            await asyncio.sleep(seconds * self.latency_scale)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+        }
+
+def _chat_request(messages: Sequence[BaseMessage], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {"messages": [[msg.type, msg.content] for msg in messages], "params": kwargs}
+
+class CassetteChatClient:
+    """包装聊天客户端（ainvoke / astream），按 Cassette 模式录制或回放"""
+
+    def __init__(self, client: Any, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+
+    async def ainvoke(self, messages: Sequence[BaseMessage], **kwargs) -> AIMessage:
+        request = _chat_request(messages, kwargs)
+        if self.cassette.mode == "replay":
+            entry = self.cassette.lookup("chat", request)
+            await self.cassette.simulate_latency(entry["latency"])
+            response = entry["response"]
+            return AIMessage(content=response["content"], usage_metadata=response.get("usage_metadata"))
+
+        start = time.monotonic()
+        message = await self.client.ainvoke(messages, **kwargs)
+        await self.cassette.record("chat", request, {
+            "content": message.content,
+            "usage_metadata": message.usage_metadata,
+        }, time.monotonic() - start)
+        return message
+
+    async def astream(self, messages: Sequence[BaseMessage], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        request = _chat_request(messages, kwargs)
+        if self.cassette.mode == "replay":
+            entry = self.cassette.lookup("chat", request)
+            response = entry["response"]
+            # 非流式录制的响应回放为一个chunk；模拟耗时均摊到各chunk之间
+            chunks = response.get("chunks") or [response["content"]]
+            for idx, text in enumerate(chunks):
+                await self.cassette.simulate_latency(entry["latency"] / len(chunks))
+                last = idx == len(chunks) - 1
+                yield AIMessageChunk(
+                    content=text,
+                    usage_metadata=response.get("usage_metadata") if last else None,
+                )
+            return
+
+        start = time.monotonic()
+        chunks: List[str] = []
+        usage_metadata = None
+        async for chunk in self.client.astream(messages, **kwargs):
+            if chunk.content:
+                chunks.append(chunk.content)
+            if chunk.usage_metadata:
+                usage_metadata = chunk.usage_metadata
+            yield chunk
+        await self.cassette.record("chat", request, {
+            "content": "".join(chunks),
+            "chunks": chunks,
+            "usage_metadata": usage_metadata,
+        }, time.monotonic() - start)
+
+class CassetteEmbeddingClient:
+    """包装嵌入客户端（aembed_query / aembed_documents），按 Cassette 模式录制或回放"""
+
+    def __init__(self, client: Any, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+
+    async def _call(self, kind: str, request: Any, call) -> Any:
+        if self.cassette.mode == "replay":
+            entry = self.cassette.lookup(kind, request)
+            await self.cassette.simulate_latency(entry["latency"])
+            return entry["response"]
+
+        start = time.monotonic()
+        result = await call()
+        await self.cassette.record(kind, request, result, time.monotonic() - start)
+        return result
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self._call("embed_query", text, lambda: self.client.aembed_query(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._call("embed_documents", texts, lambda: self.client.aembed_documents(texts))
+
+def wrap_client(kind: str, client: Any) -> Any:
+    """LLM_CASSETTE_MODE 不为 off 时包装部署客户端"""
+    if settings.LLM_CASSETTE_MODE == "off":
+        return client
+    cassette = get_cassette()
+    if kind == "chat":
+        return CassetteChatClient(client, cassette)
+    return CassetteEmbeddingClient(client, cassette)
@@ -1,76 +1,539 @@
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from app.config import settings
-from typing import List, Dict, Optional
-import tiktoken
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
+from app.config import AzureDeployment, PhaseModel, settings
+from app.services.response_cache import get_response_cache
+from app.services.embedding_cache import get_embedding_cache
+from app.services.rate_limiter import RateLimiter, RequestPriority, parse_retry_after
+from app.services.resilience import CircuitBreaker, CircuitOpenError, LLMMetrics, LLMTimeoutError, hedged_call
+from app.services.deployment_pool import Deployment, DeploymentPool
+from app.services.llm_cassette import get_cassette, wrap_client
+from app.utils.tokens import count_tokens, count_tokens_async, get_encoding
+from app.utils.tracing import current_span, traced
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Set, Tuple
+import asyncio
+import httpx
+import json
+import random
+import time
+import openai
+
+# 重试或拆分也无法恢复的错误（鉴权/部署不存在），直接判定整批失败
+NON_RETRYABLE_ERRORS = (
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+)
+
+# 计入熔断器的错误（部署降级：超时、连接失败、5xx）
+BREAKER_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
 
 class LLMService:
     """LangChain集成的Azure OpenAI服务"""
     
-    def __init__(self):
-        # 初始化聊天模型（不设置任何动态参数）
-        self.chat_model = AzureChatOpenAI(
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            api_version=settings.AZURE_OPENAI_API_VERSION,
-            deployment_name=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
+    def __init__(self,
+                 http_client_factory: Optional[Callable[[str], Tuple[httpx.Client, httpx.AsyncClient]]] = None):
+        # http_client_factory 按 endpoint 返回共享连接池（见 ServiceRegistry），未提供时由SDK自行创建
+        self.http_client_factory = http_client_factory
+        
+        # 聊天 / 嵌入部署池（每个部署独立配额与熔断，池内按负载或延迟路由）
+        self.chat_pool = DeploymentPool(
+            "chat",
+            [self._create_deployment("chat", config) for config in settings.chat_deployments()],
+            settings.LLM_ROUTING_STRATEGY,
+        )
+        # 分级聊天池（按阶段选择，见 LLM_PHASE_MODELS）
+        self.chat_tiers: Dict[str, DeploymentPool] = {
+            name: DeploymentPool(
+                f"chat:{name}",
+                [self._create_deployment("chat", config) for config in configs],
+                settings.LLM_ROUTING_STRATEGY,
+            )
+            for name, configs in settings.AZURE_OPENAI_CHAT_TIERS.items()
+        }
+        for phase, phase_model in settings.LLM_PHASE_MODELS.items():
+            if phase_model.tier and phase_model.tier not in self.chat_tiers:
+                raise ValueError(f"Unknown chat tier for phase {phase}: {phase_model.tier}")
+        self.embedding_pool = DeploymentPool(
+            "embedding",
+            [self._create_deployment("embedding", config) for config in settings.embedding_deployments()],
+            settings.LLM_ROUTING_STRATEGY,
+        )
+        
+        self.encoding = get_encoding()
+        self.response_cache = get_response_cache() if settings.RESPONSE_CACHE_ENABLED else None
+        self.embedding_cache = get_embedding_cache() if settings.EMBEDDING_CACHE_ENABLED else None
+        self.embedding_semaphore = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY * len(self.embedding_pool))
+        self.metrics = LLMMetrics()
+    
+    def _create_deployment(self, kind: str, config: AzureDeployment) -> Deployment:
+        """创建一个部署的客户端、限流器与熔断器"""
+        http_client, http_async_client = (
+            self.http_client_factory(config.endpoint) if self.http_client_factory else (None, None)
+        )
+        api_key = config.api_key or settings.AZURE_OPENAI_API_KEY
+        api_version = config.api_version or settings.AZURE_OPENAI_API_VERSION
+        
+        # 重试与故障切换由 _route 负责（客户端限流器按每次实际请求计数），SDK 不再自行重试
+        if kind == "chat":
+            # 初始化聊天模型（不设置任何动态参数）
+            client = AzureChatOpenAI(
+                azure_endpoint=config.endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                deployment_name=config.deployment,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                include_response_headers=True,
+                stream_usage=settings.AZURE_OPENAI_STREAM_USAGE,
+                max_retries=0,
+            )
+            rpm, tpm = settings.CHAT_RPM_LIMIT, settings.CHAT_TPM_LIMIT
+        else:
+            client = AzureOpenAIEmbeddings(
+                azure_endpoint=config.endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                deployment=config.deployment,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                max_retries=0,
+            )
+            rpm, tpm = settings.EMBEDDING_RPM_LIMIT, settings.EMBEDDING_TPM_LIMIT
+        
+        rate_limiter = None
+        if settings.RATE_LIMIT_ENABLED:
+            rate_limiter = RateLimiter(config.rpm or rpm, config.tpm or tpm)
+        
+        return Deployment(
+            name=config.deployment,
+            endpoint=config.endpoint,
+            # 录制/回放模式下包装客户端（限流、缓存、指标等其余逻辑不变）
+            client=wrap_client(kind, client),
+            rate_limiter=rate_limiter,
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=settings.LLM_CIRCUIT_RECOVERY_SECONDS,
+            ),
+            sampling_params=(config.sampling_params if config.sampling_params is not None
+                             else settings.AZURE_OPENAI_SAMPLING_PARAMS),
         )
+    
+    async def _build_messages(self,
+                              system_prompt: str,
+                              user_message: str,
+                              conversation_history: Optional[List[Dict[str, str]]] = None) -> Tuple[List[BaseMessage], int, int]:
+        """构建消息列表（控制历史token数量），返回 (消息列表, 估算的prompt token数, 其中历史消息的token数)"""
+        total_tokens = await self.count_tokens_async(system_prompt)
+        history_tokens = 0
+        
+        # 添加历史消息（从最新往前取，直到超出token预算；优先使用已持久化的token数）
+        history: List[BaseMessage] = []
+        if conversation_history:
+            for msg in reversed(conversation_history):
+                msg_tokens = msg.get("token_count")
+                if msg_tokens is None:
+                    msg_tokens = await self.count_tokens_async(msg["content"])
+                if total_tokens + msg_tokens > settings.HISTORY_TOKEN_BUDGET:
+                    break
+                
+                if msg["role"] == "user":
+                    history.append(HumanMessage(content=msg["content"]))
+                elif msg["role"] == "assistant":
+                    history.append(AIMessage(content=msg["content"]))
+                elif msg["role"] == "summary":
+                    history.append(SystemMessage(content=f"Summary of the earlier conversation:\n{msg['content']}"))
+                
+                total_tokens += msg_tokens
+                history_tokens += msg_tokens
+        
+        messages: List[BaseMessage] = [SystemMessage(content=system_prompt)]
+        messages.extend(reversed(history))
+        
+        # 添加当前用户消息
+        messages.append(HumanMessage(content=user_message))
+        total_tokens += await self.count_tokens_async(user_message)
+        return messages, total_tokens, history_tokens
+    
+    async def _build_result(self,
+                            content: str,
+                            prompt_tokens_estimate: int,
+                            usage_metadata: Optional[Dict[str, Any]] = None,
+                            model: Optional[str] = None) -> Dict[str, Any]:
+        """构建统一的响应结构（优先使用服务端返回的token用量）"""
+        cached_tokens = 0
+        if usage_metadata:
+            prompt_tokens = usage_metadata.get("input_tokens", 0)
+            completion_tokens = usage_metadata.get("output_tokens", 0)
+            # 命中服务端提示词缓存的前缀token数（prompt_tokens_details.cached_tokens）
+            cached_tokens = (usage_metadata.get("input_token_details") or {}).get("cache_read") or 0
+        else:
+            prompt_tokens = prompt_tokens_estimate
+            completion_tokens = await self.count_tokens_async(content)
+        
+        return {
+            "success": True,
+            "content": content,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "cached_tokens": cached_tokens
+            },
+            "model": model or self.chat_pool.model_name
+        }
+    
+    def _phase_model(self,
+                     phase: Optional[str],
+                     temperature: Optional[float],
+                     max_tokens: Optional[int]) -> Tuple[str, DeploymentPool, Dict[str, Any]]:
+        """阶段对应的 (部署池名称, 部署池, 采样参数)；LLM_PHASE_MODELS 中的配置优先于调用方传入的默认值"""
+        phase_model = settings.LLM_PHASE_MODELS.get(phase or "default") or PhaseModel()
+        tier = phase_model.tier or "default"
+        pool = self.chat_tiers.get(tier, self.chat_pool)
+        
+        params: Dict[str, Any] = {}
+        temperature = phase_model.temperature if phase_model.temperature is not None else temperature
+        max_tokens = phase_model.max_tokens if phase_model.max_tokens is not None else max_tokens
+        if temperature is not None:
+            params["temperature"] = temperature
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        return tier, pool, params
+    
+    @staticmethod
+    def _invoke_params(deployment: Deployment, params: Dict[str, Any]) -> Dict[str, Any]:
+        return params if deployment.sampling_params else {}
+    
+    async def _cache_lookup(self,
+                            pool: DeploymentPool,
+                            params: Dict[str, Any],
+                            messages: List[BaseMessage],
+                            use_cache: bool = True,
+                            cache_query: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """查询响应缓存，返回 (命中的结果, 写回缓存所需的上下文)
+        
+        缓存按部署池模型与采样参数区分（同一提示词在不同模型/参数下的结果不共用）。
+        use_cache=False 时不查询缓存（重新生成），新结果写回时覆盖旧条目。
+        语义匹配只比较 cache_query（提示词中的用户原始输入），未给出时只做精确匹配。
+        """
+        if self.response_cache is None:
+            return None, None
         
-        # 初始化嵌入模型
-        self.embeddings = AzureOpenAIEmbeddings(
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            api_version=settings.AZURE_OPENAI_API_VERSION,
-            deployment=settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        model = pool.model_name
+        if params:
+            model = f"{model}:{json.dumps(params, sort_keys=True)}"
+        key, context_key = self.response_cache.make_keys(
+            model,
+            [(msg.type, msg.content) for msg in messages],
+            query=cache_query
         )
+        entry = {"key": key, "context_key": context_key, "embedding": None}
+        if not use_cache:
+            return None, entry
+        
+        cached = await self.response_cache.get(key)
+        if cached is not None:
+            return {**cached, "cached": "exact"}, entry
+        
+        if settings.RESPONSE_CACHE_SEMANTIC_ENABLED and cache_query:
+            entry["embedding"] = await self.generate_embedding(cache_query)
+            if entry["embedding"]:
+                cached = await self.response_cache.get_semantic(context_key, entry["embedding"])
+                if cached is not None:
+                    return {**cached, "cached": "semantic"}, entry
+        
+        self.response_cache.record_miss()
+        return None, entry
+    
+    async def _cache_store(self, entry: Optional[Dict[str, Any]], result: Dict[str, Any]):
+        """成功的响应写回缓存"""
+        if entry is None or not result.get("success"):
+            return
+        await self.response_cache.set(entry["key"], entry["context_key"], result, entry["embedding"])
+    
+    async def _route(self,
+                     pool: DeploymentPool,
+                     estimated_tokens: int,
+                     priority: RequestPriority,
+                     call: Callable[[Deployment], Awaitable[Any]],
+                     attempts: Optional[List[Deployment]] = None,
+                     can_failover: Optional[Callable[[], bool]] = None) -> Tuple[Deployment, Any]:
+        """选择部署并调用，返回 (实际使用的部署, 结果)
+        
+        - 在所选部署的限流器中排队；遇到 429 时暂停该部署并重新路由，而不是直接失败
+        - 连接失败/5xx 计入该部署的熔断器，并切换到其他健康部署（can_failover 返回 False 时不切换）
+        - 被取消（超时/对冲落败）的部署保留在 attempts 中，由 _guarded_call 决定是否计为失败
+        """
+        failed: Set[Deployment] = set()
+        rate_limited = 0
+        
+        while True:
+            deployment = pool.select(exclude=failed)
+            limiter = deployment.rate_limiter
+            if limiter:
+                await limiter.acquire(estimated_tokens, priority)
+            try:
+                deployment.circuit_breaker.before_call()
+            except CircuitOpenError:
+                # 排队期间该部署被熔断，换一个
+                failed.add(deployment)
+                continue
+            
+            deployment.outstanding += 1
+            if attempts is not None:
+                attempts.append(deployment)
+            start = time.monotonic()
+            try:
+                result = await call(deployment)
+            except asyncio.CancelledError:
+                deployment.circuit_breaker.release()
+                raise
+            except openai.RateLimitError as e:
+                deployment.circuit_breaker.release()
+                self._discard_attempt(attempts, deployment)
+                rate_limited += 1
+                if limiter is None:
+                    failed.add(deployment)
+                if rate_limited > settings.RATE_LIMIT_MAX_RETRIES or len(failed) >= len(pool):
+                    raise
+                if limiter:
+                    limiter.penalize(parse_retry_after(e.response.headers if e.response is not None else None))
+                continue
+            except BREAKER_ERRORS as e:
+                deployment.record_failure()
+                self._discard_attempt(attempts, deployment)
+                failed.add(deployment)
+                if len(failed) >= len(pool) or (can_failover is not None and not can_failover()):
+                    raise
+                print(f"Deployment {deployment.key} failed ({type(e).__name__}), failing over")
+                continue
+            except BaseException:
+                deployment.circuit_breaker.release()
+                self._discard_attempt(attempts, deployment)
+                raise
+            finally:
+                deployment.outstanding -= 1
+            
+            deployment.record_success(time.monotonic() - start)
+            self._discard_attempt(attempts, deployment)
+            return deployment, result
+    
+    @staticmethod
+    def _discard_attempt(attempts: Optional[List[Deployment]], deployment: Deployment):
+        if attempts is not None and deployment in attempts:
+            attempts.remove(deployment)
+    
+    def _hedge_delay(self, label: str) -> Optional[float]:
+        """对冲延迟取该阶段历史延迟的p95；样本不足时不对冲"""
+        if not settings.LLM_HEDGING_ENABLED:
+            return None
+        tracker = self.metrics.latency[label]
+        if len(tracker.samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return tracker.percentile(0.95)
+    
+    async def _guarded_call(self,
+                            phase: Optional[str],
+                            timeout: Optional[float],
+                            factory: Callable[[List[Deployment]], Awaitable[Any]],
+                            hedge: bool = False) -> Any:
+        """截止时间 + 可选对冲，并记录各阶段指标
+        
+        factory 接收一个列表，_route 在其中登记进行中的部署；超时时这些部署计为失败（触发熔断）。
+        """
+        label = phase or "default"
+        self.metrics.calls[label] += 1
         
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        deadline = timeout if timeout is not None else settings.LLM_TIMEOUT_SECONDS
+        hedge_delay = self._hedge_delay(label) if hedge else None
+        attempts: List[Deployment] = []
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                hedged_call(lambda: factory(attempts), hedge_delay, self.metrics),
+                timeout=deadline
+            )
+        except asyncio.TimeoutError as e:
+            self.metrics.timeouts[label] += 1
+            self.metrics.failures[label] += 1
+            for deployment in attempts:
+                deployment.record_failure()
+            raise LLMTimeoutError(f"LLM call exceeded {deadline}s deadline ({label})") from e
+        except BaseException:
+            self.metrics.failures[label] += 1
+            raise
+        
+        self.metrics.latency[label].add(time.monotonic() - start)
+        return result
+    
+    @staticmethod
+    def _trace_request(messages: List[BaseMessage],
+                       phase: Optional[str],
+                       prompt_tokens: int,
+                       history_tokens: int,
+                       tier: str,
+                       params: Dict[str, Any]):
+        request_span = current_span()
+        if not request_span.recording:
+            return
+        request_span.update(
+            phase=phase,
+            tier=tier,
+            **params,
+            messages=len(messages),
+            prompt_chars=sum(len(msg.content) for msg in messages),
+            prompt_tokens_estimate=prompt_tokens,
+            history_tokens=history_tokens,
+        )
+    
+    @staticmethod
+    def _trace_result(result: Dict[str, Any], deployment: Optional[Deployment] = None):
+        current_span().update(
+            deployment=deployment.name if deployment else None,
+            response_chars=len(result.get("content") or ""),
+            **{f"usage.{key}": value for key, value in result.get("usage", {}).items()},
+        )
     
+    def deployments_snapshot(self) -> Dict[str, Any]:
+        """各部署的负载、延迟与熔断状态"""
+        snapshot = {
+            "chat": self.chat_pool.snapshot(),
+            "chat_tiers": {name: pool.snapshot() for name, pool in self.chat_tiers.items()},
+            "embedding": self.embedding_pool.snapshot(),
+        }
+        if settings.LLM_CASSETTE_MODE != "off":
+            snapshot["cassette"] = get_cassette().stats()
+        return snapshot
+    
+    @traced("llm.generate_response")
     async def generate_response(self,
                                system_prompt: str,
                                user_message: str,
-                               conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, any]:
-        """使用LangChain生成响应"""
+                               conversation_history: Optional[List[Dict[str, str]]] = None,
+                               priority: RequestPriority = RequestPriority.INTERACTIVE,
+                               phase: Optional[str] = None,
+                               timeout: Optional[float] = None,
+                               temperature: Optional[float] = None,
+                               max_tokens: Optional[int] = None,
+                               use_cache: bool = True,
+                               cache_query: Optional[str] = None) -> Dict[str, any]:
+        """使用LangChain生成响应（部署池与采样参数按阶段选择，见 LLM_PHASE_MODELS）
+        
+        use_cache=False 时跳过响应缓存查询（重新生成时需要新的回答）；
+        cache_query 为 user_message 中的用户原始输入，响应缓存的语义匹配只比较这段文本。
+        """
         
         try:
-            # 构建消息列表
-            messages = [SystemMessage(content=system_prompt)]
+            tier, pool, params = self._phase_model(phase, temperature, max_tokens)
+            messages, prompt_tokens, history_tokens = await self._build_messages(system_prompt, user_message, conversation_history)
+            self._trace_request(messages, phase, prompt_tokens, history_tokens, tier, params)
             
-            # 添加历史消息（控制token数量）
-            if conversation_history:
-                total_tokens = self.count_tokens(system_prompt)
-                for msg in reversed(conversation_history):
-                    msg_tokens = self.count_tokens(msg["content"])
-                    if total_tokens + msg_tokens > 16000:
-                        break
-                    
-                    if msg["role"] == "user":
-                        messages.insert(1, HumanMessage(content=msg["content"]))
-                    elif msg["role"] == "assistant":
-                        messages.insert(1, AIMessage(content=msg["content"]))
-                    
-                    total_tokens += msg_tokens
+            cached, cache_entry = await self._cache_lookup(pool, params, messages, use_cache, cache_query)
+            current_span().set("response_cache_hit", cached is not None)
+            if cached is not None:
+                return cached
+            self.metrics.record_prompt(phase or "default", prompt_tokens, history_tokens)
             
-            # 添加当前用户消息
-            messages.append(HumanMessage(content=user_message))
+            # 调用模型（采样参数按调用传入，客户端本身不设置动态参数）
+            estimated_tokens = prompt_tokens + params.get("max_tokens", settings.RATE_LIMIT_COMPLETION_ESTIMATE)
+            deployment, response = await self._guarded_call(
+                phase, timeout,
+                lambda attempts: self._route(
+                    pool, estimated_tokens, priority,
+                    lambda d: d.client.ainvoke(messages, **self._invoke_params(d, params)),
+                    attempts
+                ),
+                hedge=True
+            )
             
-            # 调用模型（不传递任何额外参数）
-            response = await self.chat_model.ainvoke(messages)
-            
-            # 计算token使用
-            prompt_tokens = sum(self.count_tokens(msg.content) for msg in messages)
-            completion_tokens = self.count_tokens(response.content)
+            result = await self._build_result(response.content, prompt_tokens, response.usage_metadata, deployment.name)
+            self._trace_result(result, deployment)
+            self.metrics.record_usage(phase or "default", result["usage"], response.usage_metadata is not None)
+            self.metrics.record_completion(phase or "default", tier, result["usage"]["completion_tokens"])
+            if deployment.rate_limiter:
+                # 响应头中的余量优先，没有时用实际用量修正预估值
+                if not deployment.rate_limiter.update_from_headers(response.response_metadata.get("headers")):
+                    deployment.rate_limiter.reconcile(estimated_tokens, result["usage"]["total_tokens"])
+            await self._cache_store(cache_entry, result)
+            return result
             
+        except Exception as e:
             return {
-                "success": True,
-                "content": response.content,
-                "usage": {
-                    "prompt_tokens": prompt_tokens,
-                    "completion_tokens": completion_tokens,
-                    "total_tokens": prompt_tokens + completion_tokens
-                },
-                "model": settings.AZURE_OPENAI_DEPLOYMENT_NAME
+                "success": False,
+                "error": str(e),
+                "content": None
             }
+    
+    @traced("llm.stream_response")
+    async def stream_response(self,
+                             system_prompt: str,
+                             user_message: str,
+                             conversation_history: Optional[List[Dict[str, str]]] = None,
+                             on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+                             priority: RequestPriority = RequestPriority.INTERACTIVE,
+                             phase: Optional[str] = None,
+                             timeout: Optional[float] = None,
+                             temperature: Optional[float] = None,
+                             max_tokens: Optional[int] = None,
+                             use_cache: bool = True,
+                             cache_query: Optional[str] = None) -> Dict[str, Any]:
+        """流式生成响应，每收到一个token回调一次 on_token，返回结构与 generate_response 相同"""
+        
+        try:
+            tier, pool, params = self._phase_model(phase, temperature, max_tokens)
+            messages, prompt_tokens, history_tokens = await self._build_messages(system_prompt, user_message, conversation_history)
+            self._trace_request(messages, phase, prompt_tokens, history_tokens, tier, params)
+            
+            cached, cache_entry = await self._cache_lookup(pool, params, messages, use_cache, cache_query)
+            current_span().set("response_cache_hit", cached is not None)
+            if cached is not None:
+                # 缓存命中时一次性回放完整内容
+                if on_token and cached["content"]:
+                    await on_token(cached["content"])
+                return cached
+            self.metrics.record_prompt(phase or "default", prompt_tokens, history_tokens)
+            
+            parts: List[str] = []
+            usage_metadata = None
+            headers = None
+            
+            async def consume(deployment: Deployment):
+                nonlocal usage_metadata, headers
+                async for chunk in deployment.client.astream(messages, **self._invoke_params(deployment, params)):
+                    # 响应头附带在第一个chunk上，服务端用量（如果返回）附带在最后的chunk上
+                    if chunk.response_metadata.get("headers"):
+                        headers = chunk.response_metadata["headers"]
+                    if chunk.usage_metadata:
+                        usage_metadata = chunk.usage_metadata
+                    token = chunk.content
+                    if not token:
+                        continue
+                    parts.append(token)
+                    if on_token:
+                        await on_token(token)
+            
+            estimated_tokens = prompt_tokens + params.get("max_tokens", settings.RATE_LIMIT_COMPLETION_ESTIMATE)
+            # 已推送给客户端的token无法撤回，因此流式调用不做对冲，且只在尚未输出token时切换部署
+            deployment, _ = await self._guarded_call(
+                phase, timeout,
+                lambda attempts: self._route(
+                    pool, estimated_tokens, priority, consume, attempts,
+                    can_failover=lambda: not parts
+                )
+            )
+            
+            result = await self._build_result("".join(parts), prompt_tokens, usage_metadata, deployment.name)
+            self._trace_result(result, deployment)
+            self.metrics.record_usage(phase or "default", result["usage"], usage_metadata is not None)
+            self.metrics.record_completion(phase or "default", tier, result["usage"]["completion_tokens"])
+            if deployment.rate_limiter:
+                if not deployment.rate_limiter.update_from_headers(headers):
+                    deployment.rate_limiter.reconcile(estimated_tokens, result["usage"]["total_tokens"])
+            await self._cache_store(cache_entry, result)
+            return result
             
         except Exception as e:
             return {
@@ -80,23 +543,177 @@ class LLMService:
             }
     
     def count_tokens(self, text: str) -> int:
-        """计算文本的token数量"""
-        return len(self.encoding.encode(text))
+        """计算文本的token数量（按内容hash缓存）"""
+        return count_tokens(text)
     
+    async def count_tokens_async(self, text: str) -> int:
+        """计算token数量；长文本在线程池中编码"""
+        return await count_tokens_async(text)
+    
+    @traced("llm.generate_embedding")
     async def generate_embedding(self, text: str) -> Optional[List[float]]:
-        """使用LangChain生成文本嵌入"""
+        """使用LangChain生成文本嵌入（嵌入缓存读写出错时绕过缓存）"""
         try:
-            embedding = await self.embeddings.aembed_query(text)
+            model = self.embedding_pool.model_name
+            current_span().set("text_chars", len(text))
+            if self.embedding_cache:
+                try:
+                    cached = (await self.embedding_cache.get_many(model, [text]))[0]
+                except Exception as e:
+                    print(f"Embedding cache read error: {e}")
+                    cached = None
+                current_span().set("embedding_cache_hit", cached is not None)
+                if cached is not None:
+                    return cached
+            
+            # 只在需要调用部署时计算token数（限流估算）
+            tokens = self.count_tokens(text)
+            current_span().set("tokens", tokens)
+            _, embedding = await self._route(
+                self.embedding_pool, tokens, RequestPriority.INTERACTIVE,
+                lambda d: d.client.aembed_query(text)
+            )
+            
+            if self.embedding_cache:
+                try:
+                    await self.embedding_cache.set_many(model, [text], [embedding])
+                except Exception as e:
+                    print(f"Embedding cache write error: {e}")
             return embedding
         except Exception as e:
             print(f"Embedding generation error: {e}")
             return None
     
-    async def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """批量生成嵌入"""
+    @traced("llm.generate_embeddings_batch")
+    async def generate_embeddings_batch(self,
+                                        texts: List[str],
+                                        priority: RequestPriority = RequestPriority.BACKGROUND) -> List[Optional[List[float]]]:
+        """批量生成嵌入，返回与输入一一对应的列表，失败的位置为 None
+        
+        已缓存的文本和批内重复文本不会重复请求；嵌入缓存读写出错时绕过缓存直接请求。
+        """
+        batch_span = current_span()
+        if batch_span.recording:
+            batch_span.update(texts=len(texts), text_chars=sum(len(text) for text in texts))
         try:
-            embeddings = await self.embeddings.aembed_documents(texts)
-            return embeddings
+            if not self.embedding_cache:
+                return await self._embed_documents(texts, priority)
+            return await self._embed_documents_cached(texts, priority)
         except Exception as e:
             print(f"Batch embedding error: {e}")
-            return []
\ No newline at end of file
+            return [None] * len(texts)
+    
+    async def _embed_documents_cached(self,
+                                      texts: List[str],
+                                      priority: RequestPriority) -> List[Optional[List[float]]]:
+        """先查嵌入缓存，只请求缺失的文本并写回缓存"""
+        model = self.embedding_pool.model_name
+        try:
+            results = await self.embedding_cache.get_many(model, texts)
+        except Exception as e:
+            print(f"Embedding cache read error: {e}")
+            return await self._embed_documents(texts, priority)
+        
+        # 按归一化文本去重后只请求缺失部分
+        missing: Dict[str, str] = {}
+        for text, result in zip(texts, results):
+            if result is None:
+                missing.setdefault(self.embedding_cache.normalize(text), text)
+        
+        current_span().set("embedding_cache_misses", len(missing))
+        if missing:
+            missing_texts = list(missing.values())
+            embeddings = await self._embed_documents(missing_texts, priority)
+            try:
+                await self.embedding_cache.set_many(model, missing_texts, embeddings)
+            except Exception as e:
+                print(f"Embedding cache write error: {e}")
+            
+            fetched = {
+                normalized: embedding
+                for normalized, embedding in zip(missing.keys(), embeddings)
+            }
+            results = [
+                result if result is not None else fetched.get(self.embedding_cache.normalize(text))
+                for text, result in zip(texts, results)
+            ]
+        
+        return results
+    
+    def _plan_embedding_batches(self, texts: List[str]) -> List[List[int]]:
+        """按部署单次请求的条数与token上限切分子批次（返回下标）"""
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        
+        for idx, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if current and (len(current) >= settings.EMBEDDING_BATCH_MAX_ITEMS
+                            or current_tokens + tokens > settings.EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(idx)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _embed_documents(self,
+                               texts: List[str],
+                               priority: RequestPriority) -> List[Optional[List[float]]]:
+        """切分子批次并发请求，失败的子批次重试/对半拆分，最终失败的位置为 None"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        if not texts:
+            return results
+        
+        batches = await asyncio.to_thread(self._plan_embedding_batches, texts)
+        await asyncio.gather(*(
+            self._embed_sub_batch(texts, indices, results, priority) for indices in batches
+        ))
+        
+        failed = [idx for idx, result in enumerate(results) if result is None]
+        if failed:
+            print(f"Batch embedding failed for {len(failed)}/{len(texts)} texts: {failed}")
+        return results
+    
+    async def _embed_sub_batch(self,
+                               texts: List[str],
+                               indices: List[int],
+                               results: List[Optional[List[float]]],
+                               priority: RequestPriority):
+        """带指数退避重试的子批次请求；重试耗尽后对半拆分，定位到具体失败的文本"""
+        batch = [texts[idx] for idx in indices]
+        batch_tokens = sum(self.count_tokens(text) for text in batch)
+        last_error: Optional[Exception] = None
+        
+        for attempt in range(settings.EMBEDDING_MAX_RETRIES + 1):
+            try:
+                async with self.embedding_semaphore:
+                    _, embeddings = await self._route(
+                        self.embedding_pool, batch_tokens, priority,
+                        lambda d: d.client.aembed_documents(batch)
+                    )
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} embeddings, got {len(embeddings)}")
+                for idx, embedding in zip(indices, embeddings):
+                    results[idx] = embedding
+                return
+            except NON_RETRYABLE_ERRORS as e:
+                print(f"Batch embedding error: {e}")
+                return
+            except Exception as e:
+                last_error = e
+                if attempt < settings.EMBEDDING_MAX_RETRIES:
+                    delay = settings.EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt)
+                    await asyncio.sleep(delay * (1 + random.random() * 0.25))
+        
+        if len(indices) > 1:
+            mid = len(indices) // 2
+            await asyncio.gather(
+                self._embed_sub_batch(texts, indices[:mid], results, priority),
+                self._embed_sub_batch(texts, indices[mid:], results, priority),
+            )
+            return
+        
+        print(f"Embedding error for text #{indices[0]}: {last_error}")
@@ -1,5 +1,7 @@
 from app.services.llm_service import LLMService
 from app.services.vector_service import VectorService
+from app.services.rate_limiter import RequestPriority
+from app.utils.tracing import current_span, traced
 from typing import List, Dict, Optional, Any
 import re
 from langchain_qdrant import QdrantVectorStore
@@ -9,9 +11,11 @@ from langchain_core.documents import Document
 class RAGService:
     """RAG 检索增强生成服务"""
     
-    def __init__(self):
-        self.llm_service = LLMService()
-        self.vector_service = VectorService()
+    def __init__(self,
+                 llm_service: Optional[LLMService] = None,
+                 vector_service: Optional[VectorService] = None):
+        self.llm_service = llm_service or LLMService()
+        self.vector_service = vector_service or VectorService()
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """智能文本分块"""
@@ -99,10 +103,11 @@ class RAGService:
             
             # 批量生成嵌入（使用LangChain）
             texts = [chunk.page_content for chunk in chunks]
-            embeddings = await self.llm_service.generate_embeddings_batch(texts)
+            embeddings = await self.llm_service.generate_embeddings_batch(texts, priority=RequestPriority.BACKGROUND)
             
             # 存储到向量数据库
             stored_chunks = []
+            failed_chunks = []
             for chunk, embedding in zip(chunks, embeddings):
                 if embedding:
                     point_id = await self.vector_service.add_document(
@@ -111,21 +116,29 @@ class RAGService:
                         metadata=chunk.metadata
                     )
                     stored_chunks.append(point_id)
+                else:
+                    failed_chunks.append(chunk.metadata["chunk_index"])
             
-            return {
-                "success": True,
+            result = {
+                "success": bool(stored_chunks) or not chunks,
                 "chunks_count": len(chunks),
-                "stored_count": len(stored_chunks)
+                "stored_count": len(stored_chunks),
+                "failed_chunks": failed_chunks
             }
+            if not result["success"]:
+                result["error"] = "Embedding failed for all chunks"
+            return result
         except Exception as e:
             print(f"Vectorization error: {e}")
             return {
                 "success": False,
                 "chunks_count": 0,
                 "stored_count": 0,
+                "failed_chunks": [],
                 "error": str(e)
             }
     
+    @traced("rag.retrieve_context")
     async def retrieve_context(self,
                               query: str,
                               project_id: int,
@@ -133,6 +146,8 @@ class RAGService:
                               file_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """检索相关上下文"""
         
+        current_span().update(project_id=project_id, top_k=top_k, query_chars=len(query))
+        
         # 生成查询嵌入
         query_embedding = await self.llm_service.generate_embedding(query)
         
@@ -149,6 +164,7 @@ class RAGService:
             filters=filters
         )
         
+        current_span().set("results", len(results))
         return results
     
     async def summarize_file(self, content: str, filename: str) -> Dict[str, Any]:
@@ -174,7 +190,9 @@ Tag: [semantic tag]
             system_prompt="You are a code analyzer. Be concise and accurate.",
             user_message=prompt,
             temperature=0.3,
-            max_tokens=300
+            max_tokens=300,
+            priority=RequestPriority.BACKGROUND,
+            phase="summarize_file"
         )
         
         if response["success"]:
@@ -0,0 +1,147 @@
+from enum import IntEnum
+from typing import List, Mapping, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import time
+
+class RequestPriority(IntEnum):
+    """请求优先级（数值越小越优先）"""
+    INTERACTIVE = 0  # 聊天工作流
+    BACKGROUND = 1   # 文件向量化、文件摘要等后台任务
+    BATCH = 2        # 批量工作流（/api/chat/batch），配额紧张时让出给其他请求
+
+class TokenBucket:
+    """按秒匀速补充的令牌桶"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else 1.0
+
+    def set_limit(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = min(self.level, self.capacity)
+
+class RateLimiter:
+    """客户端自适应限流器（RPM + TPM 双令牌桶，按优先级排队）
+
+    - 调用方在发送请求前 acquire，额度不足时排队等待而不是失败
+    - 同一时刻只有队首（优先级最高、最早到达）的请求可以消耗额度，
+      因此交互式请求总是排在后台任务之前
+    - 根据 Azure 返回的 x-ratelimit-* 响应头校准桶内余量，遇到 429 时按 retry-after 暂停
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+
+        self._cond = asyncio.Condition()
+        self._waiters: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, tokens: int, priority: RequestPriority = RequestPriority.INTERACTIVE):
+        """等待直到可以发送一个消耗 tokens 个token的请求"""
+        # 单个请求超过桶容量时按容量计算，避免永远等待
+        tokens = min(float(tokens), self.tokens.capacity)
+        entry = (int(priority), next(self._seq))
+
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+
+                    wait = None
+                    if self._waiters[0] == entry:
+                        wait = max(
+                            self.blocked_until - now,
+                            self.requests.time_until(1),
+                            self.tokens.time_until(tokens),
+                        )
+                        if wait <= 0:
+                            heapq.heappop(self._waiters)
+                            self.requests.level -= 1
+                            self.tokens.level -= tokens
+                            self._cond.notify_all()
+                            return
+
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                # 取消或异常时移出队列，唤醒下一个
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """请求完成后用实际用量修正预估值"""
+        self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated_tokens - actual_tokens)
+
+    def update_from_headers(self, headers: Optional[Mapping[str, str]]) -> bool:
+        """根据 x-ratelimit-* 响应头校准余量
+
+        返回是否按响应头同步了token余量（服务端余量已包含本次请求的实际用量，此时不再 reconcile）。
+        """
+        if not headers:
+            return False
+
+        synced = False
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _parse_number(headers.get(f"x-ratelimit-limit-{kind}"))
+            if limit:
+                bucket.set_limit(int(limit))
+            remaining = _parse_number(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if remaining is None:
+                continue
+            if remaining < bucket.level:
+                bucket.level = remaining
+            if bucket is self.tokens:
+                synced = True
+        return synced
+
+    def penalize(self, retry_after: Optional[float]):
+        """收到 429 后暂停所有请求 retry_after 秒"""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + (retry_after or 1.0))
+        self.requests.level = min(self.requests.level, 0)
+        self.tokens.level = min(self.tokens.level, 0)
+
+def _parse_number(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """解析 retry-after-ms / retry-after 响应头（秒）"""
+    if not headers:
+        return None
+    retry_after_ms = _parse_number(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000.0
+    return _parse_number(headers.get("retry-after"))
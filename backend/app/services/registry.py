@@ -0,0 +1,68 @@
+from fastapi import Request
+from app.config import settings
+from app.services.llm_service import LLMService
+from app.services.vector_service import VectorService
+from app.services.rag_service import RAGService
+from app.core.langgraph_workflow import LangGraphWorkflow
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+import httpx
+
+class ServiceRegistry:
+    """进程级服务注册表
+
+    在 FastAPI lifespan 中创建一次，持有所有共享服务实例，
+    并为每个上游（scheme://host:port）维护一个 keep-alive 连接池，
+    使所有阶段和请求复用 TLS 握手与连接。
+    """
+
+    def __init__(self):
+        self._http_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+
+        self.llm_service = LLMService(http_client_factory=self.get_http_clients)
+        self.vector_service = VectorService()
+        self.rag_service = RAGService(llm_service=self.llm_service, vector_service=self.vector_service)
+        self.langgraph_workflow = LangGraphWorkflow(llm_service=self.llm_service, rag_service=self.rag_service)
+
+    def get_http_clients(self, endpoint: str) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        """获取（必要时创建）某个上游的同步/异步连接池"""
+        parts = urlsplit(endpoint)
+        upstream = f"{parts.scheme}://{parts.netloc}"
+
+        if upstream not in self._http_clients:
+            limits = httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            )
+            timeout = httpx.Timeout(settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+            self._http_clients[upstream] = (
+                httpx.Client(limits=limits, timeout=timeout),
+                httpx.AsyncClient(limits=limits, timeout=timeout),
+            )
+
+        return self._http_clients[upstream]
+
+    async def aclose(self):
+        """关闭所有连接池"""
+        for http_client, http_async_client in self._http_clients.values():
+            http_client.close()
+            await http_async_client.aclose()
+        self._http_clients.clear()
+
+
+# 依赖注入
+def get_registry(request: Request) -> ServiceRegistry:
+    return request.app.state.registry
+
+def get_llm_service(request: Request) -> LLMService:
+    return get_registry(request).llm_service
+
+def get_vector_service(request: Request) -> VectorService:
+    return get_registry(request).vector_service
+
+def get_rag_service(request: Request) -> RAGService:
+    return get_registry(request).rag_service
+
+def get_workflow(request: Request) -> LangGraphWorkflow:
+    return get_registry(request).langgraph_workflow
@@ -0,0 +1,202 @@
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import asyncio
+import time
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+class LLMTimeoutError(Exception):
+    """LLM调用超过截止时间"""
+
+class CircuitBreaker:
+    """熔断器
+
+    - closed: 正常放行；连续失败达到阈值后转为 open
+    - open: 直接拒绝，recovery_timeout 秒后转为 half_open
+    - half_open: 只放行一个探测请求，成功则 closed，失败则重新 open
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self.rejected_count = 0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        """调用前检查，不允许时抛出 CircuitOpenError"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected_count += 1
+                raise CircuitOpenError("LLM deployment is degraded (circuit open)")
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.rejected_count += 1
+                raise CircuitOpenError("LLM deployment is degraded (circuit half-open, probing)")
+            self._probe_in_flight = True
+
+    def available(self) -> bool:
+        """当前是否可以接受请求（不改变状态，用于部署选择）"""
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.recovery_timeout
+        if self.state == "half_open":
+            return not self._probe_in_flight
+        return True
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        self.state = "closed"
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened_count += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """调用既未成功也未计为失败（例如客户端错误）时释放探测名额"""
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_count": self.opened_count,
+            "rejected_count": self.rejected_count,
+        }
+
+class LatencyTracker:
+    """滑动窗口延迟统计"""
+
+    def __init__(self, window: int = 200):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def mean(self) -> Optional[float]:
+        if not self.samples:
+            return None
+        return sum(self.samples) / len(self.samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[idx]
+
+class LLMMetrics:
+    """LLM调用指标（按阶段统计延迟、超时与对冲）"""
+
+    def __init__(self):
+        self.latency: Dict[str, LatencyTracker] = defaultdict(LatencyTracker)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.timeouts: Dict[str, int] = defaultdict(int)
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        # 服务端返回用量的调用数、prompt token总数、其中命中提示词缓存的token数
+        self.usage_reports: Dict[str, int] = defaultdict(int)
+        self.prompt_tokens: Dict[str, int] = defaultdict(int)
+        self.cached_tokens: Dict[str, int] = defaultdict(int)
+        # 发送给模型的估算prompt token数，以及其中对话历史占用的部分（不含响应缓存命中）
+        self.estimated_prompt_tokens: Dict[str, int] = defaultdict(int)
+        self.history_tokens: Dict[str, int] = defaultdict(int)
+        # 各阶段最近使用的部署池与输出token数（用于调整 LLM_PHASE_MODELS）
+        self.tiers: Dict[str, str] = {}
+        self.completion_tokens: Dict[str, int] = defaultdict(int)
+        self.completions: Dict[str, int] = defaultdict(int)
+
+    def record_usage(self, phase: str, usage: Dict[str, int], reported: bool):
+        """记录一次调用的token用量（仅统计服务端返回的真实用量）"""
+        if not reported:
+            return
+        self.usage_reports[phase] += 1
+        self.prompt_tokens[phase] += usage.get("prompt_tokens", 0)
+        self.cached_tokens[phase] += usage.get("cached_tokens", 0)
+
+    def record_prompt(self, phase: str, prompt_tokens: int, history_tokens: int):
+        """记录一次调用的估算prompt大小（用于衡量各阶段上下文策略的效果）"""
+        self.estimated_prompt_tokens[phase] += prompt_tokens
+        self.history_tokens[phase] += history_tokens
+    
+    def record_completion(self, phase: str, tier: str, completion_tokens: int):
+        """记录一次成功调用所用的部署池与输出token数"""
+        self.tiers[phase] = tier
+        self.completions[phase] += 1
+        self.completion_tokens[phase] += completion_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        phases = {}
+        for phase in set(self.calls) | set(self.timeouts):
+            tracker = self.latency[phase]
+            calls = self.calls[phase]
+            completions = self.completions[phase]
+            phases[phase] = {
+                "tier": self.tiers.get(phase),
+                "calls": self.calls[phase],
+                "failures": self.failures[phase],
+                "timeouts": self.timeouts[phase],
+                "mean_seconds": tracker.mean(),
+                "p50_seconds": tracker.percentile(0.5),
+                "p95_seconds": tracker.percentile(0.95),
+                "p99_seconds": tracker.percentile(0.99),
+                "usage_reports": self.usage_reports[phase],
+                "prompt_tokens": self.prompt_tokens[phase],
+                "cached_tokens": self.cached_tokens[phase],
+                "cache_hit_ratio": (self.cached_tokens[phase] / self.prompt_tokens[phase]
+                                    if self.prompt_tokens[phase] else None),
+                "estimated_prompt_tokens": self.estimated_prompt_tokens[phase],
+                "history_tokens": self.history_tokens[phase],
+                "avg_prompt_tokens": self.estimated_prompt_tokens[phase] / calls if calls else None,
+                "avg_history_tokens": self.history_tokens[phase] / calls if calls else None,
+                "avg_completion_tokens": self.completion_tokens[phase] / completions if completions else None,
+            }
+        return {
+            "phases": phases,
+            "hedges_sent": self.hedges_sent,
+            "hedge_wins": self.hedge_wins,
+        }
+
+async def hedged_call(factory: Callable[[], Awaitable[Any]],
+                      hedge_delay: Optional[float],
+                      metrics: Optional[LLMMetrics] = None) -> Any:
+    """对冲请求：主请求在 hedge_delay 秒内未完成时再发一个相同请求，取先成功的结果"""
+    if hedge_delay is None:
+        return await factory()
+
+    primary = asyncio.ensure_future(factory())
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    hedge = asyncio.ensure_future(factory())
+    if metrics:
+        metrics.hedges_sent += 1
+
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge and metrics:
+                        metrics.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
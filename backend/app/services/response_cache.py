@@ -0,0 +1,190 @@
+from app.config import settings
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# 全局单例
+_response_cache = None
+
+# make_keys 中替换查询文本的占位符
+QUERY_PLACEHOLDER = "\x00query\x00"
+
+def get_response_cache():
+    """获取LLM响应缓存单例"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            path=settings.RESPONSE_CACHE_PATH,
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            semantic_threshold=settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD,
+        )
+    return _response_cache
+
+class ResponseCache:
+    """LLM响应缓存（SQLite持久化，TTL + LRU淘汰）
+
+    两级查找：
+    - 精确匹配：key = hash(deployment, 系统提示词, 裁剪后的历史, 用户消息)
+    - 语义匹配（可选）：在相同上下文（deployment + 系统提示词 + 历史 + 去掉查询文本后的用户消息）下，
+      查询文本（用户的原始输入，而不是整段阶段提示词）嵌入的余弦相似度超过阈值即视为命中
+    """
+
+    def __init__(self,
+                 path: str,
+                 ttl_seconds: int = 7 * 24 * 3600,
+                 max_entries: int = 5000,
+                 semantic_threshold: float = 0.97):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                context_key TEXT NOT NULL,
+                response TEXT NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_responses_context ON llm_responses (context_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_responses_access ON llm_responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_keys(deployment: str,
+                  messages: List[Tuple[str, str]],
+                  query: Optional[str] = None) -> Tuple[str, str]:
+        """根据 deployment 与 (role, content) 消息列表生成 (精确key, 上下文key)
+        
+        最后一条消息视为当前用户消息。给出 query（嵌入在最后一条消息中的用户输入）时，
+        上下文key包含去掉 query 后的最后一条消息（阶段说明、前序阶段输出等），语义匹配只比较 query；
+        否则上下文key不包含最后一条消息。
+        """
+        last_role, last_content = messages[-1]
+        if query:
+            template = (last_role, last_content.replace(query, QUERY_PLACEHOLDER))
+            context = json.dumps([deployment, messages[:-1], template], ensure_ascii=False)
+            current = query
+        else:
+            context = json.dumps([deployment, messages[:-1]], ensure_ascii=False)
+            current = messages[-1]
+        context_key = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        exact = json.dumps([context_key, current], ensure_ascii=False)
+        return hashlib.sha256(exact.encode("utf-8")).hexdigest(), context_key
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """精确查找"""
+        result = await asyncio.to_thread(self._get, key)
+        if result is not None:
+            self.hits += 1
+        return result
+
+    async def get_semantic(self, context_key: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """语义查找（仅在相同上下文内比较）"""
+        result = await asyncio.to_thread(self._get_semantic, context_key, embedding)
+        if result is not None:
+            self.semantic_hits += 1
+        return result
+
+    def record_miss(self):
+        self.misses += 1
+
+    async def set(self,
+                  key: str,
+                  context_key: str,
+                  response: Dict[str, Any],
+                  embedding: Optional[List[float]] = None):
+        """写入缓存并按LRU淘汰"""
+        await asyncio.to_thread(self._set, key, context_key, response, embedding)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def _get_semantic(self, context_key: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, response, embedding FROM llm_responses "
+                "WHERE context_key = ? AND embedding IS NOT NULL AND created_at >= ?",
+                (context_key, now - self.ttl_seconds)
+            ).fetchall()
+        if not rows:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+        candidates = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        scores = candidates @ query / np.maximum(np.linalg.norm(candidates, axis=1), 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] < self.semantic_threshold:
+            return None
+
+        with self._lock:
+            self._conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, rows[best][0]))
+            self._conn.commit()
+        return json.loads(rows[best][1])
+
+    def _set(self,
+             key: str,
+             context_key: str,
+             response: Dict[str, Any],
+             embedding: Optional[List[float]]):
+        now = time.time()
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, context_key, response, embedding, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, context_key, json.dumps(response, ensure_ascii=False), blob, now, now)
+            )
+            # 清理过期条目，并按最近访问时间淘汰超出容量的条目
+            self._conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM llm_responses WHERE key IN ("
+                "SELECT key FROM llm_responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
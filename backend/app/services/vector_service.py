@@ -1,12 +1,15 @@
 from qdrant_client import QdrantClient
 from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
 from app.config import settings
+from app.utils.tracing import current_span, traced
 from typing import List, Dict, Optional, Any
 import uuid
 import os
 
 # 全局单例
 _qdrant_client = None
+# 已确认存在的集合（每个进程只检查一次）
+_ensured_collections = set()
 
 def get_qdrant_client():
     """获取Qdrant客户端单例"""
@@ -27,6 +30,8 @@ class VectorService:
     
     def _ensure_collection(self):
         """确保集合存在"""
+        if self.collection_name in _ensured_collections:
+            return
         try:
             collections = self.client.get_collections().collections
             exists = any(c.name == self.collection_name for c in collections)
@@ -40,6 +45,7 @@ class VectorService:
                     )
                 )
                 print(f"✅ Created Qdrant collection: {self.collection_name}")
+            _ensured_collections.add(self.collection_name)
         except Exception as e:
             print(f"⚠️  Qdrant collection check error: {e}")
     
@@ -67,6 +73,7 @@ class VectorService:
         
         return point_id
     
+    @traced("qdrant.search")
     async def search(self,
                     query_embedding: List[float],
                     limit: int = 5,
@@ -90,6 +97,7 @@ class VectorService:
         
         try:
             results = self.client.search(**search_params)
+            current_span().update(limit=limit, results=len(results))
             
             return [
                 {
@@ -0,0 +1,59 @@
+"""Token 计数（进程级缓存）"""
+from collections import OrderedDict
+import asyncio
+import hashlib
+import threading
+import tiktoken
+
+# 进程级token计数缓存（content hash -> token数），同一文本在进程内只编码一次
+TOKEN_COUNT_CACHE_SIZE = 8192
+# 超过该字符数的文本放到线程池中编码，避免阻塞事件循环
+TOKENIZE_OFFLOAD_CHARS = 8000
+
+_encoding = None
+_token_count_cache: "OrderedDict[str, int]" = OrderedDict()
+_token_count_lock = threading.Lock()
+
+def get_encoding():
+    """获取 cl100k_base 编码器单例"""
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """计算文本的token数量（按内容hash缓存）"""
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    with _token_count_lock:
+        count = _token_count_cache.get(key)
+        if count is not None:
+            _token_count_cache.move_to_end(key)
+            return count
+    
+    count = len(get_encoding().encode(text))
+    
+    with _token_count_lock:
+        _token_count_cache[key] = count
+        while len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+            _token_count_cache.popitem(last=False)
+    return count
+
+async def count_tokens_async(text: str) -> int:
+    """计算token数量；长文本在线程池中编码"""
+    if len(text) > TOKENIZE_OFFLOAD_CHARS:
+        return await asyncio.to_thread(count_tokens, text)
+    return count_tokens(text)
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """截断文本到前 max_tokens 个token"""
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+async def truncate_tokens_async(text: str, max_tokens: int) -> str:
+    """截断文本；长文本在线程池中编码"""
+    if len(text) > TOKENIZE_OFFLOAD_CHARS:
+        return await asyncio.to_thread(truncate_tokens, text, max_tokens)
+    return truncate_tokens(text, max_tokens)
@@ -0,0 +1,286 @@
+"""请求追踪：嵌套计时 span（contextvars 传播，asyncio 任务与 LangGraph 并行分支自动继承父 span）
+
+每个 API 请求一个 trace；结束后保存在内存中（供调试端点查询），并由后台线程按行追加到本地 JSONL 文件，
+不依赖外部采集器。
+"""
+from app.config import settings
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+class Span:
+    """一个计时区间"""
+    
+    recording = True
+    
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+    
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+    
+    def update(self, **attributes):
+        self.attributes.update(attributes)
+    
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": datetime.fromtimestamp(self.start_time, tz=timezone.utc).isoformat(),
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class _NoopSpan:
+    """未在追踪中（或追踪关闭）时返回的空 span（计算代价较高的属性先检查 recording）"""
+    
+    recording = False
+    
+    def set(self, key: str, value: Any):
+        pass
+    
+    def update(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    """一次请求的全部 span"""
+    
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.spans: List[Span] = []
+        self.finished = False
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """按父子关系嵌套的 span 树"""
+        nodes = {span.span_id: {**span.to_dict(), "children": []} for span in self.spans}
+        roots = []
+        for span in sorted(self.spans, key=lambda s: s.start_time):
+            node = nodes[span.span_id]
+            parent = nodes.get(span.parent_id)
+            (parent["children"] if parent else roots).append(node)
+        return {"trace_id": self.trace_id, "name": self.name, "spans": roots}
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+class TraceStore:
+    """最近完成的 trace（内存）+ JSONL 导出
+    
+    导出（序列化、写文件、轮转）在后台线程中进行，请求结束时只把 trace 放入队列，不阻塞事件循环；
+    队列满时丢弃该 trace 的导出（内存中仍可查询）。
+    """
+    
+    def __init__(self, max_traces: int, export_path: Optional[str], export_max_mb: int,
+                 export_queue_size: int = 1000):
+        self.max_traces = max_traces
+        self.export_path = export_path
+        self.export_max_bytes = export_max_mb * 1024 * 1024
+        self.export_dropped = 0
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._export_queue: "queue.Queue[Optional[Trace]]" = queue.Queue(maxsize=export_queue_size)
+        self._writer: Optional[threading.Thread] = None
+    
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces[trace.trace_id] = trace
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+            if self.export_path and self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-export", daemon=True)
+                self._writer.start()
+        if self.export_path:
+            try:
+                self._export_queue.put_nowait(trace)
+            except queue.Full:
+                self.export_dropped += 1
+    
+    def _write_loop(self):
+        while True:
+            trace = self._export_queue.get()
+            try:
+                if trace is None:
+                    return
+                self._export(trace)
+            finally:
+                self._export_queue.task_done()
+    
+    def _export(self, trace: Trace):
+        lines = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in trace.spans)
+        try:
+            os.makedirs(os.path.dirname(self.export_path) or ".", exist_ok=True)
+            # 超过大小上限时轮转为 .1（只保留一个旧文件）
+            if os.path.exists(self.export_path) and os.path.getsize(self.export_path) > self.export_max_bytes:
+                os.replace(self.export_path, self.export_path + ".1")
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except Exception as e:
+            print(f"Trace export error: {e}")
+    
+    def close(self, timeout: float = 5.0):
+        """写完队列中的 trace 并停止后台线程（同步阻塞，关闭时在线程池中调用）"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        self._export_queue.put(None)
+        writer.join(timeout)
+    
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(trace_id)
+    
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近的 trace 概要（新的在前）"""
+        with self._lock:
+            traces = list(self._traces.values())[-limit:]
+        summaries = []
+        for trace in reversed(traces):
+            root = next((s for s in trace.spans if s.parent_id is None), None)
+            summaries.append({
+                "trace_id": trace.trace_id,
+                "name": trace.name,
+                "start_time": root.to_dict()["start_time"] if root else None,
+                "duration_ms": root.to_dict()["duration_ms"] if root else None,
+                "span_count": len(trace.spans),
+                "error": root.error if root else None,
+            })
+        return summaries
+
+_trace_store: Optional[TraceStore] = None
+
+def get_trace_store() -> TraceStore:
+    """获取 trace 存储单例"""
+    global _trace_store
+    if _trace_store is None:
+        _trace_store = TraceStore(
+            max_traces=settings.TRACING_MAX_TRACES,
+            export_path=settings.TRACING_EXPORT_PATH or None,
+            export_max_mb=settings.TRACING_EXPORT_MAX_MB,
+        )
+    return _trace_store
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+def current_span() -> Any:
+    """当前 span（用于在被 @traced 装饰的函数内补充属性）；不在 trace 中时返回空 span"""
+    trace = _current_trace.get()
+    current = _current_span.get()
+    if trace is None or trace.finished or current is None:
+        return _NOOP_SPAN
+    return current
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Any]:
+    """在当前 trace 中记录一个子 span；不在 trace 中时不做任何记录"""
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        yield _NOOP_SPAN
+        return
+    
+    parent = _current_span.get()
+    current = Span(trace.trace_id, name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+        trace.spans.append(current)
+
+@contextmanager
+def start_trace(name: str, **attributes) -> Iterator[Any]:
+    """开始一个新的 trace（根 span），结束后保存并导出"""
+    if not settings.TRACING_ENABLED:
+        yield _NOOP_SPAN
+        return
+    
+    trace = Trace(name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.finished = True
+        get_trace_store().add(trace)
+
+def traced(name: str):
+    """装饰异步函数：整个调用记录为一个 span"""
+    
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+class TracingMiddleware:
+    """ASGI 中间件：每个 /api 请求一个 trace（包含流式响应的整个生命周期），响应头返回 X-Trace-Id"""
+    
+    def __init__(self, app, excluded_prefixes: tuple = ("/api/debug",)):
+        self.app = app
+        self.excluded_prefixes = excluded_prefixes
+    
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if (scope["type"] != "http" or not settings.TRACING_ENABLED
+                or not path.startswith("/api/") or path.startswith(self.excluded_prefixes)):
+            await self.app(scope, receive, send)
+            return
+        
+        with start_trace(f"{scope['method']} {path}", method=scope["method"], path=path) as root:
+            trace_id = current_trace_id()
+            response_bytes = 0
+            
+            async def send_wrapper(message):
+                nonlocal response_bytes
+                if message["type"] == "http.response.start":
+                    root.set("status_code", message["status"])
+                    message = {
+                        **message,
+                        "headers": list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode())],
+                    }
+                elif message["type"] == "http.response.body":
+                    response_bytes += len(message.get("body", b""))
+                await send(message)
+            
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                root.set("response_bytes", response_bytes)
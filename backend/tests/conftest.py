@@ -0,0 +1,33 @@
+import os
+import re
+import tempfile
+
+# Settings 的必填项（测试不访问 Azure OpenAI）；数据文件放在临时目录
+DATA_DIR = tempfile.mkdtemp(prefix="meta-agent-tests-")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9/")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{DATA_DIR}/meta_agent.db")
+os.environ.setdefault("QDRANT_PATH", f"{DATA_DIR}/qdrant")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+os.environ.setdefault("RESPONSE_CACHE_PATH", f"{DATA_DIR}/llm_responses.db")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", f"{DATA_DIR}/embeddings.db")
+os.environ.setdefault("TRACING_EXPORT_PATH", f"{DATA_DIR}/spans.jsonl")
+os.environ.setdefault("LLM_CASSETTE_MODE", "off")
+
+from app.utils import tokens
+
+
+class WordEncoding:
+    """离线替身编码器：按单词与标点切分（tiktoken 首次使用时需要联网下载 cl100k_base）"""
+
+    _pattern = re.compile(r"\w+|[^\w\s]")
+
+    def encode(self, text, **kwargs):
+        return self._pattern.findall(text)
+
+    def decode(self, token_list):
+        return " ".join(token_list)
+
+
+tokens._encoding = WordEncoding()
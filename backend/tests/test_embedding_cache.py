@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from app.services.embedding_cache import EmbeddingCache
+from app.services.llm_service import LLMService
+
+
+class FakeEmbeddings:
+    """替身嵌入客户端：记录请求的文本"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def aembed_query(self, text):
+        self.requests.append([text])
+        return [float(len(text)), 1.0]
+
+    async def aembed_documents(self, texts):
+        self.requests.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class BrokenCache(EmbeddingCache):
+    """读或写时抛出异常的嵌入缓存"""
+
+    def __init__(self, path, fail_get=False, fail_set=False):
+        super().__init__(path)
+        self.fail_get = fail_get
+        self.fail_set = fail_set
+
+    async def get_many(self, deployment, texts):
+        if self.fail_get:
+            raise OSError("cache read failed")
+        return await super().get_many(deployment, texts)
+
+    async def set_many(self, deployment, texts, embeddings):
+        if self.fail_set:
+            raise OSError("cache write failed")
+        return await super().set_many(deployment, texts, embeddings)
+
+
+def test_content_addressed_lookup(tmp_path):
+    """相同的归一化文本在同一部署下共享条目，不同部署互不影响"""
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+
+    async def main():
+        await cache.set_many("ada", ["hello", "world"], [[1.0, 2.0], [3.0, 4.0]])
+        return (
+            await cache.get_many("ada", [" hello\n", "world", "missing"]),
+            await cache.get_many("other", ["hello"]),
+        )
+
+    found, other = asyncio.run(main())
+    assert found == [[1.0, 2.0], [3.0, 4.0], None]
+    assert other == [None]
+    assert cache.stats() == {"entries": 2, "bytes": 16, "hits": 2, "misses": 2}
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    asyncio.run(EmbeddingCache(path).set_many("ada", ["hello"], [[0.5, 0.25]]))
+
+    reopened = EmbeddingCache(path)
+    assert asyncio.run(reopened.get_many("ada", ["hello"])) == [[0.5, 0.25]]
+    assert reopened.stats()["bytes"] == 8
+
+
+def test_evicts_least_recently_used_over_capacity(tmp_path, monkeypatch):
+    """超出容量时按最近访问时间淘汰（每个条目 2 个 float32 = 8 字节）"""
+    now = [1000.0]
+    monkeypatch.setattr("app.services.embedding_cache.time.time", lambda: now[0])
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"), max_bytes=16)
+
+    async def main():
+        for text in ("a", "b"):
+            await cache.set_many("ada", [text], [[1.0, 1.0]])
+            now[0] += 1
+        await cache.get_many("ada", ["a"])
+        now[0] += 1
+        await cache.set_many("ada", ["c"], [[1.0, 1.0]])
+        return await cache.get_many("ada", ["a", "b", "c"])
+
+    assert asyncio.run(main()) == [[1.0, 1.0], None, [1.0, 1.0]]
+    assert cache.stats()["bytes"] == 16
+
+
+@pytest.fixture
+def llm_service():
+    service = LLMService()
+    client = FakeEmbeddings()
+    for deployment in service.embedding_pool.deployments:
+        deployment.client = client
+    return service, client
+
+
+@pytest.mark.parametrize("fail_get, fail_set", [(True, False), (False, True), (True, True)])
+def test_embedding_falls_back_when_cache_fails(llm_service, tmp_path, fail_get, fail_set):
+    """嵌入缓存读写出错时仍返回API生成的嵌入"""
+    service, client = llm_service
+    service.embedding_cache = BrokenCache(str(tmp_path / "embeddings.db"), fail_get, fail_set)
+
+    assert asyncio.run(service.generate_embedding("hello")) == [5.0, 1.0]
+    assert asyncio.run(service.generate_embeddings_batch(["a", "bb"])) == [[1.0, 1.0], [2.0, 1.0]]
+    assert client.requests == [["hello"], ["a", "bb"]]
+
+
+def test_batch_requests_only_missing_texts(llm_service, tmp_path):
+    """已缓存的文本与批内重复文本不会重复请求"""
+    service, client = llm_service
+    service.embedding_cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+
+    async def main():
+        await service.generate_embeddings_batch(["a", "bb"])
+        return await service.generate_embeddings_batch(["a", "ccc", "ccc ", "bb"])
+
+    assert asyncio.run(main()) == [[1.0, 1.0], [3.0, 1.0], [3.0, 1.0], [2.0, 1.0]]
+    assert client.requests == [["a", "bb"], ["ccc"]]
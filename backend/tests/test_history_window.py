@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+
+from app.models.database import AsyncSessionLocal, Project, engine, init_db
+from app.services import conversation_service
+from app.services.conversation_service import ConversationService
+
+project_names = (f"history-{index}" for index in itertools.count())
+
+
+def run(coro):
+    async def main():
+        try:
+            await init_db()
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+async def new_conversation(db):
+    project = Project(name=next(project_names))
+    db.add(project)
+    await db.commit()
+    conversation = await ConversationService.create_conversation(db, project.id, "history")
+    return conversation.id
+
+
+def contents(history):
+    return [(entry["role"], entry["content"]) for entry in history]
+
+
+def test_window_excludes_current_message_over_budget():
+    """当前消息超出预算时不在窗口中，之前的消息不能被当作当前消息切掉"""
+    async def main():
+        async with AsyncSessionLocal() as db:
+            conversation_id = await new_conversation(db)
+            await ConversationService.add_message(db, conversation_id, "user", "add pagination")
+            await ConversationService.add_message(db, conversation_id, "assistant", "done")
+            current = await ConversationService.add_message(db, conversation_id, "user", "word " * 100)
+
+            history = await ConversationService.get_history_window(
+                db, conversation_id, before_id=current.id, max_tokens=50
+            )
+            return contents(history)
+
+    assert run(main()) == [("user", "add pagination"), ("assistant", "done")]
+
+
+def test_cached_window_matches_history_before():
+    """每轮增量更新的缓存窗口与直接查询的当前消息之前的历史一致（含从头部淘汰超出预算的消息）"""
+    async def main():
+        windows, expected = [], []
+        async with AsyncSessionLocal() as db:
+            conversation_id = await new_conversation(db)
+            for turn in range(6):
+                current = await ConversationService.add_message(db, conversation_id, "user", f"question {turn}")
+                windows.append(contents(await ConversationService.get_history_window(
+                    db, conversation_id, before_id=current.id, max_tokens=12
+                )))
+                expected.append(contents(await ConversationService.get_history_before(
+                    db, conversation_id, current.id, max_tokens=12
+                )))
+                await ConversationService.add_message(db, conversation_id, "assistant", f"answer {turn}")
+            return conversation_id, windows, expected
+
+    conversation_id, windows, expected = run(main())
+    assert windows == expected
+    assert windows[0] == []
+    assert windows[-1][-1] == ("assistant", "answer 4")
+    assert conversation_id in conversation_service._history_windows
+
+
+def test_window_cached_past_current_message():
+    """缓存的窗口已包含当前消息时改为直接查询"""
+    async def main():
+        async with AsyncSessionLocal() as db:
+            conversation_id = await new_conversation(db)
+            await ConversationService.add_message(db, conversation_id, "user", "first")
+            current = await ConversationService.add_message(db, conversation_id, "user", "second")
+            await ConversationService.get_history_window(db, conversation_id)
+            history = await ConversationService.get_history_window(db, conversation_id, before_id=current.id)
+            return contents(history)
+
+    assert run(main()) == [("user", "first")]
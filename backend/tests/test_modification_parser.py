@@ -0,0 +1,87 @@
+import pytest
+
+from app.core.modification_parser import CodeModificationParser, parse_code_modifications
+
+RESPONSE = (
+    "**Implementation:**\n"
+    "[File to Modify]: app/orders.py\n"
+    "[Modification Type]: MODIFY\n"
+    "\n"
+    "def list_orders(page, size):\n"
+    "    return query(page, size)\n"
+    "\n"
+    "[File to Modify]: docs/orders.md\n"
+    "[Modification Type]: ADD\n"
+    "\n"
+    "```markdown\n"
+    "## Summary\n"
+    "Orders are paginated.\n"
+    "```\n"
+    "\n"
+    "**Security Review:** validate the page size\n"
+)
+
+EXPECTED = [
+    {
+        "file_path": "app/orders.py",
+        "modification_type": "MODIFY",
+        "content": "def list_orders(page, size):\n    return query(page, size)",
+    },
+    {
+        "file_path": "docs/orders.md",
+        "modification_type": "ADD",
+        "content": "```markdown\n## Summary\nOrders are paginated.\n```",
+    },
+]
+
+
+def test_parse_complete_response():
+    """代码围栏内的标题属于代码；围栏之外的段落标题结束当前块"""
+    assert parse_code_modifications(RESPONSE) == EXPECTED
+
+
+def test_fenced_blocks_end_at_section_heading():
+    """整个块位于代码围栏内时（见 Code Modification Protocol），围栏闭合后的段落标题结束该块"""
+    modifications = parse_code_modifications(
+        "```\n[File to Modify]: a.py\n[Modification Type]: ADD\n\nx = 1\n```\n\n**Next Steps:** deploy\n"
+    )
+
+    assert [modification["file_path"] for modification in modifications] == ["a.py"]
+    assert "x = 1" in modifications[0]["content"]
+    assert "deploy" not in modifications[0]["content"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 16, 17, 64])
+def test_incremental_matches_complete_parse(chunk_size):
+    """任意切分的流式输入与一次性解析结果一致，每个块在结束时立即返回"""
+    parser = CodeModificationParser()
+    emitted = []
+    for start in range(0, len(RESPONSE), chunk_size):
+        emitted.extend(parser.feed(RESPONSE[start:start + chunk_size]))
+    assert emitted == EXPECTED
+    assert parser.close() == []
+    assert parser.modifications == EXPECTED
+
+
+def test_block_emitted_when_next_marker_arrives():
+    parser = CodeModificationParser()
+
+    assert parser.feed("[File to Modify]: a.py\n[Modification Type]: ADD\nx = 1\n") == []
+    assert parser.feed("[File to Modify]: b.py\n") == [
+        {"file_path": "a.py", "modification_type": "ADD", "content": "x = 1"}
+    ]
+    assert parser.feed("[Modification Type]: DELETE\n") == []
+    assert parser.close() == [{"file_path": "b.py", "modification_type": "DELETE", "content": ""}]
+
+
+def test_incomplete_header_and_text_without_blocks():
+    assert parse_code_modifications("no modifications here") == []
+    assert parse_code_modifications("[File to Modify]: a.py\n[Modification Type]:") == []
+
+
+def test_feed_after_close_raises():
+    parser = CodeModificationParser()
+    parser.close()
+
+    with pytest.raises(ValueError):
+        parser.feed("text")
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.rate_limiter import RateLimiter, RequestPriority, TokenBucket, parse_retry_after
+
+
+def test_reconcile_returns_overestimated_tokens():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    limiter.tokens.level = 500
+
+    limiter.reconcile(estimated_tokens=300, actual_tokens=100)
+
+    assert limiter.tokens.level == 700
+
+
+def test_headers_take_precedence_over_reconcile():
+    """响应头同步了token余量时不再按实际用量修正（否则同一次调用被计两次）"""
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    limiter.tokens.level = 500
+
+    assert limiter.update_from_headers({
+        "x-ratelimit-limit-tokens": "1000",
+        "x-ratelimit-remaining-tokens": "400",
+        "x-ratelimit-remaining-requests": "50",
+    })
+    assert limiter.tokens.level == 400
+    assert limiter.requests.level == 50
+
+
+def test_headers_without_token_remaining_do_not_sync():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+
+    assert not limiter.update_from_headers(None)
+    assert not limiter.update_from_headers({"x-ratelimit-remaining-requests": "10"})
+    assert limiter.requests.level == 10
+
+
+def test_token_bucket_refills_per_second():
+    bucket = TokenBucket(per_minute=600)
+    bucket.level = 0
+    bucket.updated_at = 100.0
+
+    bucket.refill(101.5)
+    assert bucket.level == 15
+    assert bucket.time_until(25) == 1.0
+
+    bucket.refill(1000.0)
+    assert bucket.level == bucket.capacity
+
+
+def test_acquire_consumes_budget_and_caps_oversized_requests():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+
+    asyncio.run(limiter.acquire(5000))
+
+    assert limiter.tokens.level < 1
+    assert limiter.requests.level == pytest.approx(59, abs=0.01)
+
+
+def test_queued_requests_are_served_by_priority():
+    """额度不足时排队；额度恢复后交互式请求先于后台和批量请求"""
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=60000)
+    order = []
+
+    async def request(name, priority):
+        await limiter.acquire(50, priority)
+        order.append(name)
+
+    async def main():
+        limiter.tokens.level = 0
+        tasks = [asyncio.create_task(request("batch", RequestPriority.BATCH))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("background", RequestPriority.BACKGROUND)))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("interactive", RequestPriority.INTERACTIVE)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["interactive", "background", "batch"]
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=60)
+
+    async def main():
+        limiter.tokens.level = 0
+        waiter = asyncio.create_task(limiter.acquire(30))
+        await asyncio.sleep(0.01)
+        queued = limiter.queue_length
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return queued
+
+    assert asyncio.run(main()) == 1
+    assert limiter.queue_length == 0
+
+
+def test_penalize_blocks_until_retry_after():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+
+    limiter.penalize(parse_retry_after({"retry-after-ms": "1500"}))
+
+    assert limiter.tokens.level <= 0
+    assert limiter.blocked_until - time.monotonic() == pytest.approx(1.5, abs=0.1)
+    assert parse_retry_after({"retry-after": "2"}) == 2.0
+    assert parse_retry_after(None) is None
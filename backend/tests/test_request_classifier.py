@@ -0,0 +1,66 @@
+import pytest
+
+from app.core.request_classifier import classify_request, needs_clarification, strip_clarification_marker
+from app.models.schemas import WorkflowRoute
+
+
+@pytest.mark.parametrize("analysis", [
+    "**Requirement Analysis:**\nAdd login.\n\n**Clarification Needed:**\nThe requirements are clear; no questions.\n\nCLARIFICATION_REQUIRED: NO",
+    "**Clarification Needed:**\nNot required.\n\nCLARIFICATION_REQUIRED: NO",
+    "**Clarification Needed:**\n\n**Assumptions:**\nUse SQLite.\n\nCLARIFICATION_REQUIRED: NO",
+    "**Clarification Needed:** None\n\n**CLARIFICATION_REQUIRED: NO**",
+    # 缺少标记时不转入 clarify 路径
+    "**Clarification Needed:**\nThe requirements are clear; no questions.",
+    "## Clarification Needed (if any):\n- What DB?",
+])
+def test_no_clarification(analysis):
+    assert not needs_clarification(analysis)
+
+
+@pytest.mark.parametrize("analysis", [
+    "## Clarification Needed (if any):\n- What DB?\n- Which auth provider?\n\nCLARIFICATION_REQUIRED: YES",
+    "**Clarification Needed:**\n1. Which framework?\n\n`CLARIFICATION_REQUIRED: YES`",
+    "**Clarification Needed:**\nclarification_required: yes",
+    # 以最后一个标记为准
+    "CLARIFICATION_REQUIRED: NO\n\n**Clarification Needed:**\n- What DB?\nCLARIFICATION_REQUIRED: YES",
+])
+def test_clarification_required(analysis):
+    assert needs_clarification(analysis)
+
+
+def test_marker_only_matches_whole_line():
+    assert not needs_clarification("Reply with CLARIFICATION_REQUIRED: YES if anything is unclear.")
+
+
+def test_strip_marker():
+    analysis = "**Clarification Needed:**\n- What DB?\n\nCLARIFICATION_REQUIRED: YES\n"
+    assert strip_clarification_marker(analysis) == "**Clarification Needed:**\n- What DB?"
+
+
+ASSISTANT_TURN = [
+    {"role": "user", "content": "Add rate limiting to the upload endpoint"},
+    {"role": "assistant", "content": "Proposed Workflow: 1. add a token bucket ..."},
+]
+
+
+@pytest.mark.parametrize("message", ["ok", "do it", "yes", "Okay!", "好的", "go ahead"])
+def test_confirmation_after_assistant_turn_runs_workflow(message):
+    assert classify_request(message, ASSISTANT_TURN) == WorkflowRoute.FULL
+
+
+@pytest.mark.parametrize("message", ["ok", "yes", "hello", "谢谢"])
+def test_trivial_message_without_assistant_turn_is_answered(message):
+    assert classify_request(message, []) == WorkflowRoute.ANSWER
+
+
+def test_greeting_is_answered_after_assistant_turn():
+    assert classify_request("thanks!", ASSISTANT_TURN) == WorkflowRoute.ANSWER
+
+
+@pytest.mark.parametrize("message", ["do it now", "does this need a migration step first", "do the same for orders"])
+def test_do_is_not_a_question_prefix(message):
+    assert classify_request(message) != WorkflowRoute.ANSWER
+
+
+def test_short_question_is_answered():
+    assert classify_request("what does the RAG service return?", ASSISTANT_TURN) == WorkflowRoute.ANSWER
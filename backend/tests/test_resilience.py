@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from app.services import resilience
+from app.services.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, LLMMetrics, hedged_call
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.snapshot()["rejected_count"] == 1
+
+
+def test_half_open_allows_a_single_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+
+    assert breaker.available()
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=10)
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 10
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock[0]
+    assert breaker.snapshot()["opened_count"] == 2
+
+
+def test_released_probe_can_be_retried(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.before_call()
+
+    breaker.release()
+
+    assert breaker.available()
+    breaker.before_call()
+
+
+def test_latency_percentiles():
+    tracker = LatencyTracker(window=4)
+    assert tracker.mean() is None
+    for seconds in (5.0, 1.0, 2.0, 3.0, 4.0):
+        tracker.add(seconds)
+
+    assert tracker.mean() == 2.5
+    assert tracker.percentile(0.5) == 3.0
+    assert tracker.percentile(0.99) == 4.0
+
+
+def test_hedged_call_returns_first_success():
+    """主请求超过对冲延迟仍未完成时发出对冲请求，取先完成的结果并取消另一个"""
+    metrics = LLMMetrics()
+    delays = iter([1.0, 0.0])
+    started = []
+
+    async def factory():
+        delay = next(delays)
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert asyncio.run(hedged_call(factory, hedge_delay=0.01, metrics=metrics)) == 0.0
+    assert started == [1.0, 0.0]
+    assert (metrics.hedges_sent, metrics.hedge_wins) == (1, 1)
+
+
+def test_hedged_call_raises_when_all_attempts_fail():
+    async def factory():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("deployment down")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hedged_call(factory, hedge_delay=0.01))
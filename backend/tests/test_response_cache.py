@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from app.services import response_cache
+from app.services.response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return ResponseCache(str(tmp_path / "responses.db"), ttl_seconds=60, max_entries=2, semantic_threshold=0.95)
+
+
+def prompt(query: str):
+    return [("system", "system prompt"), ("user", f"Phase: requirement\n\nUser Input: {query}")]
+
+
+def test_make_keys_scopes_semantic_matching_to_query():
+    """同一阶段模板下不同的用户输入共享上下文key；精确key不同"""
+    exact_a, context_a = ResponseCache.make_keys("gpt", prompt("add paging"), query="add paging")
+    exact_b, context_b = ResponseCache.make_keys("gpt", prompt("add sorting"), query="add sorting")
+    _, other_context = ResponseCache.make_keys("gpt-mini", prompt("add paging"), query="add paging")
+
+    assert context_a == context_b
+    assert exact_a != exact_b
+    assert other_context != context_a
+    assert ResponseCache.make_keys("gpt", prompt("add paging"), query="add paging")[0] == exact_a
+
+
+def test_exact_hit_and_ttl_expiry(cache, clock):
+    async def main():
+        await cache.set("key", "context", {"content": "cached"})
+        hit = await cache.get("key")
+        clock.now += 61
+        expired = await cache.get("key")
+        return hit, expired
+
+    hit, expired = asyncio.run(main())
+    assert hit == {"content": "cached"}
+    assert expired is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_evicts_least_recently_used(cache, clock):
+    async def main():
+        for key in ("a", "b"):
+            await cache.set(key, "context", {"content": key})
+            clock.now += 1
+        await cache.get("a")
+        clock.now += 1
+        await cache.set("c", "context", {"content": "c"})
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(main()) == [{"content": "a"}, None, {"content": "c"}]
+
+
+def test_semantic_match_within_context(cache):
+    async def main():
+        await cache.set("a", "context", {"content": "paging"}, embedding=[1.0, 0.0])
+        return (
+            await cache.get_semantic("context", [0.99, 0.05]),
+            await cache.get_semantic("context", [0.5, 0.5]),
+            await cache.get_semantic("other", [1.0, 0.0]),
+        )
+
+    similar, dissimilar, other_context = asyncio.run(main())
+    assert similar == {"content": "paging"}
+    assert dissimilar is None
+    assert other_context is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_semantic_match_ignores_expired_entries(cache, clock):
+    async def main():
+        await cache.set("a", "context", {"content": "paging"}, embedding=[1.0, 0.0])
+        clock.now += 61
+        return await cache.get_semantic("context", [1.0, 0.0])
+
+    assert asyncio.run(main()) is None
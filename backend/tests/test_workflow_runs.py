@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+from typing import Any, Dict, List, Set
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import chat
+from app.core.langgraph_workflow import LangGraphWorkflow
+from app.models.database import AsyncSessionLocal, Project, engine, init_db
+from app.models.schemas import ChatRequest, WorkflowPhase
+from app.services.checkpoint_service import CheckpointService
+
+project_names = (f"runs-{index}" for index in itertools.count())
+
+BUILD_REQUEST = "build a new payment service with database"
+
+
+class PhaseLLMService:
+    """替身 LLMService：按阶段返回固定输出，记录调用的阶段与是否使用响应缓存；fail 中的阶段调用失败"""
+
+    def __init__(self):
+        self.phases: List[str] = []
+        self.use_cache: List[bool] = []
+        self.fail: Set[str] = set()
+
+    async def generate_response(self, system_prompt, user_message, conversation_history=None,
+                                phase=None, use_cache=True, **kwargs) -> Dict[str, Any]:
+        self.phases.append(phase)
+        self.use_cache.append(use_cache)
+        if phase in self.fail:
+            return {"success": False, "error": f"{phase} failed", "content": ""}
+        return {"success": True, "content": f"{phase} output\n\nCLARIFICATION_REQUIRED: NO"}
+
+    async def stream_response(self, system_prompt, user_message, conversation_history=None,
+                              on_token=None, phase=None, **kwargs) -> Dict[str, Any]:
+        result = await self.generate_response(system_prompt, user_message, conversation_history, phase, **kwargs)
+        if on_token:
+            await on_token(result["content"])
+        return result
+
+
+class NoRAGService:
+    async def retrieve_context(self, **kwargs):
+        return []
+
+
+def run(coro):
+    async def main():
+        try:
+            await init_db()
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def workflow():
+    return LangGraphWorkflow(llm_service=PhaseLLMService(), rag_service=NoRAGService())
+
+
+async def send(workflow, message: str):
+    async with AsyncSessionLocal() as db:
+        project = Project(name=next(project_names))
+        db.add(project)
+        await db.commit()
+        return await chat.send_message(
+            ChatRequest(message=message, project_id=project.id),
+            db=db, langgraph_workflow=workflow, rag_service=workflow.rag_service
+        )
+
+
+def test_regenerate_rejects_phase_not_on_route(workflow):
+    """直接回答的运行不能从需求阶段重新生成（否则会重新走回直接回答）"""
+    async def main():
+        response = await send(workflow, "hello")
+        workflow.llm_service.phases.clear()
+        async with AsyncSessionLocal() as db:
+            with pytest.raises(HTTPException) as error:
+                await chat.regenerate_run(response.run_id, WorkflowPhase.REQUIREMENT,
+                                          db=db, langgraph_workflow=workflow)
+            regenerated = await chat.regenerate_run(response.run_id, WorkflowPhase.ANSWER,
+                                                    db=db, langgraph_workflow=workflow)
+            workflow_run = await CheckpointService.get_run(db, response.run_id)
+            return response, error.value, regenerated, workflow_run.status
+
+    response, error, regenerated, status = run(main())
+    assert response.workflow_state.route == "answer"
+    assert error.status_code == 400
+    assert regenerated.message_id == response.message_id
+    assert workflow.llm_service.phases == ["answer"]
+    assert status == "completed"
+
+
+def test_resume_reruns_only_failed_phase_and_downstream(workflow):
+    """续跑只执行失败的阶段及其下游，已完成阶段复用检查点，助手消息原地更新"""
+    llm_service = workflow.llm_service
+
+    async def main():
+        llm_service.fail = {"implementation"}
+        response = await send(workflow, BUILD_REQUEST)
+        async with AsyncSessionLocal() as db:
+            failed = await CheckpointService.get_run(db, response.run_id)
+            failed_status = failed.status
+        llm_service.fail.clear()
+        llm_service.phases.clear()
+        async with AsyncSessionLocal() as db:
+            resumed = await chat.resume_run(response.run_id, db=db, langgraph_workflow=workflow)
+            workflow_run = await CheckpointService.get_run(db, response.run_id)
+            with pytest.raises(HTTPException) as error:
+                await chat.resume_run(response.run_id, db=db, langgraph_workflow=workflow)
+            return response, failed_status, resumed, workflow_run.status, error.value
+
+    response, failed_status, resumed, status, error = run(main())
+    assert response.workflow_state.route == "full"
+    assert failed_status == "failed"
+    assert sorted(llm_service.phases) == ["implementation", "security_review"]
+    assert resumed.message_id == response.message_id
+    assert status == "completed"
+    assert error.status_code == 400
+
+
+def test_regenerate_reruns_phase_and_downstream_without_cache(workflow):
+    """重新生成从指定阶段起重新执行（不使用响应缓存），上游阶段复用检查点"""
+    llm_service = workflow.llm_service
+
+    async def main():
+        response = await send(workflow, BUILD_REQUEST)
+        llm_service.phases.clear()
+        llm_service.use_cache.clear()
+        async with AsyncSessionLocal() as db:
+            regenerated = await chat.regenerate_run(response.run_id, WorkflowPhase.ARCHITECTURE,
+                                                    db=db, langgraph_workflow=workflow)
+        return response, regenerated
+
+    response, regenerated = run(main())
+    assert sorted(llm_service.phases) == ["architecture", "implementation", "rag_planning", "security_review"]
+    assert not any(llm_service.use_cache)
+    assert regenerated.message_id == response.message_id
+    assert regenerated.run_id == response.run_id
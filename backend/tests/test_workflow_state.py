@@ -0,0 +1,155 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from app.config import settings
+from app.core.langgraph_workflow import LangGraphWorkflow
+from app.core.context_policy import ContextPolicy, phase_policy
+from app.utils.tokens import count_tokens
+
+HISTORY = [
+    {"role": "user" if idx % 2 == 0 else "assistant", "content": f"turn {idx}: add pagination to the orders endpoint"}
+    for idx in range(6)
+]
+USER_INPUT = "build a new payment service with database"
+
+IMPLEMENTATION = (
+    "**Implementation:**\n"
+    "[File to Modify]: app/payments.py\n"
+    "[Modification Type]: ADD\n\n"
+    "def charge(amount):\n    return amount\n"
+)
+COLLAPSED = (
+    "**Summary:** payment service\n\n"
+    "**Analysis:** one module\n\n"
+    f"{IMPLEMENTATION}\n"
+    "**Security Review:** none\n"
+)
+
+
+@pytest.fixture(params=["default", "full"], autouse=True)
+def context_policies(request, monkeypatch):
+    """默认策略下各阶段携带的历史不同；全部设为 full 时，任何节点间的历史累积都会体现在后续阶段的提示词中"""
+    if request.param == "full":
+        monkeypatch.setattr(settings, "WORKFLOW_CONTEXT_POLICIES", {
+            phase: ContextPolicy.FULL.value for phase in settings.WORKFLOW_CONTEXT_POLICIES
+        })
+    return request.param
+
+
+class RecordingLLMService:
+    """替身 LLMService：记录每个阶段收到的对话历史条数与提示词token数"""
+
+    def __init__(self):
+        self.calls: Dict[str, List[Dict[str, int]]] = {}
+
+    def _record(self, phase: str, system_prompt: str, user_message: str,
+                conversation_history: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        history = conversation_history or []
+        self.calls.setdefault(phase, []).append({
+            "history_messages": len(history),
+            "prompt_tokens": count_tokens(system_prompt)
+            + count_tokens(user_message)
+            + sum(count_tokens(message["content"]) for message in history),
+        })
+        if phase == "collapsed":
+            content = COLLAPSED
+        elif phase == "implementation":
+            content = IMPLEMENTATION
+        else:
+            content = f"{phase} output\n\nCLARIFICATION_REQUIRED: NO"
+        return {"success": True, "content": content}
+
+    async def generate_response(self, system_prompt, user_message, conversation_history=None,
+                                phase=None, **kwargs) -> Dict[str, Any]:
+        return self._record(phase, system_prompt, user_message, conversation_history)
+
+    async def stream_response(self, system_prompt, user_message, conversation_history=None,
+                              on_token=None, phase=None, **kwargs) -> Dict[str, Any]:
+        result = self._record(phase, system_prompt, user_message, conversation_history)
+        if on_token:
+            await on_token(result["content"])
+        return result
+
+
+class NoRAGService:
+    async def retrieve_context(self, **kwargs):
+        return []
+
+
+def run_workflow(mode: str, history: List[Dict[str, str]], runs: int = 1):
+    llm_service = RecordingLLMService()
+    workflow = LangGraphWorkflow(llm_service=llm_service, rag_service=NoRAGService())
+
+    async def main():
+        results = []
+        for _ in range(runs):
+            results.append(await workflow.run(
+                user_input=USER_INPUT,
+                system_prompt="system prompt",
+                conversation_history=history,
+                mode=mode,
+            ))
+        return results
+
+    return asyncio.run(main()), llm_service.calls
+
+
+@pytest.mark.parametrize("mode, phases", [
+    ("staged", {"requirement", "architecture", "rag_planning", "implementation", "security_review"}),
+    ("collapsed", {"collapsed"}),
+])
+def test_history_is_not_duplicated_across_phases(mode, phases):
+    results, calls = run_workflow(mode, HISTORY)
+
+    assert results[0]["success"] and not results[0]["phase_errors"]
+    assert set(calls) == phases
+    for phase, phase_calls in calls.items():
+        assert len(phase_calls) == 1
+        history_messages = phase_calls[0]["history_messages"]
+        policy = phase_policy(phase)
+        if policy == ContextPolicy.NONE:
+            assert history_messages == 0
+        elif policy == ContextPolicy.FULL:
+            assert history_messages == len(HISTORY)
+        else:
+            assert history_messages <= len(HISTORY)
+
+
+@pytest.mark.parametrize("mode", ["staged", "collapsed"])
+def test_prompt_tokens_per_phase_are_stable(mode):
+    """同一输入重复运行时各阶段的历史条数与提示词token数保持不变（状态不在节点或运行之间累积）"""
+    _, calls = run_workflow(mode, HISTORY, runs=3)
+
+    for phase, phase_calls in calls.items():
+        assert len(phase_calls) == 3
+        assert all(call == phase_calls[0] for call in phase_calls), phase
+
+
+@pytest.mark.parametrize("mode", ["staged", "collapsed"])
+def test_prompt_tokens_grow_linearly_with_history(mode):
+    """历史增加一条消息时，携带完整历史的阶段的提示词只增加这一条消息的token数"""
+    extra = {"role": "user", "content": "also add an index on created_at"}
+    _, short_calls = run_workflow(mode, HISTORY)
+    _, long_calls = run_workflow(mode, HISTORY + [extra])
+
+    for phase in short_calls:
+        if phase_policy(phase) != ContextPolicy.FULL:
+            continue
+        short, long = short_calls[phase][0], long_calls[phase][0]
+        assert long["history_messages"] == short["history_messages"] + 1
+        assert long["prompt_tokens"] == short["prompt_tokens"] + count_tokens(extra["content"])
+
+
+def test_collapsed_modifications_end_at_next_section(context_policies):
+    """单次回答中代码修改块之后的 Security Review 段落不属于代码"""
+    if context_policies != "default":
+        pytest.skip("与上下文策略无关")
+    results, _ = run_workflow("collapsed", HISTORY)
+
+    assert results[0]["code_modifications"] == [{
+        "file_path": "app/payments.py",
+        "modification_type": "ADD",
+        "content": "def charge(amount):\n    return amount",
+    }]
@@ -0,0 +1,353 @@
+"""
+本地 Azure OpenAI 兼容替身服务（用于压测与延迟测试，不消耗真实配额）
+
+实现 AzureChatOpenAI / AzureOpenAIEmbeddings 调用的接口：
+- POST /openai/deployments/{deployment}/chat/completions  （支持 stream=true）
+- POST /openai/deployments/{deployment}/embeddings        （支持 float / base64）
+
+返回内容由请求内容决定（相同输入得到相同输出），嵌入维度可配置（默认3072）。
+可配置首token延迟分布、输出token速率、错误/429注入以及模拟的 RPM/TPM 配额，
+并按消息前缀模拟提示词缓存（usage.prompt_tokens_details.cached_tokens）。
+
+用法（在 backend 目录下）:
+    python -m tools.azure_openai_stub --port 8100 --latency lognormal:-0.7,0.5 --tokens-per-second 60
+然后在 .env 中设置 AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8100/
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import struct
+import time
+import uuid
+
+WORDS = (
+    "the service module handles request validation and returns a structured response "
+    "using async database sessions with dependency injection for configuration and "
+    "logging while keeping business logic isolated from transport concerns"
+).split()
+
+class StubConfig:
+    """替身服务配置"""
+
+    def __init__(self,
+                 latency: str = "fixed:0",
+                 tokens_per_second: float = 0.0,
+                 completion_tokens: int = 200,
+                 embedding_dim: int = 3072,
+                 embedding_latency: str = "fixed:0",
+                 error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0,
+                 retry_after_ms: int = 1000,
+                 rpm: int = 0,
+                 tpm: int = 0,
+                 seed: Optional[int] = None):
+        self.latency = parse_distribution(latency)
+        self.embedding_latency = parse_distribution(embedding_latency)
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.embedding_dim = embedding_dim
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rng = random.Random(seed)
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """解析延迟分布（秒）: fixed:S | uniform:LO,HI | normal:MU,SIGMA | lognormal:MU,SIGMA | exp:MEAN"""
+    kind, _, args = spec.partition(":")
+    params = [float(x) for x in args.split(",")] if args else []
+
+    if kind == "fixed":
+        return lambda rng: params[0] if params else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / params[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def estimate_tokens(value: Any) -> int:
+    """粗略估算token数（约4字符/token；token数组按长度计算）"""
+    if isinstance(value, str):
+        return max(1, len(value) // 4)
+    if isinstance(value, list):
+        if value and isinstance(value[0], int):
+            return len(value)
+        return sum(estimate_tokens(v) for v in value)
+    if isinstance(value, dict):
+        return estimate_tokens(value.get("content") or "")
+    return 0
+
+def deterministic_text(seed: bytes, n_tokens: int) -> List[str]:
+    """根据种子生成确定性的token序列"""
+    rng = random.Random(hashlib.sha256(seed).digest())
+    digest = hashlib.sha256(seed).hexdigest()[:8]
+    tokens = ["Stub", " response", f" {digest}:"]
+    while len(tokens) < n_tokens:
+        tokens.append(" " + rng.choice(WORDS))
+    return tokens[:max(n_tokens, 1)]
+
+def deterministic_vector(seed: bytes, dim: int) -> List[float]:
+    """根据种子生成确定性的单位向量"""
+    rng = random.Random(hashlib.sha256(seed).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+class QuotaWindow:
+    """按分钟固定窗口模拟部署的 RPM/TPM 配额"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = 0
+        self.requests = 0
+        self.tokens = 0
+
+    def consume(self, tokens: int) -> Tuple[bool, Dict[str, str]]:
+        window = int(time.time() // 60)
+        if window != self.window:
+            self.window, self.requests, self.tokens = window, 0, 0
+
+        allowed = (not self.rpm or self.requests < self.rpm) and (not self.tpm or self.tokens + tokens <= self.tpm)
+        if allowed:
+            self.requests += 1
+            self.tokens += tokens
+
+        headers = {}
+        if self.rpm:
+            headers["x-ratelimit-limit-requests"] = str(self.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(max(0, self.rpm - self.requests))
+        if self.tpm:
+            headers["x-ratelimit-limit-tokens"] = str(self.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(max(0, self.tpm - self.tokens))
+        return allowed, headers
+
+class PrefixCache:
+    """模拟服务端提示词缓存：按消息粒度记录见过的前缀，
+    命中长度 ≥1024 tokens 时按128 tokens向下取整报告 cached_tokens"""
+
+    MIN_TOKENS = 1024
+    INCREMENT = 128
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.seen: "OrderedDict[str, None]" = OrderedDict()
+
+    def lookup_and_store(self, deployment: str, messages: List[Any]) -> int:
+        digest = hashlib.sha256(deployment.encode("utf-8"))
+        prefix_tokens = 0
+        cached = 0
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+            prefix_tokens += estimate_tokens(message)
+            key = digest.hexdigest()
+            if key in self.seen:
+                self.seen.move_to_end(key)
+                cached = prefix_tokens
+            else:
+                self.seen[key] = None
+        while len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+        if cached < self.MIN_TOKENS:
+            return 0
+        return cached - cached % self.INCREMENT
+
+def create_app(config: StubConfig) -> FastAPI:
+    """创建替身服务应用"""
+    app = FastAPI(title="Azure OpenAI Stub")
+    quotas: Dict[str, QuotaWindow] = {}
+    prefix_cache = PrefixCache()
+    stats = {"chat": 0, "embeddings": 0, "errors": 0, "rate_limited": 0,
+             "prompt_tokens": 0, "cached_tokens": 0}
+
+    def check_faults(deployment: str, tokens: int) -> Tuple[Optional[JSONResponse], Dict[str, str]]:
+        """按配置注入错误/429，并计算配额响应头"""
+        quota = quotas.setdefault(deployment, QuotaWindow(config.rpm, config.tpm))
+        allowed, headers = quota.consume(tokens)
+
+        if not allowed or config.rng.random() < config.rate_limit_rate:
+            stats["rate_limited"] += 1
+            retry_headers = {
+                **headers,
+                "retry-after-ms": str(config.retry_after_ms),
+                "retry-after": str(max(1, config.retry_after_ms // 1000)),
+            }
+            body = {"error": {"code": "429", "message": "Rate limit exceeded (stub)"}}
+            return JSONResponse(body, status_code=429, headers=retry_headers), headers
+
+        if config.rng.random() < config.error_rate:
+            stats["errors"] += 1
+            body = {"error": {"code": "InternalServerError", "message": "Injected failure (stub)"}}
+            return JSONResponse(body, status_code=500, headers=headers), headers
+
+        return None, headers
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        stats["chat"] += 1
+
+        messages = body.get("messages", [])
+        prompt_tokens = estimate_tokens(messages)
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or config.completion_tokens
+        n_tokens = min(config.completion_tokens, max_tokens)
+
+        error, headers = check_faults(deployment, prompt_tokens + n_tokens)
+        if error:
+            return error
+
+        seed = json.dumps([deployment, messages], sort_keys=True).encode("utf-8")
+        tokens = deterministic_text(seed, n_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        cached_tokens = min(prefix_cache.lookup_and_store(deployment, messages), prompt_tokens)
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+        await asyncio.sleep(config.latency(config.rng))
+
+        if not body.get("stream"):
+            if config.tokens_per_second > 0:
+                await asyncio.sleep(len(tokens) / config.tokens_per_second)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": deployment,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }, headers=headers)
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def event_stream():
+            def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": deployment,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(data)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                if config.tokens_per_second > 0:
+                    await asyncio.sleep(1.0 / config.tokens_per_second)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            if include_usage:
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": deployment,
+                    "choices": [],
+                    "usage": usage,
+                }
+                yield f"data: {json.dumps(data)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def embeddings(deployment: str, request: Request):
+        body = await request.json()
+        stats["embeddings"] += 1
+
+        inputs = body.get("input", [])
+        # 单条输入可以是字符串或token数组
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        total_tokens = sum(estimate_tokens(item) for item in inputs)
+        error, headers = check_faults(deployment, total_tokens)
+        if error:
+            return error
+
+        await asyncio.sleep(config.embedding_latency(config.rng))
+
+        dim = body.get("dimensions") or config.embedding_dim
+        use_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for idx, item in enumerate(inputs):
+            vector = deterministic_vector(json.dumps([deployment, item]).encode("utf-8"), dim)
+            if use_base64:
+                embedding: Any = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii")
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": idx, "embedding": embedding})
+
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": deployment,
+            "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens},
+        }, headers=headers)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Azure OpenAI compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="首token延迟分布（秒）: fixed:S | uniform:LO,HI | normal:MU,SIGMA | lognormal:MU,SIGMA | exp:MEAN")
+    parser.add_argument("--embedding-latency", default="fixed:0", help="嵌入请求延迟分布（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="输出token速率，0表示不限速")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="每次回复的token数")
+    parser.add_argument("--embedding-dim", type=int, default=3072)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入500错误的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="注入429的概率")
+    parser.add_argument("--retry-after-ms", type=int, default=1000)
+    parser.add_argument("--rpm", type=int, default=0, help="模拟每个部署的RPM配额，0表示不限制")
+    parser.add_argument("--tpm", type=int, default=0, help="模拟每个部署的TPM配额，0表示不限制")
+    parser.add_argument("--seed", type=int, default=None, help="故障注入与延迟采样的随机种子")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        embedding_dim=args.embedding_dim,
+        embedding_latency=args.embedding_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after_ms=args.retry_after_ms,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        seed=args.seed,
+    )
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
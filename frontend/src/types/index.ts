@@ -2,6 +2,7 @@ export interface Project {
   id: number;
   name: string;
   description?: string;
+  workflow_mode?: WorkflowMode | null;
   created_at: string;
   updated_at: string;
 }
@@ -65,6 +66,7 @@ export interface ChatResponse {
     active_personas: string[];
     phase_outputs?: Record<string, any>;
     security_flags?: string[];
+    route?: 'answer' | 'lite' | 'full' | 'clarify' | 'collapsed';
   };
   code_modifications?: CodeModification[];
   suggestions?: string[];
@@ -73,4 +75,7 @@ export interface ChatResponse {
 export interface ProjectCreate {
   name: string;
   description?: string;
+  workflow_mode?: WorkflowMode;
 }
+
+export type WorkflowMode = 'staged' | 'collapsed';